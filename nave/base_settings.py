@@ -197,6 +197,7 @@ MIDDLEWARE = (
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.contrib.admindocs.middleware.XViewMiddleware',
     'nave.common.middleware.FallBackLanguageMiddleware',
+    'nave.common.middleware.GraphCacheMiddleware',
 )
 
 AUTHENTICATION_BACKENDS = (
@@ -518,6 +519,51 @@ SAVE_POST_HOOKS = []
 
 ES_ACTION_SIZE = 500
 
+# pages beyond the result window are requested with search_after, the sort values of deep pages
+# are stored in the SEARCH_PAGING_CACHE
+SEARCH_MAX_RESULT_WINDOW = 10000
+SEARCH_PAGING_CACHE = 'default'
+SEARCH_PAGING_CACHE_TIMEOUT = 3600
+# number of pages before the requested page that are checked for cached sort values
+SEARCH_AFTER_LOOKBACK = 50
+
+# OAI-PMH harvests page over an elasticsearch point-in-time that is kept alive between requests,
+# set to None to page over the live index. Resumption tokens expire after OAI_PMH_TOKEN_MAX_AGE seconds
+OAI_PMH_PIT_KEEP_ALIVE = "10m"
+OAI_PMH_TOKEN_MAX_AGE = 86400
+# stream the OAI-PMH responses record by record, gzipped when the client accepts it and OAI_PMH_GZIP is set
+OAI_PMH_STREAMING = True
+OAI_PMH_GZIP = False
+
+# harvest_pmh writes rotating files and resume checkpoints to OAI_HARVEST_OUTPUT_DIR
+OAI_HARVEST_OUTPUT_DIR = '/tmp'
+OAI_HARVEST_RECORDS_PER_FILE = 10000
+OAI_HARVEST_WORKERS = 4
+OAI_HARVEST_RETRIES = 5
+OAI_HARVEST_BACKOFF = 1
+OAI_HARVEST_TIMEOUT = 60
+
+# worker processes used by the NarthexBulkLoader, defaults to the number of cores
+NARTHEX_LOADER_WORKERS = None
+
+# number of specs the NarthexBulkLoader loads at the same time
+NARTHEX_LOADER_SPEC_WORKERS = 2
+
+# maximum number of records waiting in each queue of the NarthexBulkLoader pipeline
+NARTHEX_LOADER_QUEUE_SIZE = 500
+
+# memory budget in MB of the per-process cache of parsed record graphs, 0 disables the cache
+RDF_GRAPH_CACHE_MAX_MB = 64
+
+# schemas pre-rendered at index time and served directly by the detail API, e.g. ['api-flat', 'icn', 'v2']
+# only used with RDF_USE_LOCAL_GRAPH, otherwise the detail API renders from the context graph of the store
+RDF_PRERENDER_SCHEMAS = []
+
+# API request logging, entries are bulk indexed by a background thread
+API_LOG_QUEUE_SIZE = 10000
+API_LOG_BATCH_SIZE = 500
+API_LOG_FLUSH_INTERVAL = 5
+
 LEGACY_ORPHAN_CONTROL = False
 
 GEO_STREAMING_RESPONSE = 2500
@@ -526,6 +572,25 @@ RDF_USE_LOCAL_GRAPH = True
 
 RDF_STORE_TRIPLES = False
 
+# keep-alive connection pool shared by all requests to the triple store
+RDF_STORE_POOL_CONNECTIONS = 4
+RDF_STORE_POOL_SIZE = 10
+RDF_STORE_CONNECT_TIMEOUT = 3
+RDF_STORE_READ_TIMEOUT = 10
+RDF_STORE_GZIP = False
+# result format of DESCRIBE and Graph Store requests: 'nt', 'turtle' or 'xml'
+RDF_STORE_GRAPH_FORMAT = 'nt'
+
+# SPARQL updates are sent in batches of at most RDF_STORE_UPDATE_BATCH_BYTES by concurrent workers
+RDF_STORE_UPDATE_BATCH_BYTES = 2 * 1024 * 1024
+RDF_STORE_UPDATE_CONCURRENCY = 4
+RDF_STORE_UPDATE_MAX_RETRIES = 5
+# initial delay in seconds between retries, doubled on every retry
+RDF_STORE_UPDATE_BACKOFF = 1
+RDF_STORE_UPDATE_TIMEOUT = 60
+# failed update batches are stored here for replay_failed_sparql_updates
+RDF_STORE_FAILED_UPDATES_DIR = '/tmp/sparql_failed_updates'
+
 ES_BULK_PROCESSOR = False
 
 RDF_DYNAMIC_CACHE = True
@@ -670,6 +735,24 @@ WEB_RESOURCE_MAX_SIZE = 500
 WEB_RESOURCE_THUMB_SMALL = 220
 WEB_RESOURCE_THUMB_LARGE = 500
 WEB_RESOURCE_USE_RDF_BASE = True
+# derivatives are rendered in a process pool, requests wait WEB_RESOURCE_DERIVATIVE_TIMEOUT seconds before
+# they get the WEB_RESOURCE_PLACEHOLDER_URL or a 202 response when no placeholder is set
+WEB_RESOURCE_DERIVATIVE_WORKERS = None
+WEB_RESOURCE_DERIVATIVE_TIMEOUT = 3
+WEB_RESOURCE_DERIVATIVE_LOCK_TIMEOUT = 120
+WEB_RESOURCE_PLACEHOLDER_URL = None
+# the sources and derivatives of a spec are indexed per process for WEB_RESOURCE_INDEX_TTL seconds,
+# the index_webresources command stores a scan in the optional SQLite WEB_RESOURCE_INDEX_DB
+WEB_RESOURCE_INDEX_TTL = 600
+WEB_RESOURCE_INDEX_DB = None
+# remote digital objects are cached by WEB_RESOURCE_REMOTE_WORKERS threads per process, failed uris are
+# retried after WEB_RESOURCE_REMOTE_BACKOFF seconds, doubled for every next failure
+WEB_RESOURCE_REMOTE_CONNECT_TIMEOUT = 5
+WEB_RESOURCE_REMOTE_READ_TIMEOUT = 30
+WEB_RESOURCE_REMOTE_MAX_SIZE = 50 * 1024 * 1024
+WEB_RESOURCE_REMOTE_WORKERS = 4
+WEB_RESOURCE_REMOTE_BACKOFF = 300
+WEB_RESOURCE_REMOTE_MAX_BACKOFF = 86400
 DEEPZOOM_VIA_HTTPS = False
 
 RESOLVE_WEBRESOURCES_VIA_RDF = False
@@ -679,6 +762,24 @@ LOCAL_RESOLVE_WEBRESOURCES_VIA_MEDIAMANAGER = False
 MEDIAMANAGER_URL = "http://media.delving.org"
 
 ZIPPED_SEARCH_RESULTS_DOWNLOAD_FOLDER = '/tmp/zips'
+# exports of search results scan the index with SEARCH_EXPORT_SLICES parallel scroll slices
+SEARCH_EXPORT_SLICES = 4
+SEARCH_EXPORT_SCROLL_SIZE = 500
+SEARCH_EXPORT_CSV_FIELDS = ['dc_title', 'dc_creator', 'dc_date', 'dc_identifier', 'dc_subject', 'edm_isShownAt',
+                            'edm_object', 'edm_dataProvider']
+# max-age of the cacheable geo outputs (binary point buffers, geobuf and vector tiles)
+GEO_CACHE_MAX_AGE = 3600
+# the clusters of api/geo/clusters/z/x/y.geojson are cached until the index is updated or the timeout expires
+GEO_CLUSTER_CACHE = 'default'
+GEO_CLUSTER_CACHE_TIMEOUT = 600
+GEO_CLUSTER_CELLS_PER_TILE = 8
+# the number of compiled search queries kept per process, 0 disables the memoization
+SEARCH_QUERY_CACHE_SIZE = 1000
+# serialized search responses of anonymous requests are shared through this cache alias, None disables it
+SEARCH_RESULT_CACHE = 'default'
+SEARCH_RESULT_CACHE_TIMEOUT = 300
+SEARCH_RESULT_CACHE_LOCK_TIMEOUT = 10
+SEARCH_RESULT_CACHE_MAX_AGE = 60
 
 
 # ############################
@@ -771,6 +872,9 @@ WATCHMAN_CHECKS = (
     'nave.common.watchman_checks.check_es_status',
     'nave.common.watchman_checks.check_fuseki_status',
     'nave.common.watchman_checks.check_celery_status',
+    'nave.common.watchman_checks.check_graph_cache_status',
+    'nave.common.watchman_checks.check_api_log_status',
+    'nave.common.watchman_checks.check_rdf_store_metrics',
     'nave.common.watchman_checks.nave_version',
     'nave.common.watchman_checks.project_version',
 )
@@ -53,3 +53,18 @@ class FallBackLanguageMiddleware(LocaleMiddleware):
                             )
                         )
                         return HttpResponseRedirect(redirect_uri)
+
+
+class GraphCacheMiddleware:
+    """Activates the per-request layer of the parsed graph cache."""
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        from nave.lod.utils.graph_cache import graph_cache
+        graph_cache.start_request()
+        try:
+            return self.get_response(request)
+        finally:
+            graph_cache.end_request()
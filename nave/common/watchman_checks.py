@@ -153,6 +153,39 @@ def check_fuseki_status():
     }
 
 
+@check
+def check_graph_cache_status():
+    from nave.lod.utils.graph_cache import graph_cache
+    stats = graph_cache.stats()
+    lookups = stats['hits'] + stats['misses']
+    stats['hit_ratio'] = stats['hits'] / lookups if lookups else 0.0
+    stats['ok'] = True
+    return {
+        'graph_cache': stats
+    }
+
+
+@check
+def check_api_log_status():
+    from nave.search.middleware import api_log_queue
+    stats = api_log_queue.stats()
+    stats['ok'] = True
+    return {
+        'api_log': stats
+    }
+
+
+@check
+def check_rdf_store_metrics():
+    from nave.lod.utils.rdfstore import endpoint_metrics
+    return {
+        'rdf_store_metrics': {
+            'ok': True,
+            'endpoints': endpoint_metrics.stats(),
+        }
+    }
+
+
 @check
 def check_celery_status():
     timeout = getattr(settings, 'HEALTHCHECK_CELERY_TIMEOUT', 3)
@@ -0,0 +1,78 @@
+# -*- coding: utf-8 -*-
+"""Fixtures shared by the tests of all apps."""
+import pytest
+
+
+class FakeResponse(object):
+    """A requests.Response with the content, status code and headers given to the FakeSession."""
+
+    def __init__(self, content=b"", status_code=200, headers=None):
+        self.content = content.encode('utf-8') if isinstance(content, str) else content
+        self.status_code = status_code
+        self.headers = headers or {}
+
+    @property
+    def text(self):
+        return self.content.decode('utf-8')
+
+    def iter_content(self, chunk_size=1):
+        for i in range(0, len(self.content), chunk_size):
+            yield self.content[i:i + chunk_size]
+
+    def raise_for_status(self):
+        if self.status_code >= 400:
+            import requests
+            raise requests.HTTPError("HTTP {}".format(self.status_code), response=self)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        return False
+
+
+class FakeSession(object):
+    """A requests.Session that records the requests and answers them without a network.
+
+    Each request is answered by the respond callable when it is set, otherwise with the next
+    queued response or an empty 200 response. Exceptions returned by respond or queued are raised.
+    """
+
+    def __init__(self):
+        self.requests = []
+        self.responses = []
+        self.respond = None
+
+    def add_response(self, content=b"", status_code=200, headers=None):
+        self.responses.append(FakeResponse(content, status_code=status_code, headers=headers))
+
+    def add_error(self, error):
+        self.responses.append(error)
+
+    @staticmethod
+    def response(content=b"", status_code=200, headers=None):
+        return FakeResponse(content, status_code=status_code, headers=headers)
+
+    def request(self, method, url, **kwargs):
+        self.requests.append((method.upper(), url, kwargs))
+        if self.respond is not None:
+            response = self.respond(method.upper(), url, **kwargs)
+        elif self.responses:
+            response = self.responses.pop(0)
+        else:
+            response = FakeResponse()
+        if isinstance(response, Exception):
+            raise response
+        return response
+
+    def get(self, url, **kwargs):
+        return self.request('GET', url, **kwargs)
+
+    def post(self, url, **kwargs):
+        return self.request('POST', url, **kwargs)
+
+
+@pytest.fixture
+def fake_session():
+    """Return a FakeSession, pass it to the code under test or monkeypatch its session getter."""
+    return FakeSession()
@@ -23,13 +23,37 @@ class Command(BaseCommand):
             '--path',
             default="~/NarthexFiles"
         )
+        parser.add_argument(
+            '--workers',
+            type=int,
+            default=None,
+            help='number of worker processes used for parsing the records.'
+        )
+        parser.add_argument(
+            '--spec-workers',
+            type=int,
+            default=None,
+            help='number of specs that are loaded at the same time.'
+        )
+        parser.add_argument(
+            '--force',
+            action='store_true',
+            default=False,
+            help='also reload records whose content hash has not changed.'
+        )
 
     def handle(self, *args, **options):
         index = options['index']
         path = options['path']
         start = datetime.now()
         self.stdout.write('Starting to loading EDM for orgId {}'.format(settings.ORG_ID))
-        loader = NarthexBulkLoader(index=index, narthex_base=path)
+        loader = NarthexBulkLoader(
+            index=index,
+            narthex_base=path,
+            workers=options['workers'],
+            spec_workers=options['spec_workers'],
+            skip_unchanged=not options['force']
+        )
         load_results = loader.walk_all_datasets()
         self.stdout.write("result bulkloading: {}".format(load_results))
         self.stdout.write('Finished to loading EDM for orgId {} in {} seconds.'.format(
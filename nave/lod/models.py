@@ -31,7 +31,7 @@ from nave.lod import namespace_manager, RDF_BASE_URL
 from nave.lod.namespace import NAVE
 from nave.lod.utils import rdfstore
 from nave.lod.utils.resolver import get_cache_url, get_remote_lod_resource, store_remote_cached_resource, get_geo_points, \
-    get_graph_statistics, GraphBindings
+    get_graph_statistics, GraphBindings, bind_namespace
 from nave.lod.utils.resolver import RDFRecord
 
 fmt = '%Y-%m-%d %H:%M:%S%z'  # '%Y-%m-%d %H:%M:%S %Z%z'
@@ -133,7 +133,7 @@ class RDFModel(TimeStampedModel, GroupOwned):
             self.ns = Namespace(namespace_string)
             self.rdf_type_base = Namespace("{}/{}/".format(self.base_uri, self.get_rdf_type().lower()))
             if namespace_string not in settings.RDF_SUPPORTED_NAMESPACES:
-                namespace_manager.bind(self.get_namespace_prefix(), self.ns)
+                bind_namespace(self.get_namespace_prefix(), self.ns)
         self.ns_dict = dict(list(namespace_manager.namespaces()))
         self.graph = None
 
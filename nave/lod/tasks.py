@@ -2,9 +2,6 @@
 """This module contains the tasks for storing RDFmodel
 data into the graphstore.
 """
-import socket
-import time
-from urllib.error import URLError
 
 from celery.task import task
 from celery.utils.log import get_task_logger
@@ -113,33 +110,18 @@ def store_graphs(triples, named_graph, store=None):
 
 
 @task(bind=True, default_retry_delay=300, max_retries=5)
-def process_sparql_updates(sparql_updates, store=None):
+def process_sparql_updates(self, sparql_updates, store=None):
+    """Send the SPARQL updates in batches to the triple store.
+
+    Failed batches are retried by the SparqlUpdateWriter and persisted for replay.
+    """
     if store is None:
         store = rdfstore.get_rdfstore()
-
-    def store_with_updates(update_queries):
-        retries = 0
-        while retries < 3:
-            try:
-                store.update("\n".join(sparql_updates))
-                update_queries.clear()
-                return True
-            except (URLError, socket.timeout) as e:
-                retries += 1
-                logger.error("sparql update timeout with retries {} and error {}".format(retries, e))
-                time.sleep(3)
-        if retries > 2:
-            #   todo: log the items in the db as not synced
-            pass
-        return False
-
-    updates = []
-    for i, update in enumerate(sparql_updates):
-        updates.append(update)
-        if i % 25 == 0:
-            store_with_updates(updates)
-            updates[:] = []
-    store_with_updates(updates)
+    with rdfstore.SparqlUpdateWriter(store=store) as writer:
+        writer.extend(sparql_updates)
+    if writer.stats['failed_batches']:
+        logger.error("Unable to store {} SPARQL updates".format(writer.stats['failed_updates']))
+    return dict(writer.stats)
 
 
 @task()
@@ -6,7 +6,7 @@ from django.test import TestCase
 from rdflib import Graph, URIRef, Literal
 from rdflib.namespace import FOAF, DC
 
-from nave.lod.utils.resolver import RDFPredicate, RDFObject, RDFResource, GraphBindings
+from nave.lod.utils.resolver import RDFPredicate, RDFObject, RDFResource, GraphBindings, GraphIndex
 
 
 test_data = """<?xml version='1.0' encoding='utf-8'?>
@@ -112,6 +112,15 @@ class TestRDFPredicate(TestCase):
         assert predicate.search_label == "dc_title"
         assert predicate.qname == "dc:title"
 
+    def test_predicates_are_interned(self):
+        uri = URIRef('http://purl.org/dc/elements/1.1/title')
+        predicate = RDFPredicate(uri)
+        assert RDFPredicate(uri) is predicate
+        assert RDFPredicate(predicate) is predicate
+        RDFPredicate.clear_registry()
+        assert RDFPredicate(uri) is not predicate
+        assert RDFPredicate(uri) == predicate
+
     @skip
     def test_creation_with_unknown_ns(self):
         uri = 'http://localhost:8000/resource/aggregation/ton-smits-huis/454'
@@ -245,6 +254,26 @@ class TestRDFResource(TestCase):
         ]
 
 
+class TestGraphIndex(TestCase):
+    """Test that the GraphIndex returns the same triples as the Graph."""
+    graph = Graph()
+    graph.parse(data=test_data)
+    index = GraphIndex(graph)
+
+    def test_index_matches_graph(self):
+        assert sorted(self.index.subjects()) == sorted(set(self.graph.subjects()))
+        assert sorted(self.index.predicates()) == sorted(set(self.graph.predicates()))
+        assert sorted(self.index.objects(predicate=DC.subject)) == sorted(self.graph.objects(predicate=DC.subject))
+        mpg = URIRef('http://www.openbeelden.nl/files/01/65/165083.WEEKNUMMER552-HRE0000CF2E.mpg')
+        assert sorted(self.index.predicate_objects(mpg)) == sorted(self.graph.predicate_objects(subject=mpg))
+        assert self.index.languages == {'en', 'nl'}
+
+    def test_preferred_label(self):
+        concept = URIRef('http://data.beeldengeluid.nl/gtaa/155912')
+        assert self.index.preferredLabel(concept) == self.graph.preferredLabel(concept)
+        assert self.index.preferredLabel(URIRef('http://example.com/unknown')) == []
+
+
 class TestGraphBindings(TestCase):
     """ Test the Graph Bindings module. """
 
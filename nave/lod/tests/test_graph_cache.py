@@ -0,0 +1,59 @@
+# -*- coding: utf-8 -*-
+"""This module tests the GraphCache."""
+from rdflib import ConjunctiveGraph, URIRef, Literal
+from rdflib.namespace import RDFS
+
+from nave.lod.utils.graph_cache import GraphCache
+
+
+def create_graph(label="test"):
+    graph = ConjunctiveGraph()
+    graph.add((URIRef("http://localhost:8000/resource/aggregation/test/1"), RDFS.label, Literal(label)))
+    return graph
+
+
+def test__get_graph__returns_independent_copy():
+    cache = GraphCache(max_bytes=1024 * 1024)
+    assert cache.get_graph("test_1", "abc") is None
+    assert cache.set_graph("test_1", "abc", create_graph(), spec="test")
+    graph = cache.get_graph("test_1", "abc")
+    assert len(graph) == 1
+    graph.add((URIRef("http://localhost:8000/resource/aggregation/test/1"), RDFS.comment, Literal("changed")))
+    assert len(cache.get_graph("test_1", "abc")) == 1
+    assert cache.stats()['hits'] == 2
+    assert cache.stats()['misses'] == 1
+
+
+def test__set_graph__evicts_least_recently_used():
+    graph = create_graph()
+    _, size = GraphCache._freeze(graph)
+    cache = GraphCache(max_bytes=size * 2)
+    cache.set_graph("test_1", "abc", graph)
+    cache.set_graph("test_2", "abc", graph)
+    cache.get_graph("test_1", "abc")
+    cache.set_graph("test_3", "abc", graph)
+    assert cache.get_graph("test_2", "abc") is None
+    assert cache.get_graph("test_1", "abc") is not None
+    assert cache.stats()['evictions'] == 1
+
+
+def test__invalidate__removes_record_and_spec():
+    cache = GraphCache(max_bytes=1024 * 1024)
+    cache.set_graph("test_1", "abc", create_graph(), spec="test")
+    cache.set_graph("test_2", "abc", create_graph(), spec="other")
+    cache.invalidate("test_1")
+    assert cache.get_graph("test_1", "abc") is None
+    cache.invalidate_spec("other")
+    assert cache.get_graph("test_2", "abc") is None
+    assert cache.stats()['entries'] == 0
+
+
+def test__request_entries__only_active_during_request():
+    cache = GraphCache(max_bytes=1024 * 1024)
+    cache.set_request_entry("key", "hit")
+    assert cache.get_request_entry("key") is None
+    cache.start_request()
+    cache.set_request_entry("key", "hit")
+    assert cache.get_request_entry("key") == "hit"
+    cache.end_request()
+    assert cache.get_request_entry("key") is None
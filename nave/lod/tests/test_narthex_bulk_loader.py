@@ -0,0 +1,55 @@
+# -*- coding: utf-8 -*-
+"""This module tests the NarthexBulkLoader."""
+from collections import Counter
+
+from nave.lod.utils.narthex_bulk_loader import NarthexBulkLoader
+
+processed_lines = [
+    '<rdf:RDF>\n',
+    '<ore:Aggregation rdf:about="http://localhost:8000/resource/aggregation/test/1"/>\n',
+    '</rdf:RDF>\n',
+    '<!--<http://localhost:8000/resource/aggregation/test/1/graph__abc123>-->\n',
+    '<rdf:RDF>\n',
+    '<ore:Aggregation rdf:about="http://localhost:8000/resource/aggregation/test/2"/>\n',
+    '</rdf:RDF>\n',
+    '<!--<http://localhost:8000/resource/aggregation/test/2/graph__def456>-->\n',
+]
+
+
+def test__is_line_marker__returns_graph_and_hash():
+    exists, named_graph, content_hash = NarthexBulkLoader.is_line_marker(processed_lines[3])
+    assert exists
+    assert named_graph == "http://localhost:8000/resource/aggregation/test/1/graph"
+    assert content_hash == "abc123"
+    assert NarthexBulkLoader.is_line_marker(processed_lines[0]) == (False, None, None)
+
+
+def test__iter_records__splits_on_graph_markers():
+    stats = Counter()
+    records = list(NarthexBulkLoader.iter_records(processed_lines, stats))
+    assert len(records) == 2
+    assert stats['lines'] == len(processed_lines)
+    named_graph, content_hash, triples = records[1]
+    assert named_graph == "http://localhost:8000/resource/aggregation/test/2/graph"
+    assert content_hash == "def456"
+    assert "aggregation/test/2" in triples
+    assert "aggregation/test/1" not in triples
+
+
+def test__create_touch_action__only_updates_modified_at():
+    action = NarthexBulkLoader.create_touch_action("org_test_1", "test_index", "2016-01-01T00:00:00")
+    assert action['_op_type'] == 'update'
+    assert action['_id'] == "org_test_1"
+    assert action['doc'] == {'system': {'modified_at': "2016-01-01T00:00:00"}}
+
+
+def test__bulk_index__invalidates_the_search_caches(monkeypatch):
+    from nave.lod.utils import narthex_bulk_loader
+    from nave.search import result_cache
+
+    monkeypatch.setattr(narthex_bulk_loader, "get_es", lambda: None)
+    monkeypatch.setattr(narthex_bulk_loader.helpers, "bulk", lambda es, actions: (len(actions), []))
+    cache = result_cache.get_result_cache()
+    generations = result_cache.get_generations(cache, ['test'])
+    assert NarthexBulkLoader().bulk_index([{'_id': 'org_test_1'}], 'test')
+    assert result_cache.get_generations(cache, ['test']) != generations
@@ -156,3 +156,65 @@ class TestRDFSTore(TestCase):
         #     response = self.store.get_graph_store.post(data=self.cached_n3, named_graph=cache_graph)
         #     assert response
         #     assert self.store.ask(named_graph=cache_graph)
+
+
+def test__sparql_update_writer__batches_by_size(fake_session):
+    from nave.lod.utils.rdfstore import SparqlUpdateWriter
+    store = RDFStore(db="test", host="http://localhost", port=3030)
+    with SparqlUpdateWriter(store=store, max_batch_bytes=25, concurrency=1, session=fake_session) as writer:
+        for i in range(4):
+            writer.add("DROP GRAPH <urn:{}>;".format(i))
+    assert [kwargs['data']['update'] for method, url, kwargs in fake_session.requests] == \
+        ["DROP GRAPH <urn:{}>;".format(i) for i in range(4)]
+    assert writer.stats['updates'] == 4
+    assert writer.stats['failed_batches'] == 0
+
+
+def test__sparql_update_writer__counts_concurrent_batches(fake_session):
+    from nave.lod.utils.rdfstore import SparqlUpdateWriter
+    store = RDFStore(db="test", host="http://localhost", port=3030)
+    with SparqlUpdateWriter(store=store, max_batch_bytes=25, concurrency=8, session=fake_session) as writer:
+        for i in range(500):
+            writer.add("DROP GRAPH <urn:{}>;".format(i % 10))
+    assert writer.stats['batches'] == 500
+    assert writer.stats['updates'] == 500
+
+
+def test__sparql_update_writer__retries_and_persists_failed_batches(tmpdir, fake_session):
+    from nave.lod.utils.rdfstore import SparqlUpdateWriter
+    for i in range(3):
+        fake_session.add_response(status_code=503)
+    store = RDFStore(db="test", host="http://localhost", port=3030)
+    writer = SparqlUpdateWriter(
+        store=store, concurrency=1, max_retries=2, backoff=0, failed_dir=str(tmpdir), session=fake_session
+    )
+    writer.add("DROP GRAPH <urn:1>;")
+    assert not writer.flush()
+    writer.close()
+    assert len(fake_session.requests) == 3
+    assert writer.stats['retries'] == 2
+    assert len(tmpdir.listdir()) == 1
+
+
+def test__endpoint_metrics__records_latency_per_endpoint():
+    from nave.lod.utils.rdfstore import EndpointMetrics
+    metrics = EndpointMetrics()
+    metrics.record("GET http://localhost:3030/test/sparql", 0.010)
+    metrics.record("GET http://localhost:3030/test/sparql", 0.030, error=True)
+    stats = metrics.stats()["GET http://localhost:3030/test/sparql"]
+    assert stats['requests'] == 2
+    assert stats['errors'] == 1
+    assert round(stats['avg_ms']) == 20
+    assert round(stats['max_ms']) == 30
+
+
+def test__rdfstore_request__metrics_shared_between_graphs(monkeypatch, fake_session):
+    from nave.lod.utils import rdfstore
+    monkeypatch.setattr(rdfstore, "get_http_session", lambda: fake_session)
+    monkeypatch.setattr(rdfstore, "endpoint_metrics", rdfstore.EndpointMetrics())
+    store = RDFStore(db="test", host="http://localhost", port=3030)
+    store.request("get", "http://localhost:3030/test/data?graph=http://localhost/resource/graph/1")
+    store.request("get", "http://localhost:3030/test/data?graph=http://localhost/resource/graph/2")
+    stats = rdfstore.endpoint_metrics.stats()
+    assert list(stats.keys()) == ["GET http://localhost:3030/test/data"]
+    assert stats["GET http://localhost:3030/test/data"]['requests'] == 2
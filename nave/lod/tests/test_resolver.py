@@ -137,3 +137,34 @@ def test__rdfrecord__resolve_webresource_uris():
             graph.objects(predicate=NAVE.thumbnailSmall)
         )
     )
+
+
+def test__rdfrecord__prerendered_documents_round_trip():
+    from rdflib import Graph
+    from nave.lod.utils.resolver import GraphBindings
+    g = Graph()
+    g.parse(data=test_rdf, format="xml")
+    bindings = GraphBindings(
+        about_uri="http://data.jck.nl/resource/aggregation/jhm-museum/M006660",
+        graph=g
+    )
+    rendered = RDFRecord.prerender_documents(bindings, g, schemas=['api-flat'])
+    assert list(rendered.keys()) == ['api-flat']
+    es_record = {'_source': {'system': {'rendered': rendered}}}
+    document = RDFRecord.get_prerendered_document(es_record, 'api-flat')
+    assert 'rdf' in document
+    assert RDFRecord.get_prerendered_document(es_record, 'icn') is None
+
+
+def test__rdfrecord__no_prerendering_without_local_graph(settings):
+    from rdflib import Graph
+    from nave.lod.utils.resolver import GraphBindings
+    settings.RDF_PRERENDER_SCHEMAS = ['api-flat']
+    settings.RDF_USE_LOCAL_GRAPH = False
+    g = Graph()
+    g.parse(data=test_rdf, format="xml")
+    bindings = GraphBindings(
+        about_uri="http://data.jck.nl/resource/aggregation/jhm-museum/M006660",
+        graph=g
+    )
+    assert RDFRecord.prerender_documents(bindings, g) == {}
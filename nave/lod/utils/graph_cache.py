@@ -0,0 +1,185 @@
+# -*- coding: utf-8 -*-
+"""This module caches the parsed RDF graphs of records stored in ElasticSearch.
+
+Parsing the stored source graph is the most expensive step of resolving a record,
+so the parsed graphs are kept in two layers:
+
+    * a per-process LRU keyed by hub_id and content hash, bounded by an approximate memory budget
+    * a per-request layer that also keeps the search hit, so looking up the same record
+      more than once in a single request does not query ElasticSearch again.
+      It is only active between GraphCacheMiddleware.start_request and end_request.
+
+The cache keeps immutable tuples of quads. Every lookup returns a freshly built graph
+so callers can modify it without affecting the cache.
+
+The following settings are Optional:
+
+    * RDF_GRAPH_CACHE_MAX_MB: the memory budget of the per-process layer. 0 disables the cache.
+"""
+import logging
+import threading
+from collections import OrderedDict, Counter, defaultdict
+
+from django.conf import settings
+from rdflib import ConjunctiveGraph
+
+from nave.lod import namespace_manager
+
+logger = logging.getLogger(__name__)
+
+# approximate overhead in bytes of a single cached quad
+QUAD_OVERHEAD = 200
+
+
+class GraphCache:
+    """Bounded LRU cache of parsed graphs with a per-request layer."""
+
+    def __init__(self, max_bytes=None):
+        if max_bytes is None:
+            max_bytes = getattr(settings, "RDF_GRAPH_CACHE_MAX_MB", 64) * 1024 * 1024
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()
+        self._versions = defaultdict(set)
+        self._size = 0
+        self._lock = threading.RLock()
+        self._local = threading.local()
+        self.counters = Counter()
+
+    @property
+    def enabled(self):
+        return self.max_bytes > 0
+
+    @staticmethod
+    def _freeze(graph):
+        """Return the graph identifier and its quads as immutable tuples plus the approximate size."""
+        quads = tuple((s, p, o, c.identifier) for s, p, o, c in graph.quads((None, None, None)))
+        size = sum(len(s) + len(p) + len(o) + QUAD_OVERHEAD for s, p, o, _ in quads)
+        return (graph.identifier, quads), size
+
+    @staticmethod
+    def _thaw(entry):
+        """Build a new graph from a frozen entry."""
+        identifier, quads = entry
+        graph = ConjunctiveGraph(identifier=identifier)
+        graph.namespace_manager = namespace_manager
+        contexts = {}
+        for s, p, o, context_id in quads:
+            context = contexts.get(context_id)
+            if context is None:
+                context = contexts[context_id] = graph.get_context(context_id)
+            context.add((s, p, o))
+        return graph
+
+    def get_graph(self, hub_id, version):
+        """Return a new copy of the cached graph or None."""
+        if not self.enabled or not version:
+            return None
+        key = (hub_id, version)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.counters['misses'] += 1
+                return None
+            self._entries.move_to_end(key)
+            self.counters['hits'] += 1
+        return self._thaw(entry[0])
+
+    def set_graph(self, hub_id, version, graph, spec=None):
+        """Store a snapshot of the graph in the per-process layer."""
+        if not self.enabled or not version or graph is None:
+            return False
+        frozen, size = self._freeze(graph)
+        if size > self.max_bytes:
+            return False
+        key = (hub_id, version)
+        with self._lock:
+            self._remove(key)
+            self._entries[key] = (frozen, size, spec)
+            self._versions[hub_id].add(version)
+            self._size += size
+            while self._size > self.max_bytes and self._entries:
+                self._remove(next(iter(self._entries)))
+                self.counters['evictions'] += 1
+        return True
+
+    def _remove(self, key):
+        entry = self._entries.pop(key, None)
+        if entry is None:
+            return
+        self._size -= entry[1]
+        hub_id, version = key
+        versions = self._versions.get(hub_id)
+        if versions is not None:
+            versions.discard(version)
+            if not versions:
+                del self._versions[hub_id]
+
+    def invalidate(self, hub_id):
+        """Remove all cached versions of the record."""
+        with self._lock:
+            for version in list(self._versions.get(hub_id, ())):
+                self._remove((hub_id, version))
+                self.counters['invalidations'] += 1
+        self._clear_request_entries()
+
+    def invalidate_spec(self, spec):
+        """Remove all cached records of the spec."""
+        with self._lock:
+            for key in [key for key, entry in self._entries.items() if entry[2] == spec]:
+                self._remove(key)
+                self.counters['invalidations'] += 1
+        self._clear_request_entries()
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._versions.clear()
+            self._size = 0
+        self._clear_request_entries()
+
+    def start_request(self):
+        """Activate the per-request layer for the current thread."""
+        self._local.entries = {}
+
+    def end_request(self):
+        """Deactivate the per-request layer for the current thread."""
+        self._local.entries = None
+
+    def _clear_request_entries(self):
+        if getattr(self._local, 'entries', None):
+            self._local.entries.clear()
+
+    def get_request_entry(self, key):
+        entries = getattr(self._local, 'entries', None)
+        if not entries or key not in entries:
+            return None
+        self.counters['request_hits'] += 1
+        return entries[key]
+
+    def set_request_entry(self, key, value):
+        entries = getattr(self._local, 'entries', None)
+        if entries is not None:
+            entries[key] = value
+
+    def stats(self):
+        """Return the counters and the current size, e.g. for monitoring dashboards."""
+        with self._lock:
+            stats = {
+                'hits': self.counters['hits'],
+                'misses': self.counters['misses'],
+                'request_hits': self.counters['request_hits'],
+                'evictions': self.counters['evictions'],
+                'invalidations': self.counters['invalidations'],
+                'entries': len(self._entries),
+                'size': self._size,
+                'max_size': self.max_bytes,
+            }
+        return stats
+
+
+graph_cache = GraphCache()
+
+
+def get_graph_cache():
+    """Return the per-process GraphCache."""
+    return graph_cache
@@ -1,5 +1,8 @@
 import logging
-from collections import defaultdict
+import queue
+import threading
+from collections import defaultdict, deque, Counter
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
 from datetime import time, datetime
 from time import ctime, sleep
 
@@ -20,21 +23,73 @@ from nave.lod.utils.resolver import ElasticSearchRDFRecord
 
 logger = logging.getLogger(__file__)
 
+# marks the end of the records put on the pipeline queues
+_END_OF_QUEUE = object()
+
+
+def convert_narthex_record(spec, named_graph, content_hash, triples, index, acceptance=False):
+    """Convert a single Narthex record into an ES action and a SPARQL update query.
+
+    This function runs inside the worker processes of the NarthexBulkLoader so it
+    only receives and returns picklable values.
+
+    :return: (es_action, sparql_update_query, error)
+    """
+    record = ElasticSearchRDFRecord(rdf_string=triples, spec=spec)
+    try:
+        record.from_rdf_string(named_graph=named_graph, rdf_string=triples, input_format="xml")
+        es_action = record.create_es_action(
+            doc_type="void_edmrecord",
+            record_type="mdr",
+            context=True,
+            index=index,
+            content_hash=content_hash
+        )
+        sparql_update = None
+        if settings.RDF_STORE_TRIPLES:
+            sparql_update = record.create_sparql_update_query(acceptance=acceptance)
+    except Exception as ex:
+        return None, None, "problem with {} for spec {} caused by {}".format(triples, spec, ex)
+    return es_action, sparql_update, None
+
 
 class NarthexBulkLoader:
     """
     Load EDM records processed by Narthex directly into Nave.
+
+    Each processed file is loaded through a pipeline:
+
+        * a reader that splits the file into records on the graph markers
+        * a pool of worker processes that parse the records and create the ES actions
+        * an index sink that sends the ES actions with `helpers.parallel_bulk`
+        * a SparqlUpdateWriter that sends the SPARQL updates in concurrent batches to the triple store
+
+    The stages are connected by bounded queues so a slow sink throttles the reader.
+
+    Records whose content_hash matches the hash stored in the index are not parsed
+    again, only their modification date is updated. Use `skip_unchanged=False` to
+    force a full reload.
     """
 
     def __init__(
             self,
             org_id=settings.ORG_ID,
             index=settings.INDEX_NAME,
-            narthex_base="~/NarthexFiles"
+            narthex_base="~/NarthexFiles",
+            workers=None,
+            spec_workers=None,
+            queue_size=None,
+            skip_unchanged=True,
         ):
         self._org_id = org_id
         self.index = index
         self.narthex_base = narthex_base
+        self.workers = workers or getattr(settings, "NARTHEX_LOADER_WORKERS", None) or os.cpu_count()
+        self.spec_workers = spec_workers or getattr(settings, "NARTHEX_LOADER_SPEC_WORKERS", 1)
+        self.queue_size = queue_size or getattr(settings, "NARTHEX_LOADER_QUEUE_SIZE", 500)
+        self.bulk_size = getattr(settings, "ES_ACTION_SIZE", 500)
+        self.skip_unchanged = skip_unchanged
+        self._pool = None
 
     @staticmethod
     def is_line_marker(line):
@@ -48,6 +103,25 @@ class NarthexBulkLoader:
         named_graph, content_hash = m.groups()
         return True, named_graph, content_hash
 
+    @staticmethod
+    def iter_records(lines, stats=None):
+        """Split the lines of a Narthex processed file into records.
+
+        :param lines: iterable of lines, e.g. an open file
+        :param stats: optional Counter that is updated with the number of lines read
+        :return: generator of (named_graph, content_hash, triples)
+        """
+        rdf_record = []
+        for line in lines:
+            if stats is not None:
+                stats['lines'] += 1
+            exists, named_graph, content_hash = NarthexBulkLoader.is_line_marker(line)
+            if exists:
+                yield named_graph, content_hash, " ".join(rdf_record)
+                rdf_record[:] = []
+            else:
+                rdf_record.append(line)
+
     @property
     def dataset_base_path(self):
         """Return the base path where the Narthex datasets are stored."""
@@ -77,25 +151,117 @@ class NarthexBulkLoader:
         return processed_specs
 
     def walk_all_datasets(self):
-        """Traverse through all Narthex Datasets on disk and store the processed data in ElasticSearch."""
+        """Traverse through all Narthex Datasets on disk and store the processed data in ElasticSearch.
+
+        Up to `spec_workers` specs are loaded at the same time. They share a single pool of worker processes.
+        """
         processed_specs = {}
-        for spec, processed_files in self.processable_files().items():
-            total_lines = total_records = 0
-            try:
-                for fname in processed_files:
-                    lines, records = self.process_narthex_file(
-                        spec=spec,
-                        path=os.path.join(self.spec_processed_path(spec), fname),
-                        console=True,
-                        index=self.index
-                    )
-                    total_lines += lines
-                    total_records += records
-                    processed_specs[spec] = (total_lines, total_records)
-            except Exception as ex:
-                print("Problem with spec {} and file {}, with error: \n {}".format(spec, fname, ex))
+        self._pool = ProcessPoolExecutor(max_workers=self.workers)
+        try:
+            with ThreadPoolExecutor(max_workers=self.spec_workers) as spec_pool:
+                futures = {
+                    spec_pool.submit(self.process_spec, spec, processed_files): spec
+                    for spec, processed_files in self.processable_files().items()
+                }
+                for future in as_completed(futures):
+                    spec = futures[future]
+                    try:
+                        processed_specs[spec] = future.result()
+                    except Exception as ex:
+                        print("Problem with spec {}, with error: \n {}".format(spec, ex))
+        finally:
+            self._pool.shutdown()
+            self._pool = None
         return processed_specs
 
+    def process_spec(self, spec, processed_files):
+        """Load all processed files of a spec and return the total lines and records."""
+        total_lines = total_records = 0
+        for fname in processed_files:
+            lines, records = self.process_narthex_file(
+                spec=spec,
+                path=os.path.join(self.spec_processed_path(spec), fname),
+                console=True,
+                index=self.index
+            )
+            total_lines += lines
+            total_records += records
+        return total_lines, total_records
+
+    @staticmethod
+    def _iter_queue(q):
+        """Yield items from the queue until the end marker is received."""
+        while True:
+            item = q.get()
+            if item is _END_OF_QUEUE:
+                return
+            yield item
+
+    def _index_sink(self, es_queue, spec, stats):
+        """Send the ES actions from the queue to ElasticSearch."""
+        actions = self._iter_queue(es_queue)
+        try:
+            for ok, info in helpers.parallel_bulk(
+                    get_es(),
+                    actions,
+                    chunk_size=self.bulk_size,
+                    raise_on_error=False,
+                    raise_on_exception=False
+            ):
+                if ok:
+                    stats['indexed'] += 1
+                else:
+                    stats['index_errors'] += 1
+                    logger.error("Something went wrong with bulk index for {}: {}".format(spec, info))
+        except Exception as ex:
+            logger.error("Bulk indexing for dataset {} failed with: {}".format(spec, ex))
+            # keep draining so the pipeline does not block
+            for _ in actions:
+                stats['index_errors'] += 1
+
+    def get_indexed_content_hashes(self, spec, index):
+        """Return a dict with the hub_id and content_hash of the records of the spec that are already indexed."""
+        if not self.skip_unchanged:
+            return {}
+        try:
+            return ElasticSearchRDFRecord.get_indexed_content_hashes(spec, store_name=index)
+        except Exception as ex:
+            logger.warn("Unable to retrieve the indexed content hashes for {}: {}".format(spec, ex))
+            return {}
+
+    @staticmethod
+    def create_touch_action(hub_id, index, modified_at, doc_type="void_edmrecord"):
+        """Create an ES action that only updates the modification date of an unchanged record."""
+        return {
+            '_op_type': 'update',
+            '_index': index,
+            '_type': doc_type,
+            '_id': hub_id,
+            'doc': {'system': {'modified_at': modified_at}}
+        }
+
+    @staticmethod
+    def invalidate_search_caches(spec):
+        """Invalidate the cached cluster tiles and search responses after records of the spec changed."""
+        from nave.search.geo_cluster import invalidate_cluster_tiles
+        from nave.search.result_cache import invalidate_search_results
+        invalidate_cluster_tiles()
+        invalidate_search_results(spec)
+
+    def _dispatch_result(self, future, es_queue, sparql_writer, spec, console, stats):
+        """Put the result of a worker on the index queue and the SPARQL writer."""
+        es_action, sparql_update, error = future.result()
+        if error:
+            stats['errors'] += 1
+            if console:
+                print(error)
+            else:
+                logger.error(error)
+            return
+        es_queue.put(es_action)
+        if sparql_update:
+            sparql_writer.add(sparql_update)
+
     def process_narthex_file(self, spec, store=None, acceptance=False, path=None, console=False, index=None):
 
         if not index and not self.index:
@@ -112,79 +278,78 @@ class NarthexBulkLoader:
             processed_fname = path
         print("started processing {} for dataset {}".format(processed_fname, spec))
 
-        with open(processed_fname, 'r') as f:
-            rdf_record = []
-            lines = 0
-            records = 0
-            stored = 0
-            new = 0
-            not_orphaned = []
-            sparql_update_queries = []
-            es_actions = []
-            # set orphaned records
-
-            for line in f:
-                lines += 1
-                exists, named_graph, content_hash = self.is_line_marker(line)
-                if exists:
-                    new += 1
-                    records += 1
-                    triples = " ".join(rdf_record)
-                    record = ElasticSearchRDFRecord(rdf_string=triples, spec=spec)
-                    try:
-                        record.from_rdf_string(named_graph=named_graph, rdf_string=triples, input_format="xml")
-                        es_actions.append(record.create_es_action(
-                            doc_type="void_edmrecord",
-                            record_type="mdr",
-                            context=True,
-                            index=index
-                        ))
-                    except Exception as ex:
-                        if console:
-                            print("problem with {} for spec {} caused by {}".format(triples, spec, ex))
-                        else:
-                            logger.error("problem with {} for spec {} caused by {}".format(triples, spec, ex))
-                    rdf_record[:] = []
-                    if settings.RDF_STORE_TRIPLES:
-                        sparql_update_queries.append(
-                            record.create_sparql_update_query(acceptance=acceptance)
-                        )
-                    nr_sparql_updates = len(sparql_update_queries)
-                    if settings.RDF_STORE_TRIPLES and nr_sparql_updates > 0 and nr_sparql_updates % 50 == 0:
-                        store.update("\n".join(sparql_update_queries))
-                        sparql_update_queries[:] = []
+        stats = Counter()
+        indexed_hashes = self.get_indexed_content_hashes(spec, index)
+        touched_at = datetime.now().isoformat()
+        es_queue = queue.Queue(maxsize=self.queue_size)
+        sparql_writer = rdfstore.SparqlUpdateWriter(store=store)
+        index_sink = threading.Thread(target=self._index_sink, args=(es_queue, spec, stats), daemon=True)
+        index_sink.start()
+
+        pool = self._pool
+        owns_pool = pool is None
+        if owns_pool:
+            pool = ProcessPoolExecutor(max_workers=self.workers)
+        # bound the records in flight so the reader can not run ahead of the workers
+        max_pending = self.workers * 4
+        pending = deque()
+        try:
+            with open(processed_fname, 'r') as f:
+                for named_graph, content_hash, triples in self.iter_records(f, stats):
+                    stats['records'] += 1
+                    hub_id = ElasticSearchRDFRecord(named_graph_uri=named_graph, spec=spec).hub_id
+                    if content_hash and indexed_hashes.get(hub_id) == content_hash:
+                        stats['unchanged'] += 1
+                        es_queue.put(self.create_touch_action(hub_id, index, touched_at))
+                        continue
+                    pending.append(pool.submit(
+                        convert_narthex_record, spec, named_graph, content_hash, triples, index, acceptance
+                    ))
+                    while len(pending) >= max_pending:
+                        self._dispatch_result(pending.popleft(), es_queue, sparql_writer, spec, console, stats)
+                    records = stats['records']
                     if records % 100 == 0 and records > 0:
                         logger.info("processed {} records of {} at {}".format(records, spec, ctime()))
                         if console:
                             print("processed {} records of {} at {}".format(records, spec, ctime()))
-                        if len(es_actions) > 100:
-                            self.bulk_index(es_actions, spec)
-                            es_actions[:] = []
-                else:
-                    rdf_record.append(line)
-            # store the remaining bulk items
-            self.bulk_index(es_actions, spec)
-            if settings.RDF_STORE_TRIPLES and len(sparql_update_queries) > 0:
-                store.update("\n".join(sparql_update_queries))
-            logger.info(
-                "Dataset {}: records inserted {}, records same content hash {}, lines parsed {}, total records processed {}".format(
-                    spec, new, stored, lines, records)
-            )
-            print("Finished loading {spec} with {lines} and {records} in {seconds}\n".format(
-                spec=spec,
-                lines=lines,
-                records=records,
-                seconds=datetime.now() - start
-            ))
-
-            RDFRecord.remove_orphans(spec, start.isoformat())
-            return lines, records
+                while pending:
+                    self._dispatch_result(pending.popleft(), es_queue, sparql_writer, spec, console, stats)
+        finally:
+            es_queue.put(_END_OF_QUEUE)
+            index_sink.join()
+            if stats['indexed']:
+                self.invalidate_search_caches(spec)
+            sparql_writer.close()
+            stats['sparql_updates'] += sparql_writer.stats['updates']
+            stats['sparql_errors'] += sparql_writer.stats['failed_updates']
+            if owns_pool:
+                pool.shutdown()
+
+        lines = stats['lines']
+        records = stats['records']
+        logger.info(
+            "Dataset {}: records indexed {}, records same content hash {}, errors {}, lines parsed {}, "
+            "total records processed {}".format(
+                spec, stats['indexed'] - stats['unchanged'], stats['unchanged'],
+                stats['errors'] + stats['index_errors'], lines, records)
+        )
+        print("Finished loading {spec} with {lines} and {records} in {seconds}\n".format(
+            spec=spec,
+            lines=lines,
+            records=records,
+            seconds=datetime.now() - start
+        ))
+
+        RDFRecord.remove_orphans(spec, start.isoformat())
+        return lines, records
 
     ### old stuff
 
     def bulk_index(self, es_actions, spec):
         logger.debug(es_actions)
         nr, errors = helpers.bulk(get_es(), es_actions)
+        if nr > 0:
+            self.invalidate_search_caches(spec)
         if nr > 0 and not errors:
             logger.info("Indexed records {} for dataset {}".format(nr, spec))
             return True
@@ -4,12 +4,27 @@
 By default it uses the settings from the settings.py, but if you instantiate SPARQL directly you can override
 these settings
 
+All requests to the triple store share a keep-alive connection pool per process, see get_http_session.
+The following settings are Optional:
+
+    * RDF_STORE_POOL_CONNECTIONS: number of hosts the pool keeps connections for
+    * RDF_STORE_POOL_SIZE: maximum number of connections kept alive per host
+    * RDF_STORE_CONNECT_TIMEOUT, RDF_STORE_READ_TIMEOUT, RDF_STORE_UPDATE_TIMEOUT: timeouts in seconds
+    * RDF_STORE_GZIP: gzip request bodies and accept gzip encoded responses
+    * RDF_STORE_GRAPH_FORMAT: result format for DESCRIBE and Graph Store requests ('nt', 'turtle' or 'xml')
+
 """
+import gzip
 import logging
+import threading
+import time
+import uuid
+from collections import Counter, defaultdict
+from concurrent.futures import ThreadPoolExecutor, wait
 
 import os
 import requests
-from SPARQLWrapper import SPARQLWrapper, GET, JSON, POST
+from requests.adapters import HTTPAdapter
 from django.conf import settings
 from django.http import Http404
 from rdflib import Graph
@@ -21,6 +36,78 @@ logger = logging.getLogger(__name__)
 urllib3_logger = logging.getLogger('requests')
 urllib3_logger.setLevel(logging.WARN)
 
+GET = "GET"
+POST = "POST"
+
+# mime-types of the result formats, the binary RDF formats are not used because rdflib can not parse them
+RESULT_FORMATS = {
+    'json': 'application/sparql-results+json',
+    'nt': 'application/n-triples',
+    'turtle': 'text/turtle',
+    'xml': 'application/rdf+xml',
+}
+
+_session = None
+_session_pid = None
+_session_lock = threading.Lock()
+
+
+def get_http_session():
+    """Return the keep-alive session shared by all RDFStores and GraphStores of this process.
+
+    The session is recreated after a fork so worker processes do not share sockets.
+    """
+    global _session, _session_pid
+    pid = os.getpid()
+    if _session is None or _session_pid != pid:
+        with _session_lock:
+            if _session is None or _session_pid != pid:
+                session = requests.Session()
+                adapter = HTTPAdapter(
+                    pool_connections=getattr(settings, "RDF_STORE_POOL_CONNECTIONS", 4),
+                    pool_maxsize=getattr(settings, "RDF_STORE_POOL_SIZE", 10)
+                )
+                session.mount('http://', adapter)
+                session.mount('https://', adapter)
+                if not getattr(settings, "RDF_STORE_GZIP", False):
+                    session.headers['Accept-Encoding'] = 'identity'
+                _session = session
+                _session_pid = pid
+    return _session
+
+
+class EndpointMetrics:
+    """Request counts and latencies per triple store endpoint."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._metrics = defaultdict(Counter)
+
+    def record(self, endpoint, elapsed, error=False):
+        elapsed_ms = elapsed * 1000
+        with self._lock:
+            metrics = self._metrics[endpoint]
+            metrics['requests'] += 1
+            metrics['total_ms'] += elapsed_ms
+            if error:
+                metrics['errors'] += 1
+            if elapsed_ms > metrics['max_ms']:
+                metrics['max_ms'] = elapsed_ms
+
+    def stats(self):
+        with self._lock:
+            return {
+                endpoint: dict(metrics, avg_ms=metrics['total_ms'] / metrics['requests'])
+                for endpoint, metrics in self._metrics.items()
+            }
+
+    def reset(self):
+        with self._lock:
+            self._metrics.clear()
+
+
+endpoint_metrics = EndpointMetrics()
+
 
 class QueryType:
     def __init__(self):
@@ -57,6 +144,10 @@ class RDFStore:
         self.base_url = self.get_store_url
         self.namespace_manager = namespace_manager
         self.graph_store = None
+        self.connect_timeout = getattr(settings, "RDF_STORE_CONNECT_TIMEOUT", 3)
+        self.read_timeout = getattr(settings, "RDF_STORE_READ_TIMEOUT", 10)
+        self.update_timeout = getattr(settings, "RDF_STORE_UPDATE_TIMEOUT", 60)
+        self.graph_format = getattr(settings, "RDF_STORE_GRAPH_FORMAT", "nt")
 
     @property
     def get_store_url(self):
@@ -83,22 +174,78 @@ class RDFStore:
             self.graph_store = GraphStore(rdf_store=self)
         return self.graph_store
 
-    def build_sparql_query(self, query, query_type, query_method=GET, named_graph=None, update=False):
+    def request(self, method, url, timeout=None, **kwargs):
+        """Send a request over the shared session and record its latency."""
+        if timeout is None:
+            timeout = self.read_timeout
+        start = time.time()
+        error = True
+        try:
+            response = get_http_session().request(
+                method, url, timeout=(self.connect_timeout, timeout), **kwargs
+            )
+            error = response.status_code >= 500
+            return response
+        finally:
+            endpoint_metrics.record(self.get_metrics_key(method, url), time.time() - start, error)
+
+    @staticmethod
+    def get_metrics_key(method, url):
+        """Return the metrics key of a request, the query string with the named graph is left out."""
+        return "{} {}".format(method.upper(), url.split('?', 1)[0])
+
+    @staticmethod
+    def encode_body(data, headers):
+        """Encode the request body and gzip it when RDF_STORE_GZIP is enabled."""
+        if isinstance(data, str):
+            data = data.encode('utf-8')
+        if data and getattr(settings, "RDF_STORE_GZIP", False):
+            data = gzip.compress(data)
+            headers['Content-Encoding'] = 'gzip'
+        return data
+
+    def parse_graph(self, response, result_format=None, identifier=None):
+        """Parse the RDF in the response into a Graph."""
+        graph = Graph(identifier=identifier)
+        graph.namespace_manager = namespace_manager
+        if response.content:
+            graph.parse(data=response.content.decode('utf-8'), format=result_format or self.graph_format)
+        return graph
+
+    def build_sparql_query(self, query, query_type, query_method=GET, named_graph=None, update=False,
+                           result_format=None):
         """Construct the boilerplate of a sparql query
+
+        SELECT and ASK queries return the decoded JSON results, DESCRIBE and CONSTRUCT
+        queries return a Graph and updates return the HTTP response.
         """
         sparql_uri = self.get_sparql_query_url if not update else self.get_sparql_update_url
-        sparql = SPARQLWrapper(sparql_uri)
-        sparql.setMethod(POST if update else query_method)
-        sparql.setReturnFormat(JSON)
-        sparql.setTimeout(15 if update else 10)
-        if named_graph:
-            sparql.addParameter("default-graph-uri", named_graph)
         if isinstance(query, dict):
-            sparql.setQuery(query_type.format(**query))
+            query_string = query_type.format(**query)
         else:
-            sparql.setQuery(query_type.format(query))
-        response = sparql.queryAndConvert()
-        return response
+            query_string = query_type.format(query)
+        params = {}
+        if named_graph:
+            params["default-graph-uri"] = named_graph
+        if update:
+            params['update'] = query_string
+            response = self.request(POST, sparql_uri, data=params, timeout=self.update_timeout)
+            response.raise_for_status()
+            return response
+        is_graph_query = query_type == QueryType.describe or \
+            query_string.lstrip().upper().startswith(('DESCRIBE', 'CONSTRUCT'))
+        if result_format is None:
+            result_format = self.graph_format if is_graph_query else 'json'
+        headers = {'Accept': RESULT_FORMATS.get(result_format, result_format)}
+        params['query'] = query_string
+        if query_method == POST:
+            response = self.request(POST, sparql_uri, data=params, headers=headers)
+        else:
+            response = self.request(GET, sparql_uri, params=params, headers=headers)
+        response.raise_for_status()
+        if is_graph_query:
+            return self.parse_graph(response, result_format)
+        return response.json()
 
     @property
     def get_graph_store_url(self):
@@ -152,10 +299,8 @@ class RDFStore:
                                            query_type=QueryType.remove_insert,
                                            named_graph=named_graph,
                                            update=True)
-        logger.log(response)
-        if "Update succeeded" in str(response):
-            return True
-        return False
+        logger.debug(response.text)
+        return response.ok
 
     def select(self, query, named_graph=None, as_graph=False):
         """
@@ -204,9 +349,7 @@ class RDFStore:
                                            query_method=POST,
                                            named_graph=named_graph,
                                            update=True)
-        if "Update succeeded" in str(response):
-            return True
-        return False
+        return response.ok
 
     def _clear_all(self):
         """ Clear all triples from the RDF store
@@ -253,13 +396,16 @@ class GraphStore:
             raise ValueError("Unsupported data type for this operation: {}".format(type(data)))
         return rdf_string
 
+    def _graph_url(self, named_graph):
+        return "{graph_store_url}?{graph_param}={graph_name_uri}".format(
+            graph_store_url=self.graph_store,
+            graph_param=self.rdf_store.graph_store_graph_param,
+            graph_name_uri=named_graph)
+
     def delete(self, named_graph):
         """ Delete the named graph from the RDF store
         """
-        response = requests.delete("{graph_store_url}?{graph_param}={graph_name_uri}".format(
-            graph_store_url=self.graph_store,
-            graph_param=self.rdf_store.graph_store_graph_param,
-            graph_name_uri=named_graph))
+        response = self.rdf_store.request("DELETE", self._graph_url(named_graph))
         return True if response.status_code in [200, 202, 204] else False
 
     def get(self, named_graph, as_graph=False):
@@ -268,56 +414,36 @@ class GraphStore:
         :param named_graph: the uri to the named graph
         :return: Graph
         """
-        headers = {'Content-Type': 'text/n3'}
-        response = requests.get(
-            "{graph_store_url}?{graph_param}={graph_name_uri}".format(
-                graph_store_url=self.graph_store,
-                graph_param=self.rdf_store.graph_store_graph_param,
-                graph_name_uri=named_graph),
-            headers=headers)
+        result_format = self.rdf_store.graph_format
+        headers = {'Accept': RESULT_FORMATS.get(result_format, result_format)}
+        response = self.rdf_store.request(GET, self._graph_url(named_graph), headers=headers)
         if response.status_code == 404:
             raise UnknownGraph("No such graph: <{}>".format(named_graph))
         if as_graph:
-            graph = Graph(identifier=named_graph)
-            graph.namespace_manager = namespace_manager
-            n3 = response.content.decode("utf-8")
-            graph.parse(data=n3, format='n3')
-            return graph
+            return self.rdf_store.parse_graph(response, result_format, identifier=named_graph)
         return response
 
     def head(self, named_graph):
         """Testing for validity of derefencable named graphs."""
+        headers = {'Accept': RESULT_FORMATS['nt']}
+        response = self.rdf_store.request("HEAD", self._graph_url(named_graph), headers=headers)
+        return True if response.status_code == 200 else False
+
+    def _send(self, method, named_graph, rdf_string):
         headers = {'Content-Type': 'application/n-triples; charset=utf-8'}
-        response = requests.head(
-            "{graph_store_url}?{graph_param}={graph_name_uri}".format(
-                graph_store_url=self.graph_store,
-                graph_param=self.rdf_store.graph_store_graph_param,
-                graph_name_uri=named_graph),
-            headers=headers
+        data = self.rdf_store.encode_body(rdf_string, headers)
+        return self.rdf_store.request(
+            method, self._graph_url(named_graph), data=data, headers=headers, timeout=self.rdf_store.update_timeout
         )
-        return True if response.status_code == 200 else False
 
     def post(self, named_graph, data):
         """Update the content of the named graph with information from data.
         """
-        headers = {'Content-Type': 'application/n-triples; charset=utf-8'}
         rdf_string = self._get_data_as_rdf_string(data)
-        r = requests.post(
-            "{graph_store_url}?{graph_param}={graph_name_uri}".format(
-                graph_store_url=self.graph_store,
-                graph_param=self.rdf_store.graph_store_graph_param,
-                graph_name_uri=named_graph),
-              data=rdf_string,
-              headers=headers)
+        r = self._send(POST, named_graph, rdf_string)
         if r.status_code == 404:
             # create the graph because it does not exist
-            r = requests.put(
-                "{graph_store_url}?{graph_param}={graph_name_uri}".format(
-                    graph_store_url=self.graph_store,
-                    graph_param=self.rdf_store.graph_store_graph_param,
-                    graph_name_uri=named_graph),
-                 data=rdf_string,
-                 headers=headers)
+            r = self._send("PUT", named_graph, rdf_string)
         if r.status_code not in [200, 201, 204]:
             logger.error("unable to store document {} in graph {} because of:\n {}".format(
                     rdf_string,
@@ -331,15 +457,8 @@ class GraphStore:
 
     def put(self, named_graph, data):
         """PUT request to replace or create the graph with information form data"""
-        headers = {'Content-Type': 'application/n-triples; charset=utf-8'}
         rdf_string = self._get_data_as_rdf_string(data)
-        r = requests.put(
-            "{graph_store_url}?{graph_param}={graph_name_uri}".format(
-                graph_store_url=self.graph_store,
-                graph_param=self.rdf_store.graph_store_graph_param,
-                graph_name_uri=named_graph),
-             data=rdf_string,
-             headers=headers)
+        r = self._send("PUT", named_graph, rdf_string)
         if r.status_code not in [200, 201, 204]:
             logger.error("unable to store document {} in graph {} because of bla:\n {}".format(
                     rdf_string,
@@ -352,11 +471,14 @@ class GraphStore:
 
     def put_file(self, file_path):
         """PUT request to replace or create the graph with information form data"""
-        files = {'file': (os.path.basename(file_path), open(file_path, 'rb'), "application/n-quads")}
-        r = requests.post(
-            "{graph_store_url}".format(graph_store_url=self.graph_store),
-            files=files,
-        )
+        with open(file_path, 'rb') as f:
+            files = {'file': (os.path.basename(file_path), f, "application/n-quads")}
+            r = self.rdf_store.request(
+                POST,
+                "{graph_store_url}".format(graph_store_url=self.graph_store),
+                files=files,
+                timeout=self.rdf_store.update_timeout
+            )
         if r.status_code not in [200, 201, 204]:
             logger.error("unable to store file {} because of bla:\n {}\n{}".format(
                 file_path,
@@ -367,6 +489,198 @@ class GraphStore:
         logger.info("Stored RDF from {} in triple-store".format(file_path))
         return True
 
+
+class SparqlUpdateWriter:
+    """Send SPARQL updates in batches to the update endpoint of a RDFStore.
+
+    Updates are collected into batches of at most max_batch_bytes and sent by a pool of
+    concurrent workers over the shared HTTP session. Failed requests are retried with exponential
+    backoff. Batches that still fail are written to failed_dir so they can be replayed
+    with replay_failed_sparql_updates.
+
+    Updates for the same named graph should not be spread over batches that are in flight
+    at the same time, because the order in which concurrent batches are applied is not defined.
+
+    Usage::
+
+        with SparqlUpdateWriter(store) as writer:
+            for update_query in update_queries:
+                writer.add(update_query)
+        print(writer.stats)
+
+    The following settings are Optional:
+
+        * RDF_STORE_UPDATE_BATCH_BYTES
+        * RDF_STORE_UPDATE_CONCURRENCY
+        * RDF_STORE_UPDATE_MAX_RETRIES
+        * RDF_STORE_UPDATE_BACKOFF
+        * RDF_STORE_UPDATE_TIMEOUT
+        * RDF_STORE_FAILED_UPDATES_DIR
+    """
+
+    def __init__(self, store=None, max_batch_bytes=None, concurrency=None, max_retries=None,
+                 backoff=None, timeout=None, failed_dir=None, session=None):
+        self.store = store if store is not None else get_rdfstore()
+        self.max_batch_bytes = max_batch_bytes or getattr(settings, "RDF_STORE_UPDATE_BATCH_BYTES", 2 * 1024 * 1024)
+        self.concurrency = concurrency or getattr(settings, "RDF_STORE_UPDATE_CONCURRENCY", 4)
+        self.max_retries = max_retries if max_retries is not None else \
+            getattr(settings, "RDF_STORE_UPDATE_MAX_RETRIES", 5)
+        self.backoff = backoff if backoff is not None else getattr(settings, "RDF_STORE_UPDATE_BACKOFF", 1)
+        self.timeout = timeout or getattr(settings, "RDF_STORE_UPDATE_TIMEOUT", 60)
+        self.failed_dir = failed_dir if failed_dir is not None else \
+            getattr(settings, "RDF_STORE_FAILED_UPDATES_DIR", None)
+        self.session = session if session is not None else get_http_session()
+        self.stats = Counter()
+        self._batch = []
+        self._batch_bytes = 0
+        self._lock = threading.Lock()
+        self._futures = set()
+        # limit the batches waiting for a worker so the producer can not run ahead
+        self._slots = threading.BoundedSemaphore(self.concurrency * 2)
+        self._executor = ThreadPoolExecutor(max_workers=self.concurrency)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def add(self, update_query):
+        """Add the update query to the current batch and send the batch when it is full."""
+        if not update_query:
+            return
+        size = len(update_query.encode('utf-8')) + 1
+        batch = None
+        with self._lock:
+            if self._batch and self._batch_bytes + size > self.max_batch_bytes:
+                batch = self._batch
+                self._batch = []
+                self._batch_bytes = 0
+            self._batch.append(update_query)
+            self._batch_bytes += size
+        if batch:
+            self._submit(batch)
+
+    def extend(self, update_queries):
+        for update_query in update_queries:
+            self.add(update_query)
+
+    def _submit(self, batch):
+        self._slots.acquire()
+        future = self._executor.submit(self._send_batch, batch)
+        with self._lock:
+            self._futures.add(future)
+        future.add_done_callback(self._batch_done)
+
+    def _batch_done(self, future):
+        self._slots.release()
+        with self._lock:
+            self._futures.discard(future)
+
+    def send(self, payload):
+        """Send the payload to the update endpoint, retrying failures.
+
+        :return: (success, last error)
+        """
+        url = self.store.get_sparql_update_url
+        delay = self.backoff
+        error = None
+        for attempt in range(self.max_retries + 1):
+            if attempt > 0:
+                with self._lock:
+                    self.stats['retries'] += 1
+                time.sleep(delay)
+                delay *= 2
+            start = time.time()
+            try:
+                response = self.session.post(url, data={'update': payload}, timeout=self.timeout)
+            except requests.RequestException as e:
+                endpoint_metrics.record("POST {}".format(url), time.time() - start, error=True)
+                error = e
+                continue
+            endpoint_metrics.record("POST {}".format(url), time.time() - start, error=response.status_code >= 500)
+            if response.status_code in [200, 204]:
+                return True, None
+            error = "HTTP {}: {}".format(response.status_code, response.text[:500])
+            # client errors, like SPARQL syntax errors, will not succeed on a retry
+            if 400 <= response.status_code < 500 and response.status_code not in [408, 429]:
+                break
+        return False, error
+
+    def _send_batch(self, batch):
+        payload = "\n".join(batch)
+        ok, error = self.send(payload)
+        if ok:
+            with self._lock:
+                self.stats['batches'] += 1
+                self.stats['updates'] += len(batch)
+                self.stats['bytes'] += len(payload)
+            return True
+        with self._lock:
+            self.stats['failed_batches'] += 1
+            self.stats['failed_updates'] += len(batch)
+        logger.error("Unable to send {} SPARQL updates to {}: {}".format(
+            len(batch), self.store.get_sparql_update_url, error))
+        self._persist_failed_batch(payload)
+        return False
+
+    def _persist_failed_batch(self, payload):
+        if not self.failed_dir:
+            return None
+        os.makedirs(self.failed_dir, exist_ok=True)
+        fname = os.path.join(
+            self.failed_dir,
+            "{}_{}_{}.sparql".format(self.store.db, time.strftime("%Y%m%dT%H%M%S"), uuid.uuid4().hex)
+        )
+        with open(fname, 'w') as f:
+            f.write(payload)
+        logger.info("Stored failed SPARQL update batch in {}".format(fname))
+        return fname
+
+    def flush(self):
+        """Send the current batch and wait until all batches are processed."""
+        with self._lock:
+            batch = self._batch
+            self._batch = []
+            self._batch_bytes = 0
+        if batch:
+            self._submit(batch)
+        with self._lock:
+            futures = list(self._futures)
+        wait(futures)
+        return self.stats['failed_batches'] == 0
+
+    def close(self):
+        self.flush()
+        self._executor.shutdown(wait=True)
+
+
+def replay_failed_sparql_updates(store=None, failed_dir=None):
+    """Resend the batches persisted by the SparqlUpdateWriter and remove the ones that succeed.
+
+    Returns a tuple with the number of replayed and still failing batches.
+    """
+    failed_dir = failed_dir if failed_dir is not None else getattr(settings, "RDF_STORE_FAILED_UPDATES_DIR", None)
+    replayed = failed = 0
+    if not failed_dir or not os.path.isdir(failed_dir):
+        return replayed, failed
+    with SparqlUpdateWriter(store=store, failed_dir="", concurrency=1) as writer:
+        prefix = "{}_".format(writer.store.db)
+        for fname in sorted(os.listdir(failed_dir)):
+            if not fname.startswith(prefix) or not fname.endswith('.sparql'):
+                continue
+            path = os.path.join(failed_dir, fname)
+            with open(path, 'r') as f:
+                ok, error = writer.send(f.read())
+            if ok:
+                os.remove(path)
+                replayed += 1
+            else:
+                failed += 1
+                logger.error("Unable to replay SPARQL updates from {}: {}".format(path, error))
+    return replayed, failed
+
+
 # test if the right database are defined
 _rdfstore_test = RDFStore(db="test")
 _rdfstore_acceptance = RDFStore(acceptance_mode=True)
@@ -19,6 +19,7 @@ The NormalisedRDFResource get as resource URI and deals with:
 from collections import defaultdict, Counter
 from collections import namedtuple, OrderedDict
 import itertools
+import json
 from datetime import datetime
 from time import sleep
 from operator import itemgetter
@@ -32,7 +33,7 @@ from urllib.parse import urlparse, quote
 import re
 from django.conf import settings
 from django.urls import reverse
-from elasticsearch import Elasticsearch
+from elasticsearch import Elasticsearch, helpers
 from elasticsearch_dsl import Search, Q
 from natsort import natsorted
 from rdflib import ConjunctiveGraph
@@ -41,6 +42,7 @@ from rdflib.namespace import RDF, SKOS, RDFS, DC, FOAF
 
 from nave.lod import namespace_manager
 from nave.lod.utils import rdfstore
+from nave.lod.utils.graph_cache import graph_cache
 
 from nave.search.connector import get_es_client
 
@@ -157,6 +159,85 @@ def get_graph_statistics(graph):
     return stats
 
 
+def bind_namespace(prefix, namespace):
+    """Bind a namespace to a prefix in the shared namespace_manager.
+
+    The interned RDFPredicates are cleared when the binding changes, because their
+    qnames depend on it.
+
+    :return: True when the binding was changed
+    """
+    namespace = URIRef(namespace)
+    if namespace_manager.store.prefix(namespace) == prefix:
+        return False
+    namespace_manager.bind(prefix, namespace)
+    RDFPredicate.clear_registry()
+    return True
+
+
+class GraphIndex:
+    """Index of all the triples in a Graph, built in a single pass.
+
+    The triples are grouped by subject, by subject and predicate and by predicate.
+    The lookup methods mirror the rdflib Graph API so that the GraphBindings, RDFResource
+    and RDFObject can use the index wherever they would otherwise query the Graph.
+    """
+
+    def __init__(self, graph):
+        self._by_subject = OrderedDict()
+        self._by_subject_predicate = defaultdict(list)
+        self._by_predicate = OrderedDict()
+        self.languages = set()
+        for s, p, o in graph:
+            self.add((s, p, o))
+
+    def add(self, triple):
+        """Add a triple to the index. The caller must make sure it was not indexed before."""
+        s, p, o = triple
+        predicate_objects = self._by_subject.get(s)
+        if predicate_objects is None:
+            predicate_objects = self._by_subject[s] = []
+        predicate_objects.append((p, o))
+        self._by_subject_predicate[(s, p)].append(o)
+        subject_objects = self._by_predicate.get(p)
+        if subject_objects is None:
+            subject_objects = self._by_predicate[p] = []
+        subject_objects.append((s, o))
+        if isinstance(o, Literal) and o.language is not None:
+            self.languages.add(o.language)
+
+    def subjects(self):
+        """Return each subject once."""
+        return list(self._by_subject.keys())
+
+    def predicates(self):
+        """Return each predicate once."""
+        return list(self._by_predicate.keys())
+
+    def objects(self, subject=None, predicate=None):
+        if subject is not None and predicate is not None:
+            return self._by_subject_predicate.get((subject, predicate), [])
+        if predicate is not None:
+            return [o for _, o in self._by_predicate.get(predicate, [])]
+        if subject is not None:
+            return [o for _, o in self._by_subject.get(subject, [])]
+        return [o for _, o in itertools.chain.from_iterable(self._by_predicate.values())]
+
+    def predicate_objects(self, subject):
+        return self._by_subject.get(subject, [])
+
+    def subject_objects(self, predicate):
+        return self._by_predicate.get(predicate, [])
+
+    def preferredLabel(self, subject, default=None, labelProperties=(SKOS.prefLabel, RDFS.label)):
+        """Same as rdflib Graph.preferredLabel without the language filter."""
+        for label_property in labelProperties:
+            labels = self._by_subject_predicate.get((subject, label_property))
+            if labels:
+                return [(label_property, label) for label in labels]
+        return default if default is not None else []
+
+
 class GraphBindings:
     def __init__(self, about_uri, graph,
                  excluded_rdf_types=None, allowed_rdf_types=None,
@@ -184,12 +265,16 @@ class GraphBindings:
         self._excluded_rdf_types = excluded_rdf_types
         self._graph = graph
         self._about_uri = URIRef(about_uri)
+        self._index = None
         self._resources = self._create_resources()
         self._resources_by_type = None
         self._inlined_resources = []
         self._call_queue = defaultdict(list)
         self._items = None
-        self._search_label_dict = defaultdict(list)
+        # search_label -> OrderedDict with the first RDFObject for each distinct value
+        self._search_label_dict = defaultdict(OrderedDict)
+        # (search_label, lexsort) -> cached list of RDFObjects
+        self._search_label_lists = {}
 
     def __getitem__(self, search_label):
         return self.get_first(search_label)
@@ -202,6 +287,25 @@ class GraphBindings:
     def get_thumbnail_fields(self):
         return self._thumbnail_fields
 
+    def get_index(self):
+        """Return the GraphIndex of the graph. It is built on first access."""
+        if self._index is None:
+            self._index = GraphIndex(self._graph)
+        return self._index
+
+    def get_lookup(self, graph):
+        """Return the GraphIndex when graph is the bound graph, otherwise the graph itself."""
+        if graph is self._graph:
+            return self.get_index()
+        return graph
+
+    def add_triple(self, triple):
+        """Add a triple to the graph and keep the index in sync."""
+        if triple not in self._graph:
+            self._graph.add(triple)
+            if self._index is not None:
+                self._index.add(triple)
+
     def get_uri_from_search_label(self, search_label):
         """Convert search_label back into a URI."""
         if not search_label or '_' not in search_label:
@@ -244,7 +348,7 @@ class GraphBindings:
         if webresources:
             webresources = sorted(webresources, key=lambda wr: wr.get_sort_key())
             for wr in webresources:
-                self._graph.add((
+                self.add_triple((
                     self.about_uri(),
                     EDM.hasView,
                     wr.subject_uri
@@ -276,7 +380,7 @@ class GraphBindings:
 
     def get_first_literal(self, predicate, graph=None):
         if graph is None:
-            graph = self._graph
+            graph = self.get_index()
         if not isinstance(predicate, URIRef):
             predicate = URIRef(predicate)
         for s, o in graph.subject_objects(predicate=predicate):
@@ -289,26 +393,31 @@ class GraphBindings:
                     return o.value if not len(o.value) > 32766 else o.value[:32700]
         return None
 
+    def _build_search_label_dict(self):
+        """Group all RDFObjects by search_label and de-duplicate them on their value."""
+        allowed_languages = settings.RDF_ALLOWED_LANGS
+        if not allowed_languages:
+            allowed_languages = []
+        for rdf_object in self.get_all_items():
+            if rdf_object.language and allowed_languages and rdf_object.language not in allowed_languages:
+                continue
+            self._search_label_dict[rdf_object.predicate.search_label].setdefault(rdf_object.value, rdf_object)
+
     def get_list(self, search_label, lexsort=True):
+        """Return the distinct RDFObjects for the search_label.
+
+        The lists are cached per search_label and sort order, so they must not be modified by the caller.
+        """
         if not self._search_label_dict:
-            allowed_languages = settings.RDF_ALLOWED_LANGS
-            if not allowed_languages:
-                allowed_languages = []
-            for rdf_object in self.get_all_items():
-                if rdf_object.language and allowed_languages:
-                    if rdf_object.language in allowed_languages:
-                        self._search_label_dict[rdf_object.predicate.search_label].append(rdf_object)
-                else:
-                    self._search_label_dict[rdf_object.predicate.search_label].append(rdf_object)
-        fields = []
-        seen = []
-        for field in self._search_label_dict.get(search_label, []):
-            if field.value not in seen:
-                seen.append(field.value)
-                fields.append(field)
-        if not lexsort:
-            return fields
-        return sorted(fields, key=lambda k: k.value)
+            self._build_search_label_dict()
+        key = (search_label, lexsort)
+        fields = self._search_label_lists.get(key)
+        if fields is None:
+            fields = list(self._search_label_dict.get(search_label, {}).values())
+            if lexsort:
+                fields = sorted(fields, key=lambda k: k.value)
+            self._search_label_lists[key] = fields
+        return fields
 
     def get_resources(self):
         if not self._resources:
@@ -318,12 +427,13 @@ class GraphBindings:
     def _create_resources(self):
         """Create RDFResources from all subjects in the Graph."""
         resources = {}
+        index = self.get_index()
         if self.aggregate_edm_blank_nodes:
-            for subj in set(self._graph.subjects()):
+            for subj in index.subjects():
                 if isinstance(subj, BNode):
-                    if any(str(obj).startswith('http://schemas.delving.eu/nave/terms/') for obj in self._graph.objects(subject=subj, predicate=RDF.type)):
-                        self._graph.add((self.about_uri(), URIRef('http://www.openarchives.org/ore/terms/aggregates'), subj))
-        for subject in self._graph.subjects():
+                    if any(str(obj).startswith('http://schemas.delving.eu/nave/terms/') for obj in index.objects(subject=subj, predicate=RDF.type)):
+                        self.add_triple((self.about_uri(), URIRef('http://www.openarchives.org/ore/terms/aggregates'), subj))
+        for subject in index.subjects():
             resource = RDFResource(
                 subject_uri=subject,
                 graph=self._graph,
@@ -351,7 +461,7 @@ class GraphBindings:
         return False
 
     def has_geo(self):
-        points = get_geo_points(self._graph, only_geohash=False)
+        points = get_geo_points(self.get_index(), only_geohash=False)
         return True if points else False
 
     @staticmethod
@@ -431,7 +541,7 @@ class GraphBindings:
         thumbnail = None
         for thumb in self.get_thumbnail_fields():
             # print(self._graph.serialize(format='nt'))
-            thumbnails = [o for o in self._graph.objects(predicate=thumb)]
+            thumbnails = self.get_index().objects(predicate=thumb)
             if len(thumbnails) == 0:
                 continue
             else:
@@ -443,15 +553,16 @@ class GraphBindings:
         index_doc = defaultdict(list)
         index_doc['rdf'] = {}
         index_doc['about'] = {}
-        rdf_class = [RDFPredicate(str(obj)) for obj in set(list(self._graph.objects(predicate=RDF.type))) if
+        index = self.get_index()
+        rdf_class = [RDFPredicate(str(obj)) for obj in set(index.objects(predicate=RDF.type)) if
                      isinstance(obj, URIRef)]
-        languages = {obj.language for obj in self._graph.objects() if
-                     isinstance(obj, Literal) and obj.language is not None}
-        predicates = {RDFPredicate(str(obj)) for obj in set(list(self._graph.predicates())) if
+        languages = set(index.languages)
+        predicates = {RDFPredicate(str(obj)) for obj in index.predicates() if
                       isinstance(obj, URIRef) and str(obj) not in settings.RDF_EXCLUDED_PROPERTIES}
-        subjects = {str(obj) for obj in set(list(self._graph.subjects())) if isinstance(obj, URIRef)}
-        rdf_objects = [obj.to_index_entry(nested=False) for obj in self.get_all_items() if
-                       obj._object_type is not self._about_uri]
+        subjects = {str(obj) for obj in index.subjects() if isinstance(obj, URIRef)}
+        # each object is converted once and reused for the search_label fields below
+        object_entries = [(obj, obj.to_index_entry(nested=False)) for obj in self.get_all_items()]
+        rdf_objects = [entry for obj, entry in object_entries if obj._object_type is not self._about_uri]
         # add classes
         index_doc['rdf']['class'] = [
             {'@type': "URIRef", 'id': clzz.uri_as_string, 'value': clzz.qname, 'raw': clzz.qname} for
@@ -478,7 +589,7 @@ class GraphBindings:
         # index_doc['rdf']['graph'] = self._graph.serialize(format='json-ld', context=context_dict).decode('utf-8')
 
         index_doc['about']['language'] = [{'@type': "Literal", 'value': lang, 'raw': lang} for lang in languages]
-        points = ["{},{}".format(lat, lon) for lat, lon in get_geo_points(self._graph, only_geohash=False)]
+        points = ["{},{}".format(lat, lon) for lat, lon in get_geo_points(index, only_geohash=False)]
         index_doc['about']['point'] = points
         index_doc['point'] = points
         captions = self.get_about_caption
@@ -493,8 +604,8 @@ class GraphBindings:
             ]
         # todo remove rdf for now enable later  again
         del index_doc['rdf']
-        for obj in self.get_all_items():
-            index_doc[obj.predicate.search_label].append(obj.to_index_entry(nested=False))
+        for obj, entry in object_entries:
+            index_doc[obj.predicate.search_label].append(entry)
         for key, val in index_doc.items():
             if isinstance(val, list):
                 if all(isinstance(l, dict) for l in val):
@@ -508,12 +619,12 @@ class GraphBindings:
         resource = self.get_about_resource()
         index_doc = {}
         about = defaultdict(list)
+        index = self.get_index()
 
-        rdf_class = [RDFPredicate(str(obj)) for obj in set(list(self._graph.objects(predicate=RDF.type))) if
+        rdf_class = [RDFPredicate(str(obj)) for obj in set(index.objects(predicate=RDF.type)) if
                      isinstance(obj, URIRef)]
-        languages = {obj.language for obj in self._graph.objects() if
-                     isinstance(obj, Literal) and obj.language is not None}
-        properties = {RDFPredicate(str(obj)) for obj in set(list(self._graph.predicates())) if
+        languages = set(index.languages)
+        properties = {RDFPredicate(str(obj)) for obj in index.predicates() if
                       isinstance(obj, URIRef) and str(obj) not in settings.RDF_EXCLUDED_PROPERTIES}
         # add classes
         about['class'] = [{'@type': "URIRef", 'id': clzz.uri_as_string, 'value': clzz.qname, 'raw': clzz.qname} for
@@ -523,7 +634,7 @@ class GraphBindings:
                              prop in properties]
         # add languages
         about['language'] = [{'@type': "Literal", 'value': lang, 'raw': lang} for lang in languages]
-        about['point'] = ["{},{}".format(lat, lon) for lat, lon in get_geo_points(self._graph, only_geohash=False)]
+        about['point'] = ["{},{}".format(lat, lon) for lat, lon in get_geo_points(index, only_geohash=False)]
         caption = self.get_about_caption
         #  todo fix issue with lang being null
         about['caption'] = [
@@ -576,15 +687,22 @@ class RDFResource:
     def get_uri(self):
         return str(self.subject_uri)
 
+    def _lookup(self):
+        """Return the GraphIndex of the bindings or the graph when there is no index for it."""
+        if self._bindings is not None:
+            return self._bindings.get_lookup(self.graph)
+        return self.graph
+
     def get_label(self):
-        label = self.graph.preferredLabel(
+        lookup = self._lookup()
+        label = lookup.preferredLabel(
             subject=self.subject_uri,
             labelProperties=self._bindings.label_properties
         )
         if not label:
             langfilter = lambda l: True
             for labelProp in (DC.title, SKOS.prefLabel, RDFS.label, URIRef("http://www.geonames.org/ontology#name")):
-                labels = list(filter(langfilter, self.graph.objects(predicate=labelProp)))
+                labels = list(filter(langfilter, lookup.objects(predicate=labelProp)))
                 if len(labels) == 0:
                     continue
                 else:
@@ -607,7 +725,7 @@ class RDFResource:
 
     def _generate_rdf_objects_from_graph(self):
         """Generate dict with predicate URIRef as key and a list of RDFObject as value."""
-        for predicate, rdf_object in self.graph.predicate_objects(subject=self.subject_uri):
+        for predicate, rdf_object in self._lookup().predicate_objects(subject=self.subject_uri):
             # todo add inline of enrichments
             self.add_item(
                 predicate_uri=predicate,
@@ -618,7 +736,7 @@ class RDFResource:
 
     def get_types(self):
         if not self._rdf_types:
-            types = list(set(self.graph.objects(subject=self.subject_uri, predicate=RDF.type)))
+            types = list(set(self._lookup().objects(subject=self.subject_uri, predicate=RDF.type)))
             if types:
                 self._rdf_types = [RDFPredicate(rdf_type) for rdf_type in types]
             else:
@@ -717,7 +835,7 @@ class RDFResource:
             uri = URIRef(uri)
         if not self._bindings:
             return uri
-        same_as = list(self._bindings._graph.objects(subject=uri, predicate=SKOS.exactMatch))
+        same_as = list(self._bindings.get_index().objects(subject=uri, predicate=SKOS.exactMatch))
         if same_as:
             return same_as[0]
         return None
@@ -763,15 +881,46 @@ class RDFResource:
         return entries
 
 
-class RDFPredicate():
+class RDFPredicate:
+    """A predicate or RDF class URI with its qname and search_label.
 
-    def __init__(self, uri):
-        self._uri = uri
-        self._manager = namespace_manager
+    Instances are interned per URI, so RDFPredicate(uri) returns the same shared object
+    for every call and the qname is only computed once per process. The registry is
+    cleared with clear_registry() when a namespace binding changes, see bind_namespace.
+    """
+
+    __slots__ = ('_uri', '_prefix', '_ns', '_label', '_qname', '_search_label')
+
+    _registry = {}
+    _max_registry_size = 50000
+
+    def __new__(cls, uri):
+        if isinstance(uri, RDFPredicate):
+            return uri
+        predicate = cls._registry.get(uri)
+        if predicate is not None:
+            return predicate
+        predicate = super().__new__(cls)
+        predicate._uri = uri
         try:
-            self._prefix, self._ns, self._label = self._manager.compute_qname(self._uri)
+            predicate._prefix, predicate._ns, predicate._label = namespace_manager.compute_qname(uri)
+            predicate._qname = namespace_manager.qname(uri)
         except Exception as e:
-            logger.error("Unable to compute qname".format(e))
+            logger.error("Unable to compute qname for {}: {}".format(uri, e))
+            predicate._prefix = predicate._ns = predicate._label = None
+            predicate._qname = str(uri)
+        predicate._search_label = predicate._qname.replace(':', '_')
+        if len(cls._registry) >= cls._max_registry_size:
+            cls.clear_registry()
+        return cls._registry.setdefault(uri, predicate)
+
+    def __reduce__(self):
+        return RDFPredicate, (self._uri,)
+
+    @classmethod
+    def clear_registry(cls):
+        """Remove all interned predicates, e.g. after the namespace bindings have changed."""
+        cls._registry.clear()
 
     @property
     def uri(self):
@@ -795,11 +944,11 @@ class RDFPredicate():
 
     @property
     def search_label(self):
-        return self.qname.replace(':', '_')
+        return self._search_label
 
     @property
     def qname(self):
-        return self._manager.qname(self._uri)
+        return self._qname
 
     # def from_search_label(search_label):
     #     return
@@ -846,8 +995,14 @@ class RDFObject:
         elif isinstance(tags, str):
             self._source_tags.update([tags])
 
+    def _lookup(self):
+        """Return the GraphIndex of the bindings or the graph when there is no index for it."""
+        if self._bindings is not None:
+            return self._bindings.get_lookup(self._graph)
+        return self._graph
+
     def generate_source_tags(self, source_tag=NAVE.sourceTag):
-        labels = self._graph.objects(
+        labels = self._lookup().objects(
             subject=self._subject,
             predicate=source_tag
         )
@@ -960,7 +1115,7 @@ class RDFObject:
         return None
 
     def get_label(self, rdf_object):
-        label = self._graph.preferredLabel(
+        label = self._lookup().preferredLabel(
             subject=rdf_object,
             labelProperties=self._bindings.label_properties,
             default=[("raw", Literal(str(rdf_object)))]
@@ -1088,6 +1243,7 @@ class RDFRecord:
         self._rdf_string = rdf_string
         self._query_response = None
         self._modified_at = None
+        self._content_hash = None
         self._bindings = None
         # self._setup_rdfrecord()
 
@@ -1319,12 +1475,18 @@ class RDFRecord:
         for s, o in graph.subject_objects(predicate=deepzoom_predicate):
             api_call = RDFRecord.is_web_resource_api_call(str(o))
             if api_call:
+                from nave.webresource.derivatives import DerivativePending
                 from nave.webresource.webresource import WebResource
                 uri, spec = api_call
                 wr = WebResource(uri=uri, spec=spec)
                 graph.remove((s, deepzoom_predicate, o))
                 if wr.exists_source:
-                    deep_zoom_url = wr.get_deepzoom_redirect()
+                    try:
+                        deep_zoom_url = wr.get_deepzoom_redirect()
+                    except DerivativePending:
+                        # the deepzoom is still generated or the remote source is still cached, leave it out
+                        logger.info("Deepzoom for {} is not ready yet".format(uri))
+                        deep_zoom_url = None
                     if deep_zoom_url:
                         graph.add((s, deepzoom_predicate, Literal(deep_zoom_url)))
         return graph
@@ -1762,8 +1924,56 @@ class RDFRecord:
             'delving_hasLandingePage': "true" if 'edm_isShownAt' in index_doc else "false",
             'delving_hasDeepZoom': "true" if 'nave_deepZoom' in index_doc else "false",
         }
+        rendered = self.prerender_documents(bindings, graph)
+        if rendered:
+            mapping['_source']['system']['rendered'] = rendered
         return mapping
 
+    @staticmethod
+    def render_document(bindings, schema, graph=None, add_delving_fields=True):
+        """Convert the GraphBindings to the document served by the API for the schema.
+
+        The schema is either 'api', 'api-flat' or one of the keys of REGISTERED_CONVERTERS.
+        """
+        if schema == 'api-flat':
+            return bindings.to_flat_index_doc()
+        from nave.void import REGISTERED_CONVERTERS
+        converter = REGISTERED_CONVERTERS.get(schema)
+        if schema == 'api' or converter is None:
+            return bindings.to_index_doc()
+        return converter(
+            bindings=bindings,
+            graph=graph if graph is not None else bindings._graph,
+            about_uri=bindings.about_uri()
+        ).convert(add_delving_fields=add_delving_fields)
+
+    @staticmethod
+    def prerender_documents(bindings, graph=None, schemas=None):
+        """Return a dict with the serialised API documents for each of the RDF_PRERENDER_SCHEMAS.
+
+        The documents are stored as non-indexed strings in system.rendered so the
+        detail API can serve them without parsing the source graph. They are rendered from
+        the local graph, so without RDF_USE_LOCAL_GRAPH nothing is pre-rendered.
+        """
+        if schemas is None:
+            schemas = getattr(settings, "RDF_PRERENDER_SCHEMAS", []) if settings.RDF_USE_LOCAL_GRAPH else []
+        rendered = {}
+        for schema in schemas:
+            try:
+                document = RDFRecord.render_document(bindings, schema, graph=graph)
+                rendered[schema] = json.dumps(document, default=str)
+            except Exception as e:
+                logger.warning("Unable to pre-render {} for {}: {}".format(schema, bindings.about_uri(), e))
+        return rendered
+
+    @staticmethod
+    def get_prerendered_document(es_record, schema):
+        """Return the document pre-rendered at index time for the schema or None."""
+        system_fields = es_record['_source']['system']
+        if 'rendered' not in system_fields or schema not in system_fields['rendered']:
+            return None
+        return json.loads(system_fields['rendered'][schema], object_pairs_hook=OrderedDict)
+
     @staticmethod
     def delete_from_index(spec, index='{}'.format(settings.INDEX_NAME)):
         """Delete all dataset records from the Search Index. """
@@ -1778,6 +1988,10 @@ class RDFRecord:
         }
         response = get_es_client().delete_by_query(index=index, body=query_string)
         logger.info("Deleted {} from Search index with message: {}".format(spec, response))
+        from nave.search.geo_cluster import invalidate_cluster_tiles
+        from nave.search.result_cache import invalidate_search_results
+        invalidate_cluster_tiles()
+        invalidate_search_results(spec)
         return response
 
     @staticmethod
@@ -1817,6 +2031,11 @@ class RDFRecord:
                 spec, response
             )
         )
+        if orphan_counter:
+            from nave.search.geo_cluster import invalidate_cluster_tiles
+            from nave.search.result_cache import invalidate_search_results
+            invalidate_cluster_tiles()
+            invalidate_search_results(spec)
         return orphan_counter
 
     def get_more_like_this(self):
@@ -1834,18 +2053,21 @@ class ElasticSearchRDFRecord(RDFRecord):
     """RDF resolved using ElasticSearch as its backend."""
 
     @staticmethod
-    def get_rdf_records_from_query(query, response=None):
+    def iter_rdf_records_from_query(query, response=None):
+        """Yield an ElasticSearchRDFRecord per hit without parsing the graphs upfront."""
         if response is None:
             response = query.execute()
-        record_list = []
         for hit in response.hits.hits:
             record = ElasticSearchRDFRecord(
                 hub_id=hit['_id'],
                 doc_type=hit['_type']
             )
             record.set_defaults_from_query_result(es_record=hit)
-            record_list.append(record)
-        return record_list
+            yield record
+
+    @staticmethod
+    def get_rdf_records_from_query(query, response=None):
+        return list(ElasticSearchRDFRecord.iter_rdf_records_from_query(query, response))
 
     def set_defaults_from_query_result(self, es_record):
         self._query_response = es_record
@@ -1857,20 +2079,46 @@ class ElasticSearchRDFRecord(RDFRecord):
         self._spec = system_fields['spec']
         self._hub_id = system_fields['slug']
         self._modified_at = system_fields['modified_at']
+        self._content_hash = system_fields['content_hash'] if 'content_hash' in system_fields else None
         return self
 
+    @property
+    def cache_version(self):
+        """Return the version of the stored graph used as key in the graph cache."""
+        if self._query_response is None:
+            return None
+        return self._content_hash or self._modified_at
+
+    def get_graph(self, **kwargs):
+        if not self._graph and self._rdf_string and self.cache_version:
+            self._graph = graph_cache.get_graph(self._hub_id, self.cache_version)
+            if self._graph is None:
+                self._graph = self.parse_graph_from_string(self._rdf_string)
+                graph_cache.set_graph(self._hub_id, self.cache_version, self._graph, spec=self._spec)
+        return super(ElasticSearchRDFRecord, self).get_graph(**kwargs)
+
     def query_for_graph(self, query_type=None, query=None, store_name=None, as_bindings=False, raw_query=None):
         if store_name is None:
             store_name = settings.INDEX_NAME
-        if raw_query:
-            s = Search(index=store_name).using(get_es_client()).query(raw_query).extra(track_total_hits=True)
-        else:
-            s = Search(index=store_name).using(get_es_client()).query(query_type, **query).extra(track_total_hits=True)
-        # s = s[:1] # todo use terminate after later
-        response = s.execute()
-        if response.hits.total.value != 1:
-            return None
-        self.set_defaults_from_query_result(response.hits.hits[0])
+        request_key = None
+        hit = None
+        if not raw_query:
+            request_key = (store_name, query_type, tuple(sorted(query.items())))
+            hit = graph_cache.get_request_entry(request_key)
+        if hit is None:
+            if raw_query:
+                s = Search(index=store_name).using(get_es_client()).query(raw_query).extra(track_total_hits=True)
+            else:
+                s = Search(index=store_name).using(get_es_client()).query(query_type, **query).extra(
+                    track_total_hits=True)
+            # s = s[:1] # todo use terminate after later
+            response = s.execute()
+            if response.hits.total.value != 1:
+                return None
+            hit = response.hits.hits[0]
+            if request_key is not None:
+                graph_cache.set_request_entry(request_key, hit)
+        self.set_defaults_from_query_result(hit)
         if as_bindings:
             return GraphBindings(about_uri=self._source_uri, graph=self.get_graph())
         return self.get_graph()
@@ -1882,6 +2130,29 @@ class ElasticSearchRDFRecord(RDFRecord):
         exists = self.query_for_graph(raw_query=query, store_name=store_name)
         return True if exists is not None else False
 
+    @staticmethod
+    def get_indexed_content_hashes(spec, store_name=None):
+        """Return a dict with the hub_id and the stored content_hash of all indexed records of a spec.
+
+        The hashes are fetched with a single scroll so they can be used as a pre-pass
+        for skipping unchanged records when a dataset is reloaded.
+        """
+        if store_name is None:
+            store_name = settings.INDEX_NAME
+        query = {"query": {"term": {"system.spec.raw": spec}}}
+        content_hashes = {}
+        for hit in helpers.scan(
+                get_es_client(),
+                index=store_name,
+                query=query,
+                _source=['system.content_hash'],
+                size=1000
+        ):
+            content_hash = hit.get('_source', {}).get('system', {}).get('content_hash')
+            if content_hash:
+                content_hashes[hit['_id']] = content_hash
+        return content_hashes
+
     def get_graph_by_id(self, hub_id, store_name=None, as_bindings=False):
         return self.query_for_graph("match", {"_id": hub_id}, store_name, as_bindings)
 
@@ -29,8 +29,11 @@ default_app_config = 'nave.search.apps.SearchConfig'
 
 LayoutItem = namedtuple("LayoutItem", ["name", "i18n"])
 
-# todo later set a custom cache for the paging
-paging_cache = caches
+
+def get_paging_cache():
+    """Return the cache that stores the search_after sort values of deep result pages."""
+    return caches[getattr(settings, "SEARCH_PAGING_CACHE", "default")]
+
 
 def get_settings(setting_name, default_value):
     """Utility function for getting values from the settings.py.
@@ -175,6 +178,10 @@ mappings = {
                                 'type': 'string',
                                 'doc_values': False
                             },
+                            'rendered': {
+                                'type': 'object',
+                                'enabled': False
+                            },
                             "geohash": {
                                 "type": "geo_point"
                             },
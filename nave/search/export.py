@@ -0,0 +1,316 @@
+# -*- coding: utf-8 -*-
+"""
+Export of complete search results.
+
+The hits are read with a sliced scroll, where every slice is scanned in its own thread, and
+serialized directly from the ``_source`` by a format specific writer. The export is either
+streamed to the client, gzipped on the fly, or written to a file by a celery task.
+
+The following settings are Optional
+
+    * SEARCH_EXPORT_SLICES: the number of parallel scroll slices
+    * SEARCH_EXPORT_SCROLL_SIZE: the number of hits per scroll request
+    * SEARCH_EXPORT_CSV_FIELDS: the index fields that become the columns of the CSV export
+"""
+import csv
+import gzip
+import io
+import json
+import logging
+import queue
+import threading
+from collections import OrderedDict
+
+from django.conf import settings
+from django.http import StreamingHttpResponse
+from django.utils.cache import patch_vary_headers
+from django.utils.text import compress_sequence
+from elasticsearch.helpers import scan
+
+from nave.lod.utils.resolver import RDFRecord
+from nave.search.connector import get_es_client
+
+logger = logging.getLogger(__name__)
+
+
+class ExportWriter(object):
+    """Serialize hits from the _source of the index documents.
+
+    Subclasses define the format, the writer only asks for the parts of the _source it needs.
+    """
+    key = None
+    extension = None
+    content_type = "text/plain"
+    source_includes = None
+    source_excludes = ['system.source_graph', 'system.rendered']
+
+    def __init__(self, converter=None):
+        self.converter = converter
+
+    def header(self):
+        return ""
+
+    def write(self, hit):
+        raise NotImplementedError("implement me")
+
+    def footer(self):
+        return ""
+
+    def get_fields(self, hit):
+        fields = hit.get('_source', {})
+        if self.converter:
+            fields = self.converter(es_result_fields=fields).convert()
+        return OrderedDict(sorted(fields.items()))
+
+    def get_item(self, hit):
+        return {
+            'doc_id': hit['_id'],
+            'doc_type': "void_edmrecord",
+            'fields': self.get_fields(hit)
+        }
+
+
+class JSONLinesWriter(ExportWriter):
+    key = "jsonl"
+    extension = "jsonl"
+    content_type = "application/x-ndjson"
+
+    def write(self, hit):
+        return "{}\n".format(json.dumps(self.get_item(hit)))
+
+
+class JSONArrayWriter(ExportWriter):
+    key = "json"
+    extension = "json"
+    content_type = "application/json"
+
+    def __init__(self, converter=None):
+        super(JSONArrayWriter, self).__init__(converter=converter)
+        self._separator = ""
+
+    def header(self):
+        return "["
+
+    def write(self, hit):
+        item = "{}\n{}".format(self._separator, json.dumps(self.get_item(hit)))
+        self._separator = ","
+        return item
+
+    def footer(self):
+        return "\n]\n"
+
+
+class CSVWriter(ExportWriter):
+    """Write one row per hit with the values of each field joined by the value_separator."""
+    key = "csv"
+    extension = "csv"
+    content_type = "text/csv"
+    value_separator = " | "
+
+    def __init__(self, converter=None, fields=None):
+        super(CSVWriter, self).__init__(converter=converter)
+        self.fields = fields or getattr(settings, "SEARCH_EXPORT_CSV_FIELDS", [])
+        self.source_includes = list(self.fields)
+        self.source_excludes = None
+
+    def _row(self, values):
+        output = io.StringIO()
+        csv.writer(output).writerow(values)
+        return output.getvalue()
+
+    def header(self):
+        return self._row(['hub_id'] + self.fields)
+
+    def get_values(self, source, field):
+        values = source.get(field, [])
+        if not isinstance(values, list):
+            values = [values]
+        return self.value_separator.join(
+            str(value.get('value', "")) if isinstance(value, dict) else str(value) for value in values
+        )
+
+    def write(self, hit):
+        source = hit.get('_source', {})
+        return self._row([hit['_id']] + [self.get_values(source, field) for field in self.fields])
+
+
+class NTriplesWriter(ExportWriter):
+    """Write the source graph of each hit as N-Triples."""
+    key = "nt"
+    extension = "nt"
+    content_type = "application/n-triples"
+    source_includes = ['system.source_graph']
+    source_excludes = None
+
+    def write(self, hit):
+        rdf_string = hit['_source']['system']['source_graph']
+        if (rdf_string.startswith('<') and not rdf_string.startswith('<rdf:RDF')) or rdf_string.startswith('_:'):
+            return rdf_string if rdf_string.endswith('\n') else "{}\n".format(rdf_string)
+        graph = RDFRecord.parse_graph_from_string(rdf_string)
+        return graph.serialize(format='nt').decode('utf-8')
+
+
+class EDMXMLWriter(ExportWriter):
+    """Write the source graph of each hit as EDM RDF/XML wrapped in a single root element."""
+    key = "xml"
+    extension = "xml"
+    content_type = "application/xml"
+    source_includes = ['system.source_graph', 'system.source_uri']
+    source_excludes = None
+
+    def header(self):
+        return '<?xml version="1.0" encoding="UTF-8"?>\n<delving-records>\n'
+
+    def write(self, hit):
+        from nave.void.convertors import EDMConverter
+        system = hit['_source']['system']
+        graph = RDFRecord.parse_graph_from_string(system['source_graph'])
+        record = EDMConverter(about_uri=system.get('source_uri'), graph=graph).convert(output_format='xml')
+        if isinstance(record, bytes):
+            record = record.decode('utf-8')
+        return "{}\n".format(record.split('?>', 1)[-1].strip() if record.startswith('<?xml') else record)
+
+    def footer(self):
+        return '</delving-records>\n'
+
+
+EXPORT_WRITERS = OrderedDict(
+    (writer.key, writer) for writer in [JSONArrayWriter, JSONLinesWriter, CSVWriter, NTriplesWriter, EDMXMLWriter]
+)
+
+
+def get_export_writer(export_format, converter=None):
+    writer = EXPORT_WRITERS.get(export_format)
+    if writer is None:
+        raise ValueError("unsupported export format {}, choose from {}".format(
+            export_format, ", ".join(EXPORT_WRITERS.keys())))
+    return writer(converter=converter)
+
+
+def sliced_scan(body, index, slices=None, size=None, client=None, scroll='5m', **kwargs):
+    """Yield all hits of the query, scanning the scroll slices in parallel threads.
+
+    The hits of the slices are interleaved, so the output is not ordered.
+    """
+    client = client or get_es_client()
+    slices = slices or getattr(settings, "SEARCH_EXPORT_SLICES", 4)
+    size = size or getattr(settings, "SEARCH_EXPORT_SCROLL_SIZE", 500)
+    if slices <= 1:
+        for hit in scan(client, query=body, index=index, size=size, scroll=scroll, **kwargs):
+            yield hit
+        return
+
+    hits = queue.Queue(maxsize=size * slices)
+    stop = threading.Event()
+    done = object()
+
+    def put(entry):
+        while not stop.is_set():
+            try:
+                hits.put(entry, timeout=1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def scan_slice(slice_id):
+        slice_body = dict(body, slice={'id': slice_id, 'max': slices})
+        try:
+            for hit in scan(client, query=slice_body, index=index, size=size, scroll=scroll, **kwargs):
+                if not put(hit):
+                    return
+        except Exception as e:
+            put(e)
+        finally:
+            put(done)
+
+    threads = [threading.Thread(target=scan_slice, args=(slice_id,), daemon=True) for slice_id in range(slices)]
+    for thread in threads:
+        thread.start()
+    running = slices
+    try:
+        while running:
+            entry = hits.get()
+            if entry is done:
+                running -= 1
+            elif isinstance(entry, Exception):
+                raise entry
+            else:
+                yield entry
+    finally:
+        # also stops the slices when the consumer goes away early
+        stop.set()
+
+
+class SearchExport(object):
+    """Export all hits of a search with an ExportWriter."""
+
+    chunk_size = 100
+
+    def __init__(self, search, index, writer, slices=None):
+        self.search = search
+        self.index = index
+        self.writer = writer
+        self.slices = slices
+        self.records = 0
+
+    def get_body(self):
+        """Return the query and post_filter of the search, without paging, sorting or aggregations."""
+        search_dict = self.search.to_dict() if hasattr(self.search, 'to_dict') else dict(self.search)
+        body = {key: value for key, value in search_dict.items() if key in ['query', 'post_filter']}
+        body['_source'] = {}
+        if self.writer.source_includes:
+            body['_source']['includes'] = self.writer.source_includes
+        if self.writer.source_excludes:
+            body['_source']['excludes'] = self.writer.source_excludes
+        return body
+
+    def __iter__(self):
+        yield self.writer.header()
+        chunk = []
+        for hit in sliced_scan(self.get_body(), index=self.index, slices=self.slices):
+            try:
+                chunk.append(self.writer.write(hit))
+            except Exception as e:
+                logger.error("Unable to export {} as {}: {}".format(hit.get('_id'), self.writer.key, e))
+                continue
+            self.records += 1
+            if len(chunk) >= self.chunk_size:
+                yield "".join(chunk)
+                chunk = []
+        if chunk:
+            yield "".join(chunk)
+        yield self.writer.footer()
+
+    def get_file_name(self, name, compress=False):
+        file_name = "{}.{}".format(name, self.writer.extension)
+        return "{}.gz".format(file_name) if compress else file_name
+
+    def stream_response(self, name, compress=True):
+        """Return a StreamingHttpResponse with the export as attachment."""
+        if compress:
+            response = StreamingHttpResponse(
+                compress_sequence(chunk.encode('utf-8') for chunk in self),
+                content_type=self.writer.content_type
+            )
+            response['Content-Encoding'] = 'gzip'
+            patch_vary_headers(response, ('Accept-Encoding',))
+        else:
+            response = StreamingHttpResponse(self, content_type=self.writer.content_type)
+        response['Content-Disposition'] = 'attachment; filename="{}"'.format(self.get_file_name(name))
+        return response
+
+    def write_to_file(self, path, compress=True, progress=None, progress_interval=1000):
+        """Write the export to path and return the number of exported records.
+
+        :param progress: called with the number of exported records every progress_interval records
+        """
+        opener = gzip.open if compress else open
+        reported = 0
+        with opener(path, 'wt', encoding='utf-8') as f:
+            for chunk in self:
+                f.write(chunk)
+                if progress and self.records - reported >= progress_interval:
+                    reported = self.records
+                    progress(self.records)
+        return self.records
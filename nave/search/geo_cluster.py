@@ -0,0 +1,96 @@
+# -*- coding: utf-8 -*-
+"""
+Tile addressed geohash clusters.
+
+The clusters of a search are computed per web mercator tile z/x/y. The geohash precision follows
+from the zoom level and the aggregation is clipped to the bounding box of the tile. The resulting
+FeatureCollections are cached per normalised search params, hidden filters and tile. The hidden
+filters include the spec filters that depend on the client ip, see RDFRecord.get_filters_by_ip. All cached tiles are
+invalidated at once by bumping a generation number when the index is updated.
+
+The following settings are Optional
+
+    * GEO_CLUSTER_CACHE: the cache alias used for the cluster tiles
+    * GEO_CLUSTER_CACHE_TIMEOUT: the time in seconds a cluster tile is cached
+    * GEO_CLUSTER_CELLS_PER_TILE: the number of geohash cells along the width of a tile
+"""
+import hashlib
+import logging
+
+from django.conf import settings
+from django.core.cache import caches
+
+from nave.search.utils import gis
+
+logger = logging.getLogger(__name__)
+
+GENERATION_KEY = "geo_cluster:generation"
+
+# params that do not change the clusters of a search
+IGNORED_PARAMS = ['start', 'page', 'rows', 'facet', 'cursor', 'format', 'callback', 'cluster.factor', '_']
+
+
+def get_cluster_cache():
+    return caches[getattr(settings, "GEO_CLUSTER_CACHE", "default")]
+
+
+def get_generation():
+    cache = get_cluster_cache()
+    generation = cache.get(GENERATION_KEY)
+    if generation is None:
+        cache.add(GENERATION_KEY, 1, None)
+        generation = cache.get(GENERATION_KEY, 1)
+    return generation
+
+
+def invalidate_cluster_tiles():
+    """Invalidate all cached cluster tiles, called when records are added to or removed from the index."""
+    cache = get_cluster_cache()
+    try:
+        cache.incr(GENERATION_KEY)
+    except ValueError:
+        cache.set(GENERATION_KEY, 2, None)
+
+
+def normalise_params(params):
+    """Return the params that define the clusters as a sorted tuple."""
+    return tuple(
+        (key, tuple(sorted(values))) for key, values in sorted(params.lists()) if key not in IGNORED_PARAMS
+    )
+
+
+def get_hidden_filters(query_factory, request):
+    """Return the sorted hidden filters of the query factory and the spec filters for the ip of the request."""
+    from nave.lod.utils.resolver import RDFRecord
+    hidden_filters = set(query_factory.hidden_filters or [])
+    hidden_filters.update('-delving_spec:{}'.format(spec) for spec in RDFRecord.get_filters_by_ip(request))
+    return sorted(hidden_filters)
+
+
+def get_cluster_tile_key(params, index_name, z, x, y, hidden_filters=None):
+    params_hash = hashlib.md5(
+        repr((index_name, normalise_params(params), sorted(hidden_filters or []))).encode('utf-8')
+    ).hexdigest()
+    return "geo_cluster:{}:{}:{}/{}/{}".format(get_generation(), params_hash, z, x, y)
+
+
+def get_cluster_tile(query_factory, request, z, x, y):
+    """Return the FeatureCollection dict with the geohash clusters of the search within tile z/x/y."""
+    cache = get_cluster_cache()
+    key = get_cluster_tile_key(
+        request.GET, query_factory.index_name, z, x, y, hidden_filters=get_hidden_filters(query_factory, request)
+    )
+    feature_collection = cache.get(key)
+    if feature_collection is not None:
+        return feature_collection
+    params = request.GET.copy()
+    params['cluster.factor'] = gis.zoom_to_geohash_precision(
+        z, cells_per_tile=getattr(settings, "GEO_CLUSTER_CELLS_PER_TILE", 8)
+    )
+    request.GET = params
+    query = query_factory.build_geo_query(request)
+    query = query.filter(gis.create_tile_filter(z, x, y)).extra(size=0)
+    results = query.execute()
+    feature_collection = gis.get_geojson(gis.get_feature_collection(results.aggregations), as_string=False)
+    cache.set(key, feature_collection, getattr(settings, "GEO_CLUSTER_CACHE_TIMEOUT", 600))
+    return feature_collection
@@ -1,14 +1,25 @@
 """Middleware to log API request and response info to ElasticSearch.
 
 The logged information can be used for Kibana Dashboards.
+
+The entries are not written in the response path. They are put on a bounded in-process
+queue that is written to ElasticSearch with the bulk API by a background thread,
+either when API_LOG_BATCH_SIZE entries are waiting or every API_LOG_FLUSH_INTERVAL seconds.
+When the queue is full the oldest entries are dropped.
 """
 
+import atexit
 import logging
+import threading
+from collections import Counter, deque
 
 from django.conf import settings
 from datetime import datetime
+from elasticsearch import helpers
 from elasticsearch_dsl import DocType, Date, Text, Nested
 
+from nave.search.connector import get_es_client
+from nave.search.utils import gis
 from nave.search.views import SearchListAPIView
 
 logger = logging.getLogger(__name__)
@@ -73,7 +84,100 @@ class APIEntry(DocType):
         return super().save(** kwargs)
 
 
-APIEntry.init()
+class APILogQueue(object):
+    """Bounded queue of APIEntry documents that are bulk indexed by a background thread."""
+
+    def __init__(self, max_size=None, batch_size=None, flush_interval=None):
+        self.max_size = max_size if max_size is not None else getattr(settings, "API_LOG_QUEUE_SIZE", 10000)
+        self.batch_size = batch_size if batch_size is not None else getattr(settings, "API_LOG_BATCH_SIZE", 500)
+        self.flush_interval = flush_interval if flush_interval is not None else \
+            getattr(settings, "API_LOG_FLUSH_INTERVAL", 5)
+        self.counters = Counter()
+        self._entries = deque()
+        self._condition = threading.Condition()
+        self._flush_lock = threading.Lock()
+        self._thread = None
+        self._index_initialised = False
+
+    def put(self, entry):
+        """Add the entry to the queue, dropping the oldest entry when the queue is full."""
+        with self._condition:
+            if len(self._entries) >= self.max_size:
+                self._entries.popleft()
+                self.counters['dropped'] += 1
+            self._entries.append(entry)
+            self.counters['queued'] += 1
+            if len(self._entries) >= self.batch_size:
+                self._condition.notify()
+        self._ensure_thread()
+
+    def _ensure_thread(self):
+        if self._thread is not None and self._thread.is_alive():
+            return
+        with self._condition:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name="api-log-flusher", daemon=True)
+                self._thread.start()
+
+    def _take_batch(self):
+        with self._condition:
+            return [self._entries.popleft() for _ in range(min(self.batch_size, len(self._entries)))]
+
+    def _run(self):
+        while True:
+            with self._condition:
+                if len(self._entries) < self.batch_size:
+                    self._condition.wait(self.flush_interval)
+            try:
+                self.flush()
+            except Exception as e:
+                logger.error("Unable to flush the API log: {}".format(e))
+
+    def _init_index(self):
+        if not self._index_initialised:
+            APIEntry.init()
+            self._index_initialised = True
+
+    def flush(self):
+        """Write all queued entries to ElasticSearch and return the number of written entries."""
+        flushed = 0
+        with self._flush_lock:
+            batch = self._take_batch()
+            while batch:
+                try:
+                    self._init_index()
+                    success, errors = helpers.bulk(
+                        get_es_client(),
+                        (entry.to_dict(include_meta=True) for entry in batch),
+                        raise_on_error=False,
+                        raise_on_exception=False
+                    )
+                except Exception as e:
+                    logger.error("Unable to write {} API log entries: {}".format(len(batch), e))
+                    self.counters['failed'] += len(batch)
+                else:
+                    self.counters['flushed'] += success
+                    self.counters['failed'] += len(errors)
+                    flushed += success
+                batch = self._take_batch()
+        return flushed
+
+    def __len__(self):
+        return len(self._entries)
+
+    def stats(self):
+        """Return the queue counters, e.g. for monitoring dashboards."""
+        return {
+            'queued': self.counters['queued'],
+            'dropped': self.counters['dropped'],
+            'flushed': self.counters['flushed'],
+            'failed': self.counters['failed'],
+            'waiting': len(self),
+        }
+
+
+api_log_queue = APILogQueue()
+atexit.register(api_log_queue.flush)
 
 
 class APILoggingMiddleware(object):
@@ -90,19 +194,52 @@ class APILoggingMiddleware(object):
         response = self.get_response(request)
 
         # Only log information for subclass of 'SearchListAPIView'
-        if not hasattr(response, 'render_context'):
+        if not hasattr(response, 'renderer_context'):
             return response
 
         if issubclass(response.renderer_context['view'].__class__, SearchListAPIView):
-
-            entry = APIEntry() # query_params=request.GET.lists()
-            entry.query_params = dict(request.GET.lists())
-            # switch between django response and DRF response
-            # entry.total_result = response.data.get('result')['pagination']['numFound']
-            entry.raw_query = '{}'.format(request.GET.urlencode())
-            entry.save()
+            api_log_queue.put(self.create_entry(request, response))
 
         # Code to be executed for each request/response after
         # the view is called.
 
         return response
+
+    @staticmethod
+    def create_entry(request, response):
+        """Create the APIEntry from the request and the unrendered response data."""
+        params = request.GET
+        entry = APIEntry(created_at=datetime.now())
+        entry.query_params = dict(params.lists())
+        entry.raw_query = '{}'.format(params.urlencode())
+        query = params.get('q', params.get('query', ''))
+        entry.requestor = {
+            'ip': request.META.get('HTTP_X_FORWARDED_FOR', request.META.get('REMOTE_ADDR')),
+        }
+        entry.request = {
+            'path': request.path,
+            'paging': any(key in params for key in ['start', 'page']),
+            'filtered': any(key in params for key in ['qf', 'qf[]', 'hqf', 'hqf[]']),
+            'fielded_query': ':' in query,
+            'geosearch': {'pt', 'd'}.issubset(params.keys()) or
+                         set(gis.BOUNDING_BOX_PARAM_KEYS).issubset(params.keys()),
+            'facets': params.getlist('facet') + params.getlist('facet.field'),
+        }
+        entry.response = APILoggingMiddleware.get_response_info(response)
+        return entry
+
+    @staticmethod
+    def get_response_info(response):
+        """Return the numFound and returned facets from the serialised response data."""
+        info = {'status_code': response.status_code}
+        data = getattr(response, 'data', None)
+        result = data.get('result') if isinstance(data, dict) else None
+        if not isinstance(result, dict):
+            return info
+        pagination = result.get('pagination')
+        if isinstance(pagination, dict) and 'numFound' in pagination:
+            info['numFound'] = pagination['numFound']
+        facets = result.get('facets')
+        if isinstance(facets, list):
+            info['facets'] = [facet.get('name') for facet in facets if isinstance(facet, dict)]
+        return info
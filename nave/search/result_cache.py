@@ -0,0 +1,158 @@
+# -*- coding: utf-8 -*-
+"""
+Shared cache of serialized search responses for anonymous requests.
+
+The serialized NaveQueryResponseWrapperSerializer output is cached under the canonical key of the
+compiled query, which covers the normalised params, the index alias and the converter. Only one
+request computes a missing entry, concurrent requests for the same key wait for it to appear.
+
+Entries are invalidated through generation numbers. Searches that are filtered on one or more
+specs depend on the generations of those specs, all other searches on the generation of the
+whole index. Invalidating a spec bumps both its own and the index generation.
+
+The following settings are Optional
+
+    * SEARCH_RESULT_CACHE: the cache alias used for the search responses, None disables the cache
+    * SEARCH_RESULT_CACHE_TIMEOUT: the time in seconds a search response is cached
+    * SEARCH_RESULT_CACHE_LOCK_TIMEOUT: the time in seconds other requests wait for a response being computed
+    * SEARCH_RESULT_CACHE_MAX_AGE: the max-age of the Cache-Control header of cached search responses
+"""
+import hashlib
+import json
+import logging
+import re
+import time
+
+from django.conf import settings
+from django.core.cache import caches
+from django.utils.cache import patch_cache_control, patch_vary_headers
+from django.utils.http import http_date
+from rest_framework.renderers import JSONRenderer
+
+logger = logging.getLogger(__name__)
+
+INDEX_GENERATION_KEY = "search_result:generation"
+FLUSH_GENERATION_KEY = "search_result:generation:flush"
+SPEC_GENERATION_KEY = "search_result:generation:spec:{}"
+
+SPEC_FILTER_PATTERN = re.compile(r'^(?:delving_spec|system\.spec)(?:\.raw|\.value)?:"?([^"]+)"?$')
+
+
+def get_result_cache():
+    alias = getattr(settings, "SEARCH_RESULT_CACHE", "default")
+    return caches[alias] if alias else None
+
+
+def _bump(cache, key):
+    try:
+        cache.incr(key)
+    except ValueError:
+        cache.set(key, 2, None)
+
+
+def invalidate_search_results(spec=None):
+    """Invalidate the cached search responses for spec, or all cached responses when spec is None."""
+    cache = get_result_cache()
+    if cache is None:
+        return
+    if spec is None:
+        _bump(cache, FLUSH_GENERATION_KEY)
+    else:
+        _bump(cache, SPEC_GENERATION_KEY.format(spec.lower()))
+    _bump(cache, INDEX_GENERATION_KEY)
+
+
+def get_query_specs(query):
+    """Return the sorted specs the query is restricted to, an empty list when it searches the whole index."""
+    filters = list(query.hidden_filters or [])
+    if query.base_params is not None:
+        filters.extend(query.base_params.getlist('qf'))
+        filters.extend(query.base_params.getlist('hqf'))
+    specs = set()
+    for query_filter in filters:
+        match = SPEC_FILTER_PATTERN.match(query_filter)
+        if match:
+            specs.add(match.group(1).lower())
+    return sorted(specs)
+
+
+def get_generations(cache, specs):
+    keys = [FLUSH_GENERATION_KEY] + ([SPEC_GENERATION_KEY.format(spec) for spec in specs] or [INDEX_GENERATION_KEY])
+    generations = cache.get_many(keys)
+    return tuple(generations.get(key, 1) for key in keys)
+
+
+def get_result_key(cache, query, request, raw_query_string=None):
+    """Return the cache key of the serialized response of query, or None when it can not be cached."""
+    compile_key = query.create_compile_key(request, raw_query_string)
+    if compile_key is None or query.search_after is not None or query.page_beyond_end:
+        return None
+    specs = get_query_specs(query)
+    key = (compile_key, request.get_host(), request.path, request.accepted_renderer.format)
+    return "search_result:{}".format(hashlib.md5(repr((get_generations(cache, specs), key)).encode('utf-8')).hexdigest())
+
+
+def is_cacheable_request(request):
+    if get_result_cache() is None or request.method != 'GET':
+        return False
+    return not request.user.is_authenticated()
+
+
+def create_entry(data):
+    """Return the cache entry with the serialized data reduced to plain json types and its validators."""
+    content = JSONRenderer().render(data)
+    return {
+        'data': json.loads(content.decode('utf-8')),
+        'etag': '"{}"'.format(hashlib.md5(content).hexdigest()),
+        'last_modified': time.time(),
+    }
+
+
+def get_cached_entry(key, get_data):
+    """Return the cache entry for key, calling get_data for the serialized response when it is missing.
+
+    Only the request that acquires the lock calls get_data, the others wait for the entry to appear
+    until SEARCH_RESULT_CACHE_LOCK_TIMEOUT and compute it themselves after that.
+    """
+    cache = get_result_cache()
+    entry = cache.get(key)
+    if entry is not None:
+        return entry
+    lock_key = "{}:lock".format(key)
+    lock_timeout = getattr(settings, "SEARCH_RESULT_CACHE_LOCK_TIMEOUT", 10)
+    if not cache.add(lock_key, 1, lock_timeout):
+        deadline = time.time() + lock_timeout
+        while time.time() < deadline:
+            time.sleep(0.05)
+            entry = cache.get(key)
+            if entry is not None:
+                return entry
+        logger.warning("Waited {}s for search result {}, computing it again".format(lock_timeout, key))
+    try:
+        entry = create_entry(get_data())
+        cache.set(key, entry, getattr(settings, "SEARCH_RESULT_CACHE_TIMEOUT", 300))
+    finally:
+        cache.delete(lock_key)
+    return entry
+
+
+def depends_on_client_ip():
+    """Do the search responses depend on the client ip through the IP_SPEC_WHITE_LIST hidden filters."""
+    return bool(getattr(settings, "IP_SPEC_WHITE_LIST", None))
+
+
+def patch_shared_cache_control(response, max_age):
+    """Allow shared caches to store the response, unless its content depends on the client ip."""
+    if depends_on_client_ip():
+        patch_cache_control(response, private=True, max_age=max_age)
+    else:
+        patch_cache_control(response, public=True, max_age=max_age)
+    return response
+
+
+def patch_response_headers(response, entry):
+    response['ETag'] = entry['etag']
+    response['Last-Modified'] = http_date(entry['last_modified'])
+    patch_shared_cache_control(response, getattr(settings, "SEARCH_RESULT_CACHE_MAX_AGE", 60))
+    patch_vary_headers(response, ('Accept',))
+    return response
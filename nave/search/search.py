@@ -1,15 +1,18 @@
 """All ES query related functionality goes into this module."""
 import collections
+import hashlib
 import itertools
 import logging
 import re
 import copy
+import threading
 import urllib.error
 import urllib.parse
 from collections import defaultdict, namedtuple
 from contextlib import contextmanager
 
 from django.conf import settings
+from django.core import signing
 from django.core.cache import caches
 from django.core.paginator import Paginator, Page, EmptyPage, PageNotAnInteger
 from django.http import QueryDict
@@ -17,23 +20,76 @@ from elasticsearch_dsl import Search, aggs, A
 from elasticsearch_dsl.response import Hit
 from elasticsearch_dsl.utils import AttrDict
 from elasticsearch_dsl.query import Q, Match, MatchPhrase
+from rest_framework.exceptions import ParseError
 from rest_framework.request import Request
 import six
 
 from nave.void.convertors import BaseConverter
 from nave.search.utils import gis
-from nave.search.connector import paging_cache
+from nave.search.connector import get_paging_cache
 
 
 logger = logging.getLogger(__name__)
 
 
+class InvalidCursor(ParseError):
+    """Raised for a cursor param that is invalid or belongs to a different query, answered with a 400."""
+
+
+class CompiledQueryCache(object):
+    """Bounded per process LRU of compiled queries."""
+
+    def __init__(self, max_size=None):
+        self.max_size = max_size if max_size is not None else getattr(settings, "SEARCH_QUERY_CACHE_SIZE", 1000)
+        self._entries = collections.OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        with self._lock:
+            compiled = self._entries.get(key)
+            if compiled is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return compiled
+
+    def set(self, key, compiled):
+        if not self.max_size:
+            return
+        with self._lock:
+            self._entries[key] = compiled
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            return {'size': len(self._entries), 'max_size': self.max_size, 'hits': self.hits, 'misses': self.misses}
+
+
+query_cache = CompiledQueryCache()
+
+
 class NaveESQuery(object):
     """
     This class builds ElasticSearch queries from default settings and HTTP request as provided by Django
 
+    Pages beyond the ElasticSearch result window are requested with search_after. The sort values
+    of the last hit of each deep page are stored in the paging cache under a key derived from the
+    normalised query params, so page N is resolved from the nearest cached page. The API also returns
+    an opaque cursor for the next page that can be passed back with the `cursor` param.
     """
 
+    max_result_window = getattr(settings, "SEARCH_MAX_RESULT_WINDOW", 10000)
+    cursor_salt = "nave.search.cursor"
+
     def __init__(self, index_name=None, doc_types=None, default_facets=None, size=16,
                  default_filters=None, hidden_filters=None, hidden_or_filters=None, cluster_geo=False,
                  geo_query=False, robust_params=True,
@@ -60,6 +116,10 @@ class NaveESQuery(object):
         self.facet_full = False
         self._is_item_query = False
         self.page = 1
+        self.start = 0
+        self.paging_key = None
+        self.search_after = None
+        self.page_beyond_end = False
         self.converter = converter
         self.non_legacy_keys = ['delving_deepZoomUrl', 'delving_geohash', 'delving_year', 'delving_thumbnail',
                                 'delving_fullTextObjectUrl', 'delving_fullText', 'delving_geohash', 'delving_spec']
@@ -209,7 +269,8 @@ class NaveESQuery(object):
         return self.index_name
 
     def _create_query(self):
-        query = Search().extra(track_total_hits=True)
+        # the pre-rendered detail documents are only returned by item queries
+        query = Search().extra(track_total_hits=True).source(excludes=['system.rendered'])
         if self.get_index_name:
             query = query.index(*self._as_list(self.get_index_name))
         if self.doc_types:
@@ -300,15 +361,17 @@ class NaveESQuery(object):
             clean_id = hub_id if hub_id else params.get('id')
             if self.nave_id_pattern.findall(clean_id):
                 doc_type, clean_id = clean_id.split('__')
-                query = query.query.query(Q("ids", values=[clean_id], type=doc_type))
+                query = query.query.source(excludes=None).query(Q("ids", values=[clean_id], type=doc_type))
                 self._is_item_query = True
             elif self.hub_id_pattern.findall(clean_id):
                 from nave.lod.utils.resolver import RDFRecord
                 clean_id = RDFRecord.clean_local_id(clean_id, is_hub_id=True)
                 if settings.ID_QUERY_CASE_INSENSITIVE:
-                    query = query.query.query(self._create_query_string("nave_id.value:{}".format(clean_id)))
+                    query = query.query.source(excludes=None).query(
+                        self._create_query_string("nave_id.value:{}".format(clean_id))
+                    )
                 else:
-                    query = query.query.query(Q("ids", values=[clean_id]))
+                    query = query.query.source(excludes=None).query(Q("ids", values=[clean_id]))
                 self._is_item_query = True
             else:
                 raise ValueError("unknown clean_id type: {}".format(clean_id))
@@ -328,6 +391,84 @@ class NaveESQuery(object):
         return q if not negative else ~q
 
     def build_query_from_request(self, request, raw_query_string=None):
+        """Build the ES query for the params of the request.
+
+        The compiled query body and the derived metadata are memoized in the query_cache under a
+        canonical key of the normalised params, the converter and the hidden and default filters.
+        """
+        if isinstance(request, Request):
+            request = request._request
+
+        # add ip based filters to hidden filters
+        from nave.lod.utils.resolver import RDFRecord
+        ip_filters = RDFRecord.get_filters_by_ip(request)
+        if ip_filters:
+            for spec in ip_filters:
+                if not self.hidden_filters:
+                    self.hidden_filters = []
+                self.hidden_filters.append('-delving_spec:{}'.format(spec))
+
+        key = self.create_compile_key(request, raw_query_string)
+        compiled = query_cache.get(key) if key else None
+        if compiled is not None:
+            return self.restore_compiled_query(compiled)
+        query = self.compile_query(request, raw_query_string)
+        if key and not (self._is_item_query or self.error_messages or self.search_after is not None or
+                        self.page_beyond_end):
+            query_cache.set(key, self.create_compiled_query())
+        return query
+
+    def create_compile_key(self, request, raw_query_string=None):
+        """Return the canonical key of everything that determines the compiled query, or None when it can not be cached."""
+        if raw_query_string or self.converter is not None:
+            params = QueryDict(raw_query_string if raw_query_string else request.META['QUERY_STRING'])
+        else:
+            params = request.GET
+        sort_by = params.get('sortBy', '')
+        if sort_by.startswith('random') and not sort_by.startswith('random_'):
+            return None
+        key = (
+            tuple(sorted((k, tuple(v)) for k, v in params.lists())),
+            bool(raw_query_string),
+            getattr(self.converter, '__name__', type(self.converter).__name__),
+            str(self.get_index_name),
+            str(self.doc_types),
+            str(self.default_filters),
+            str(self.hidden_filters),
+            str(self.hidden_or_filters),
+            tuple((facet.es_field, facet.size) for facet in self.default_facets),
+            self.size,
+            self.facet_size,
+            self.cluster_geo,
+            self.geo_query,
+            repr(self.query.to_dict()),
+        )
+        return hashlib.sha1(repr(key).encode('utf-8')).hexdigest()
+
+    def create_compiled_query(self):
+        """Return the serialized query body and the metadata derived while building it."""
+        return copy.deepcopy({
+            'body': self.query.to_dict(),
+            'applied_filters': self.applied_filters,
+            'facet_params': self.facet_params,
+            'base_params': self.base_params,
+            'default_facets': self.default_facets,
+            'facet_full': self.facet_full,
+            'facet_size': self.facet_size,
+            'size': self.size,
+            'page': self.page,
+            'start': self.start,
+            'paging_key': self.paging_key,
+        })
+
+    def restore_compiled_query(self, compiled):
+        compiled = copy.deepcopy(compiled)
+        self.query = self.query._clone().update_from_dict(compiled.pop('body'))
+        for attribute, value in compiled.items():
+            setattr(self, attribute, value)
+        return self.query
+
+    def compile_query(self, request, raw_query_string=None):
 
         @contextmanager
         def robust(key):
@@ -346,17 +487,6 @@ class NaveESQuery(object):
 
 
         query = self.query
-        if isinstance(request, Request):
-            request = request._request
-
-        # add ip based filters to hidden filters
-        from nave.lod.utils.resolver import RDFRecord
-        ip_filters = RDFRecord.get_filters_by_ip(request)
-        if ip_filters:
-            for spec in ip_filters:
-                if not self.hidden_filters:
-                    self.hidden_filters = []
-                self.hidden_filters.append('-delving_spec:{}'.format(spec))
 
         query_string = raw_query_string if raw_query_string else request.META['QUERY_STRING']
         if self.converter is not None:
@@ -386,7 +516,7 @@ class NaveESQuery(object):
 
         # remove non filter keys
         for key, value in list(facet_params.items()):
-            if key in ['start', 'page', 'rows', 'format', 'diw-version', 'lang', 'callback',
+            if key in ['start', 'page', 'cursor', 'rows', 'format', 'diw-version', 'lang', 'callback',
                        'facetBoolType', 'facet.limit', 'facet.full']:
                 del facet_params[key]
             if not value and key in facet_params:
@@ -400,7 +530,16 @@ class NaveESQuery(object):
                 except ValueError as ve:
                     logger.warn("invalid row value: {}".format(ve))
         # implement paging
-        if 'page' in params:
+        self.paging_key = self.create_paging_key(params)
+        search_after_start = None
+        cursor = self.parse_cursor(params.get('cursor')) if 'cursor' in params else None
+        if 'cursor' in params and cursor is None:
+            raise InvalidCursor(self.error_messages[-1])
+        if cursor is not None:
+            self.start, self.search_after = cursor
+            self.page = int(self.start / self.size) + 1
+            query = query[:self.size]
+        elif 'page' in params:
             with robust('page'):
                 page_param = params.get('page')
                 if page_param.endswith("'A=0"):
@@ -409,14 +548,12 @@ class NaveESQuery(object):
                 self.page = page
                 start = (page - 1) * self.size if page > 0 else 0
                 end = start + self.size
-                if end >= 10000:
-                    logger.warn("Switching to search after regular paging will break on this result window.")
-                    # import pdb; pdb.set_trace()
-                    # build new key from params and get cache
-                    # if not not found got to page 1000*10 set cache key and start paging
-                    # TODO add .extra search after
-                # else:
-                query = query[start:end]
+                self.start = start
+                if end > self.max_result_window:
+                    search_after_start = start
+                    query = query[:self.size]
+                else:
+                    query = query[start:end]
         elif 'start' in params and 'page' not in params:
             with robust('start'):
                 start = int(params.get('start'))
@@ -429,17 +566,15 @@ class NaveESQuery(object):
                 if page > 0:
                     self.page = page
                 end = start + self.size
-                if end >= 10000:
-                    # build new key from params and get cache
-                    # if not not found got to page 1000*10 set cache key and start paging
-                    logger.warn("Switching to search after regular paging will break on this result window.")
-                    # TODO add .extra search after
-                # else:
-                query = query[start:end]
+                self.start = start
+                if end > self.max_result_window:
+                    search_after_start = start
+                    query = query[:self.size]
+                else:
+                    query = query[start:end]
         else:
             query = query[:self.size]
 
-
         # add hidden filters
         exclude_filter_list = params.getlist("pop.filterkey")
         hidden_filter_dict = self._filters_as_dict(
@@ -716,6 +851,16 @@ class NaveESQuery(object):
                     negative_boost=settings.NEGATIVE_BOOST
                   )
             )
+        if search_after_start is not None:
+            self.search_after = self.resolve_search_after(query, search_after_start)
+            if self.search_after is None:
+                # return an empty page instead of the first page, so clients paging until an empty page stop
+                logger.info("page {} is beyond the end of the result set or without a stable sort order".format(
+                    self.page))
+                self.page_beyond_end = True
+                query = query[0:0]
+        if self.search_after is not None:
+            query = query.extra(search_after=self.search_after)
         self.query = query
         self.facet_params = facet_params
         self.base_params = params
@@ -726,6 +871,98 @@ class NaveESQuery(object):
         #  __import__('pdb').set_trace()
         return query
 
+    def create_paging_key(self, params):
+        """Return the paging cache key for the params without the paging params."""
+        normalised = sorted(
+            (key, value) for key, values in params.lists() for value in values
+            if key not in ['start', 'page', 'cursor', 'callback', 'format'] and not key.startswith('_')
+        )
+        normalised.append(('__rows', self.size))
+        normalised.append(('__index', str(self.get_index_name)))
+        normalised.append(('__hidden', str(self.hidden_filters)))
+        digest = hashlib.sha1(urllib.parse.urlencode(normalised).encode('utf-8')).hexdigest()
+        return "nave_search_after_{}".format(digest)
+
+    def _sort_values_key(self, offset):
+        return "{}_{}".format(self.paging_key, offset)
+
+    def cache_sort_values(self, offset, sort_values):
+        """Store the sort values of the last hit before offset, so the page starting at offset can use search_after."""
+        if self.paging_key is None or not sort_values:
+            return
+        timeout = getattr(settings, "SEARCH_PAGING_CACHE_TIMEOUT", 3600)
+        get_paging_cache().set(self._sort_values_key(offset), list(sort_values), timeout)
+
+    def create_cursor(self, offset, sort_values):
+        """Return an opaque cursor to continue paging at offset."""
+        return signing.dumps(
+            {'k': self.paging_key[-16:], 'o': offset, 's': list(sort_values)},
+            salt=self.cursor_salt,
+            compress=True
+        )
+
+    def parse_cursor(self, cursor):
+        """Return the offset and the sort values of a cursor created for the same query or None."""
+        try:
+            cursor = signing.loads(cursor, salt=self.cursor_salt)
+        except signing.BadSignature:
+            self.error_messages.append("param cursor: invalid cursor")
+            return None
+        if self.paging_key is None or cursor.get('k') != self.paging_key[-16:]:
+            self.error_messages.append("param cursor: the cursor belongs to a different query")
+            return None
+        return int(cursor['o']), cursor['s']
+
+    def resolve_search_after(self, query, start):
+        """Return the sort values of the last hit before start.
+
+        The results are walked with search_after from the nearest cached offset. The page
+        boundaries that are passed are stored in the paging cache for later requests.
+        """
+        body = query.to_dict()
+        if 'sort' not in body:
+            return None
+        cache = get_paging_cache()
+        lookback = getattr(settings, "SEARCH_AFTER_LOOKBACK", 50)
+        page_start = start - start % self.size
+        candidates = sorted(
+            {start} | {page_start - i * self.size for i in range(lookback)},
+            reverse=True
+        )
+        candidates = [offset for offset in candidates if 0 < offset <= start]
+        cached = cache.get_many([self._sort_values_key(offset) for offset in candidates])
+        offset, sort_values = 0, None
+        for candidate in candidates:
+            if self._sort_values_key(candidate) in cached:
+                offset, sort_values = candidate, cached[self._sort_values_key(candidate)]
+                break
+        for key in ['aggs', 'from', 'size', 'search_after']:
+            body.pop(key, None)
+        body['_source'] = False
+        body['track_total_hits'] = False
+        timeout = getattr(settings, "SEARCH_PAGING_CACHE_TIMEOUT", 3600)
+        while offset < start:
+            chunk = min(start - offset, self.max_result_window)
+            walk = Search.from_dict(dict(body, size=chunk))
+            if self.get_index_name:
+                walk = walk.index(*self._as_list(self.get_index_name))
+            if sort_values is not None:
+                walk = walk.extra(search_after=sort_values)
+            hits = walk.execute().hits.hits
+            if not hits:
+                return None
+            boundaries = {}
+            for i, hit in enumerate(hits, start=1):
+                position = offset + i
+                if position % self.size == 0 or position == start:
+                    boundaries[self._sort_values_key(position)] = list(hit['sort'])
+            cache.set_many(boundaries, timeout)
+            offset += len(hits)
+            sort_values = list(hits[-1]['sort'])
+            if len(hits) < chunk and offset < start:
+                return None
+        return sort_values
+
     def check_facet_key(self, facet, key):
         """Check if the key and facet match."""
         clean_facet = facet.split('.', maxsplit=1)[0]
@@ -779,6 +1016,38 @@ class NaveESQuery(object):
                 break
         yield ']\n'
 
+    def build_geo_point_search(self, request, tile=None, point_field="point"):
+        """Return the search for all records of the request with a point, optionally clipped to a z/x/y tile."""
+        # build_query_from_request reads the params of the underlying request of a DRF Request
+        if isinstance(request, Request):
+            request = request._request
+        params = request.GET.copy()
+        for key in ['start', 'page', 'facet', 'cursor']:
+            if key in params:
+                params.pop(key)
+        self.default_facets = []
+        request.GET = params
+        search = self.build_query_from_request(request)
+        search = search.filter({'exists': {'field': point_field}})
+        if tile:
+            search = search.filter(gis.create_tile_filter(*tile, key=point_field))
+        return search
+
+    def get_geo_points(self, search, point_field="point", slices=None):
+        """Yield (hub_id, lat, lon) for every point of the search.
+
+        Only the doc values of the point field are read, using a sliced scroll.
+        """
+        from nave.search.export import sliced_scan
+        search_dict = search.to_dict()
+        body = {key: value for key, value in search_dict.items() if key in ['query', 'post_filter']}
+        body['_source'] = False
+        body['docvalue_fields'] = [point_field]
+        for hit in sliced_scan(body, index=self.index_name, slices=slices):
+            for value in hit.get('fields', {}).get(point_field, []):
+                lat, lon = gis.parse_point(value)
+                yield hit['_id'], lat, lon
+
     def query_to_facet_key(self, facet_key):
         if facet_key.startswith('delving_spec'):
             facet_key = "system.spec.raw"
@@ -802,37 +1071,87 @@ class NaveESQuery(object):
         return facet_dict
 
 
+class FacetLinkParams(object):
+    """The parts of the facet links that are shared by all FacetCountLinks of a query.
+
+    The params are cleaned and urlencoded once, the link of each facet value is then
+    created by appending its encoded filter query.
+    """
+    ignored_params = ['start', 'page', 'rows', 'format', 'diw-version', 'lang', 'callback', 'query', 'q',
+                      'facet.limit', 'facetBoolType', 'facet', 'facet.reset']
+
+    def __init__(self, query):
+        self._query = query
+        self._converter = query.converter
+        facet_params = query.facet_params.copy()
+        for key, value in list(facet_params.items()):
+            if key in self.ignored_params:
+                del facet_params[key]
+            if not value and key in facet_params:
+                del facet_params[key]
+        self._facet_params = facet_params
+        self.selected_filters = query.facet_params.getlist('qf')
+        self.selected = set(self.selected_filters)
+        # todo: later replace the replace statements with urlencode() as well for query filters
+        self._base_link = self._convert(facet_params.urlencode().replace('qf=', 'qf[]=')) if facet_params else ""
+        self._clean_names = {}
+
+    def _convert(self, link):
+        if not self._converter:
+            return link
+        return self._query.apply_converter_rules(
+            query_string=link,
+            converter=self._converter,
+            as_query_dict=False,
+            reverse=True
+        )
+
+    def clean_name(self, facet_name):
+        if facet_name not in self._clean_names:
+            if self._converter:
+                self._clean_names[facet_name] = self._query.apply_converter_rules(
+                    query_string=facet_name,
+                    converter=self._converter,
+                    as_query_dict=False,
+                    reverse=False
+                )
+            else:
+                self._clean_names[facet_name] = facet_name
+        return self._clean_names[facet_name]
+
+    def create_link(self, filter_query, is_selected):
+        """Return the link that toggles the filter_query in the current facet params."""
+        if is_selected:
+            facet_params = self._facet_params.copy()
+            facet_params.setlist('qf', [facet for facet in self.selected_filters if facet != filter_query])
+            link = self._convert(facet_params.urlencode())
+        else:
+            filter_link = self._convert("qf[]={}".format(
+                filter_query.replace(":", "%3A").replace("&", "%26").replace(';', '%3B')
+            ))
+            link = "{}&{}".format(self._base_link, filter_link) if self._base_link else filter_link
+        if not link:
+            return ""
+        if self._converter:
+            return link if link.startswith("&") else "&{}".format(link)
+        return link if link.startswith("?") else "?{}".format(link)
+
+
 class FacetCountLink(object):
-    def __init__(self, facet_name, value, count, query):
+    def __init__(self, facet_name, value, count, query, link_params=None):
         self._value = value
         self._count = count
         self._name = facet_name
-        self._clean_name = None
         self._query = query
+        self._link_params = link_params if link_params is not None else FacetLinkParams(query)
         self._filter_query = "{}:{}".format(self._get_clean_name, self._value)
-        self._facet_params = self._query.facet_params.copy()
-        self._is_selected = self._set_is_selected()
+        self._is_selected = None
         self._link = None
         self._full_link = None
 
     @property
     def _get_clean_name(self):
-        if not self._clean_name:
-            if self._query.converter:
-                self._clean_name = self._query.apply_converter_rules(
-                    query_string=self._name,
-                    converter=self._query.converter,
-                    as_query_dict=False,
-                    reverse=False
-                )
-            else:
-                self._clean_name = self._name
-        return self._clean_name
-
-    def _set_is_selected(self):
-        filter_query = self._filter_query
-        filter_params = self._facet_params.getlist('qf')
-        return filter_query in filter_params
+        return self._link_params.clean_name(self._name)
 
     @property
     def value(self):
@@ -852,40 +1171,7 @@ class FacetCountLink(object):
     @property
     def link(self):
         if not self._link:
-            facet_params = self._facet_params.copy()
-            for key, value in list(facet_params.items()):
-                if key in ['start', 'page', 'rows', 'format', 'diw-version', 'lang', 'callback', 'query', 'q',
-                           'facet.limit', 'facetBoolType', 'facet', 'facet.reset']:
-                    del facet_params[key]
-                if not value and key in facet_params:
-                    del facet_params[key]
-            selected_facets = self._facet_params.getlist('qf')
-            # todo: later replace the replace statements with urlencode() as well for query filters
-            if facet_params:
-                link = "{}&qf[]={}".format(
-                    facet_params.urlencode().replace('qf=', 'qf[]='),
-                    self._filter_query.replace(":", "%3A").replace("&", "%26").replace(';', '%3B')
-                )
-            else:
-                link = "qf[]={}".format(
-                    self._filter_query.replace(":", "%3A").replace("&", "%26").replace(';', '%3B')
-                )
-            if self.is_selected:
-                selected_facets = [facet for facet in selected_facets if facet != self._filter_query]
-                facet_params.setlist('qf', selected_facets)
-                link = "{}".format(facet_params.urlencode())
-            if not link:
-                return ""
-            if self._query.converter:
-                link = self._query.apply_converter_rules(
-                    query_string=link,
-                    converter=self._query.converter,
-                    as_query_dict=False,
-                    reverse=True
-                )
-                self._link = link if link.startswith("&") else "&{}".format(link)
-            else:
-                self._link = link if link.startswith("?") else "?{}".format(link)
+            self._link = self._link_params.create_link(self._filter_query, self.is_selected)
         return self._link
 
     @property
@@ -901,6 +1187,8 @@ class FacetCountLink(object):
 
     @property
     def is_selected(self):
+        if self._is_selected is None:
+            self._is_selected = self._filter_query in self._link_params.selected
         return self._is_selected
 
     def __repr__(self):
@@ -912,7 +1200,7 @@ class FacetCountLink(object):
 
 class FacetLink(object):
     def __init__(self, name, facet_terms, query, total=0, other=0,
-                 missing=0, doc_count=0):
+                 missing=0, doc_count=0, link_params=None):
         self._name = name
         self._clean_name = None
         self._i18n = None
@@ -923,6 +1211,7 @@ class FacetLink(object):
         self._query = query
         self._facet_terms = facet_terms
         self._is_selected = False
+        self._link_params = link_params if link_params is not None else FacetLinkParams(query)
         self._facet_count_links = self._create_facet_count_links()
 
     def _create_facet_count_links(self):
@@ -931,7 +1220,7 @@ class FacetLink(object):
             count = term.doc_count
             value = term.key
             facet_count_links.append(
-                    FacetCountLink(self._name, value, count, self._query)
+                    FacetCountLink(self._name, value, count, self._query, link_params=self._link_params)
             )
         return facet_count_links
 
@@ -1004,6 +1293,7 @@ class NaveFacets(object):
     def __init__(self, nave_query, facets):
         self._nave_query = nave_query
         self._facets = NaveFacets._respect_facet_config_ordering(facets, nave_query.default_facets)
+        self._link_params = FacetLinkParams(nave_query)
         self._facet_querylinks = self._create_facet_query_links()
 
     @staticmethod
@@ -1043,7 +1333,8 @@ class NaveFacets(object):
                 other=other_docs,
                 query=self._nave_query,
                 facet_terms=facet,
-                doc_count=doc_count
+                doc_count=doc_count,
+                link_params=self._link_params
             )
             facet_query_links[key] = facet_query_link
         return facet_query_links
@@ -1196,10 +1487,15 @@ class ESPage(Page):
 
 
 class QueryPagination(object):
-    def __init__(self, paginator, current_page=1):
+    def __init__(self, paginator, current_page=1, cursor=None):
         self._paginator = paginator
         self._page = self._paginator.page(current_page)
         self._links = None
+        self._cursor = cursor
+
+    @property
+    def cursor(self):
+        return self._cursor
 
     @property
     def page(self):
@@ -1504,15 +1800,31 @@ class NaveQueryResponse(object):
         self._geojson_clusters = None
         self._paginator = None
         self._rows = self._query.size
+        if self._query.start + 2 * self._rows > self._query.max_result_window:
+            self.set_cache_page()
 
     def set_cache_page(self):
-       """Set the seach_after key for ElasticSearch."""
-       sort_key = self._result.hits[-1].meta.sort
-       # todo implement the rest
-       # get all params replace start or page append __ number
-       page_key = ''
-       page_cache.set(page_key, str(sort_key), 300)
+        """Store the search_after sort values of the last hit so the next page does not need from+size paging.
+
+        :return: the offset of the next page or None
+        """
+        hits = self.es_results.hits.hits
+        if not hits or 'sort' not in hits[-1]:
+            return None
+        offset = self._query.start + len(hits)
+        self._query.cache_sort_values(offset, hits[-1]['sort'])
+        return offset
 
+    @property
+    def next_cursor(self):
+        """Return the opaque cursor for the next page or None."""
+        hits = self.es_results.hits.hits
+        if not hits or 'sort' not in hits[-1] or self._query.paging_key is None:
+            return None
+        offset = self._query.start + len(hits)
+        if offset >= self.num_found:
+            return None
+        return self._query.create_cursor(offset, hits[-1]['sort'])
 
     @property
     def query(self):
@@ -1549,7 +1861,8 @@ class NaveQueryResponse(object):
         if not self._pagination:
             self._pagination = QueryPagination(
                     self.paginator,
-                    self._query.page
+                    self._query.page,
+                    cursor=self.next_cursor
             )
         return self._pagination
 
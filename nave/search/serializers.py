@@ -93,6 +93,7 @@ class QueryPaginationSerializer(serializers.Serializer):
     firstPage = serializers.IntegerField(source="first_page")
     lastPage = serializers.IntegerField(source="last_page")
     links = PageLinkSerializer(many=True)
+    cursor = serializers.CharField()
 
 
 class NaveESFieldSerializer(serializers.BaseSerializer):
@@ -3,17 +3,12 @@
 
 """
 import os
-import time
 import uuid
 
 from celery import shared_task
 from celery.task import task
 from celery.utils.log import get_task_logger
 from django.conf import settings
-from elasticsearch.helpers import scan
-
-from nave.search.connector import es_client as es
-from nave.search.search import NaveESItemList
 
 logger = get_task_logger(__name__)
 
@@ -28,66 +23,38 @@ def clean_up_old_downloads():
     pass
 
 
-@task()
-def download_all_search_results(query_dict, index_name, converter,
-                                doc_types, response_format='json'):
+@task(bind=True, ignore_result=False)
+def download_all_search_results(self, query_dict, index_name, converter=None, response_format='json',
+                                name=None, compress=True, username=None):
     """
-    This function creates a downloadable zip-file for a ElasticSearch
-    result set that will be emailed to the user.
+    Export all results of an ElasticSearch query to a file in the ZIPPED_SEARCH_RESULTS_DOWNLOAD_FOLDER.
 
+    The progress is reported in the task state, see BigDownloadView.
 
-    # TODO update the parameters for the function
-    :type query_dict: object
-    :return: path to object returned
+    :param query_dict: the ElasticSearch query as dict
+    :param converter: key of the registered converter applied to the JSON exports
+    :param response_format: one of the keys of nave.search.export.EXPORT_WRITERS
+    :param username: the user that requested the export, only this user can download the file
+    :return: link, query, the number of records, the format, the path of the export and the username
     """
-    # response_format = request.GET.get('format', 'json')
-    # if not request.user.is_authenticated():
-    #     logger.warn("Only logged in users can create a download request.")
-    #     return 0
-    # else:
-    #     user = request.user
-    # with open(os.path.join(settings.ZIPPED_SEARCH_RESULTS_DOWNLOAD_FOLDER,
-    #                        "{}_{}.{}".format(user.username, uuid.uuid1(), response_format))) as f:
-    #     pass
-
-    # ensure download dir exist
-
-    downloader = scan(
-        client=es,
-        query=query_dict,
-        index=index_name,
-        doc_type=doc_types
-    )
+    from django.core.urlresolvers import reverse
+    from nave.search.export import SearchExport, get_export_writer
+    from nave.void import REGISTERED_CONVERTERS
+
+    download_folder = settings.ZIPPED_SEARCH_RESULTS_DOWNLOAD_FOLDER
+    os.makedirs(download_folder, exist_ok=True)
+    writer = get_export_writer(response_format, converter=REGISTERED_CONVERTERS.get(converter))
+    export = SearchExport(search=query_dict, index=index_name, writer=writer)
     download_file = os.path.join(
-        settings.ZIPPED_SEARCH_RESULTS_DOWNLOAD_FOLDER,
-        "{}_{}.{}".format(uuid.uuid1(), converter, response_format))
-    with open(download_file, 'w') as f:
-        f.write('[\n')
-        for results in downloader:
-            items = NaveESItemList(
-                results=results,
-                converter=converter
-            ).items
-            f.write(items)
-            # todo serializers for other formats than JSON
-        f.write('\n]\n')
-
+        download_folder,
+        export.get_file_name(name or "{}_{}".format(uuid.uuid1(), response_format), compress=compress)
+    )
 
-    # create elasticsearch.helper.scan object
-    # for each response convert to Nave Response Item and apply converter
-    # write the records to file
-    # when done create download link
-    # compose email to user with
-    # - link
-    # - query
-    # - records saved
-    # - format
-    # - request time
+    def progress(records):
+        self.update_state(state='PROGRESS', meta={'records': records})
 
-    logger.info("started")
-    time.sleep(3)
-    logger.info("ended")
-    logger.info(query_dict)
-    link = "link"
-    records_returned = 10
-    return link, query_dict, records_returned, format
+    logger.info("Started export of {} to {}".format(query_dict, download_file))
+    records = export.write_to_file(download_file, compress=compress, progress=progress)
+    logger.info("Exported {} records to {}".format(records, download_file))
+    link = "{}?file=true".format(reverse('big_download', kwargs={'id': self.request.id}))
+    return link, query_dict, records, response_format, download_file, username
@@ -0,0 +1,84 @@
+# -*- coding: utf-8 -*-
+"""Test the search result export writers."""
+import json
+
+from elasticsearch_dsl import Search
+
+from nave.search.export import CSVWriter, JSONArrayWriter, JSONLinesWriter, NTriplesWriter, SearchExport
+
+HIT = {
+    '_id': 'spec_1',
+    '_source': {
+        'dc_title': [{'value': 'Title', 'raw': 'Title'}, {'value': 'Other title', 'raw': 'Other title'}],
+        'dc_creator': [{'value': 'Smits, Ton', 'raw': 'Smits, Ton'}],
+        'system': {'source_graph': '<http://example.com/1> <http://purl.org/dc/elements/1.1/title> "Title" .'},
+    }
+}
+
+
+def _export(writer, hits):
+    return writer.header() + "".join(writer.write(hit) for hit in hits) + writer.footer()
+
+
+def test__json_array_writer__writes_valid_json():
+    output = json.loads(_export(JSONArrayWriter(), [HIT, HIT]))
+    assert len(output) == 2
+    assert output[0]['doc_id'] == 'spec_1'
+    assert output[0]['fields']['dc_creator'][0]['value'] == 'Smits, Ton'
+
+
+def test__json_lines_writer__writes_line_per_hit():
+    lines = _export(JSONLinesWriter(), [HIT, HIT]).splitlines()
+    assert len(lines) == 2
+    assert json.loads(lines[1])['doc_id'] == 'spec_1'
+
+
+def test__csv_writer__joins_values():
+    writer = CSVWriter(fields=['dc_title', 'dc_creator'])
+    lines = _export(writer, [HIT]).splitlines()
+    assert lines[0] == 'hub_id,dc_title,dc_creator'
+    assert lines[1] == 'spec_1,Title | Other title,"Smits, Ton"'
+
+
+def test__ntriples_writer__passes_through_ntriples():
+    assert NTriplesWriter().write(HIT) == HIT['_source']['system']['source_graph'] + "\n"
+
+
+def test__search_export__body_without_paging_and_aggregations():
+    search = Search().query("match", dc_title="title").post_filter("term", **{'delving_spec.raw': 'spec'})
+    search = search.sort('_id').extra(size=10)
+    search.aggs.bucket('spec', 'terms', field='delving_spec.raw')
+    body = SearchExport(search, index='test', writer=NTriplesWriter()).get_body()
+    assert sorted(body.keys()) == ['_source', 'post_filter', 'query']
+    assert body['_source'] == {'includes': ['system.source_graph']}
+
+
+def test__big_download_view__content_type_from_the_file():
+    from nave.search.views import BigDownloadView
+    assert BigDownloadView.get_content_type("/tmp/export.csv.gz", "csv") == "application/gzip"
+    assert BigDownloadView.get_content_type("/tmp/export.csv", "csv") == "text/csv"
+
+
+def test__big_download_view__only_serves_the_requesting_user(monkeypatch):
+    import pytest
+    from django.contrib.auth.models import AnonymousUser
+    from django.http import Http404
+    from django.test import RequestFactory
+    from nave.search import views
+
+    class FakeTaskResult:
+        state = 'SUCCESS'
+        result = ("/download?file=true", {}, 10, 'csv', "/tmp/export.csv.gz", 'owner')
+
+    class FakeUser:
+        username = 'other'
+
+        def is_authenticated(self):
+            return True
+
+    monkeypatch.setattr(views.download_all_search_results, "AsyncResult", lambda task_id: FakeTaskResult())
+    request = RequestFactory().get("/api/download/task/1/?file=true")
+    for user in [AnonymousUser(), FakeUser()]:
+        request.user = user
+        with pytest.raises(Http404):
+            views.BigDownloadView.as_view()(request, id='1')
@@ -0,0 +1,38 @@
+# -*- coding: utf-8 -*-
+"""Test the cache keys of the geohash cluster tiles."""
+from django.http import QueryDict
+
+from nave.search import geo_cluster
+
+
+def test__cluster_tile_key__ignores_paging_and_order():
+    first = QueryDict('q=amsterdam&qf=dc_type:foto&qf=delving_spec:spec&rows=10&start=20')
+    second = QueryDict('qf=delving_spec:spec&qf=dc_type:foto&q=amsterdam')
+    assert geo_cluster.get_cluster_tile_key(first, 'nave', 5, 16, 10) == \
+        geo_cluster.get_cluster_tile_key(second, 'nave', 5, 16, 10)
+    assert geo_cluster.get_cluster_tile_key(first, 'nave', 5, 16, 10) != \
+        geo_cluster.get_cluster_tile_key(first, 'nave', 5, 16, 11)
+
+
+def test__invalidate_cluster_tiles__changes_keys():
+    params = QueryDict('q=amsterdam')
+    key = geo_cluster.get_cluster_tile_key(params, 'nave', 5, 16, 10)
+    geo_cluster.invalidate_cluster_tiles()
+    assert geo_cluster.get_cluster_tile_key(params, 'nave', 5, 16, 10) != key
+
+
+def test__cluster_tile_key__depends_on_the_ip_spec_filters(settings):
+    from django.test import RequestFactory
+    from nave.search.search import NaveESQuery
+    settings.IP_SPEC_WHITE_LIST = {'restricted': ['10.0.0.1']}
+    whitelisted = RequestFactory().get('/tiles?q=amsterdam', REMOTE_ADDR='10.0.0.1')
+    other = RequestFactory().get('/tiles?q=amsterdam', REMOTE_ADDR='10.0.0.2')
+    query_factory = NaveESQuery(index_name='nave')
+    assert geo_cluster.get_hidden_filters(query_factory, whitelisted) == []
+    assert geo_cluster.get_hidden_filters(query_factory, other) == ['-delving_spec:restricted']
+
+    def get_key(request):
+        hidden_filters = geo_cluster.get_hidden_filters(query_factory, request)
+        return geo_cluster.get_cluster_tile_key(request.GET, 'nave', 5, 16, 10, hidden_filters=hidden_filters)
+
+    assert get_key(whitelisted) != get_key(other)
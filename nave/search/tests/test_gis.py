@@ -0,0 +1,53 @@
+# -*- coding: utf-8 -*-
+"""Test the binary geo encodings."""
+import pytest
+
+from nave.search.utils import gis, geohash
+from nave.search.utils.vector_tile import PointLayer, encode_tile
+
+
+def test__pack_points__round_trip():
+    points = [(52.370216, 4.895168), (51.924420, 4.477733), (-33.868820, 151.209296)]
+    buffer = b"".join(gis.pack_points(points))
+    assert len(buffer) == 8 + 8 * len(points)
+    assert gis.unpack_points(buffer) == pytest.approx(points)
+
+
+def test__parse_point__object_and_string():
+    assert gis.parse_point({'lat': 52.1, 'lon': 4.2}) == (52.1, 4.2)
+    assert gis.parse_point("52.1, 4.2") == (52.1, 4.2)
+
+
+def test__tile_bounds():
+    west, south, east, north = gis.tile_bounds(0, 0, 0)
+    assert (west, east) == (-180.0, 180.0)
+    assert north == pytest.approx(85.0511, abs=1e-4)
+    assert south == pytest.approx(-85.0511, abs=1e-4)
+    assert gis.tile_bounds(1, 1, 0)[:2] == (0.0, pytest.approx(0.0))
+
+
+def test__point_layer__only_keeps_points_in_tile():
+    layer = PointLayer("points", 1, 1, 0)
+    assert layer.add_point(52.370216, 4.895168, properties={'hub_id': 'spec_1'})
+    assert not layer.add_point(-33.868820, 151.209296, properties={'hub_id': 'spec_2'})
+    assert len(layer) == 1
+    tile = encode_tile(layer)
+    # layer field 3 with the layer name and the property value
+    assert tile[0] == (3 << 3) | 2
+    assert b"points" in tile and b"spec_1" in tile
+
+
+def test__decode_many__matches_decode_exactly():
+    hashes = ['u173zq', 'u15', 'r3gx2f9tt5', 'ezs42']
+    for geo_hash, (lat, lon) in zip(hashes, geohash.decode_many(hashes)):
+        exact_lat, exact_lon = geohash.decode_exactly(geo_hash)[:2]
+        assert lat == pytest.approx(exact_lat)
+        assert lon == pytest.approx(exact_lon)
+
+
+def test__zoom_to_geohash_precision():
+    assert gis.zoom_to_geohash_precision(0) == 1
+    assert gis.zoom_to_geohash_precision(10) == 5
+    precisions = [gis.zoom_to_geohash_precision(zoom) for zoom in range(0, 23)]
+    assert precisions == sorted(precisions)
+    assert max(precisions) <= 12
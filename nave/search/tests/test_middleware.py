@@ -0,0 +1,28 @@
+# -*- coding: utf-8 -*-
+"""Test the APILoggingMiddleware."""
+from nave.search.middleware import APILogQueue, APILoggingMiddleware
+
+
+class FakeResponse:
+    status_code = 200
+    data = {'result': {
+        'pagination': {'numFound': 12},
+        'facets': [{'name': 'dc_subject'}, {'name': 'delving_spec'}]
+    }}
+
+
+def test__api_log_queue__drops_oldest_entries():
+    queue = APILogQueue(max_size=2, batch_size=10, flush_interval=60)
+    queue._ensure_thread = lambda: None
+    for entry in ['first', 'second', 'third']:
+        queue.put(entry)
+    assert list(queue._entries) == ['second', 'third']
+    assert queue.stats()['dropped'] == 1
+    assert queue.stats()['queued'] == 3
+
+
+def test__get_response_info__reads_unrendered_data():
+    info = APILoggingMiddleware.get_response_info(FakeResponse())
+    assert info['status_code'] == 200
+    assert info['numFound'] == 12
+    assert info['facets'] == ['dc_subject', 'delving_spec']
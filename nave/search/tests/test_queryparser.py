@@ -2,6 +2,7 @@
 """ Test Nave QueryParser."""
 from functools import partial
 
+from django.http import QueryDict
 from django.test import TestCase
 
 from nave.search.search import NaveESQuery
@@ -37,3 +38,90 @@ def test_multi_string_query_cleanup():
         query_string="dc_subject_facet:bloem AND dc_title_text:roos"
     )
     res == "dc_subject.raw:bloem AND dc_title.value:roos"
+
+
+def test_paging_key_ignores_paging_params():
+    query = NaveESQuery(index_name="test")
+    key = query.create_paging_key(QueryDict("q=bloemen&qf=dc_subject:roos&page=700"))
+    assert key == query.create_paging_key(QueryDict("qf=dc_subject:roos&q=bloemen&start=30"))
+    assert key != query.create_paging_key(QueryDict("q=tulpen&page=700"))
+
+
+def test_cursor_round_trip():
+    query = NaveESQuery(index_name="test")
+    query.paging_key = query.create_paging_key(QueryDict("q=bloemen"))
+    cursor = query.create_cursor(10016, [1.5, "test_hub_id", 1470000000])
+    assert query.parse_cursor(cursor) == (10016, [1.5, "test_hub_id", 1470000000])
+    other = NaveESQuery(index_name="test")
+    other.paging_key = other.create_paging_key(QueryDict("q=tulpen"))
+    assert other.parse_cursor(cursor) is None
+    assert other.parse_cursor("invalid") is None
+
+
+def test_compile_key_is_canonical():
+    from django.test import RequestFactory
+    query = NaveESQuery(index_name="test")
+    key = query.create_compile_key(RequestFactory().get("/search?q=bloemen&qf=dc_subject:roos&qf=dc_type:foto"))
+    assert key == query.create_compile_key(
+        RequestFactory().get("/search?qf=dc_subject:roos&q=bloemen&qf=dc_type:foto"))
+    assert key != query.create_compile_key(RequestFactory().get("/search?q=tulpen"))
+    assert query.create_compile_key(RequestFactory().get("/search?q=bloemen&sortBy=random")) is None
+
+
+def test_compiled_query_cache_is_bounded():
+    from nave.search.search import CompiledQueryCache
+    cache = CompiledQueryCache(max_size=2)
+    cache.set("a", {'body': 1})
+    cache.set("b", {'body': 2})
+    assert cache.get("a") == {'body': 1}
+    cache.set("c", {'body': 3})
+    assert cache.get("b") is None
+    assert cache.get("a") is not None and cache.get("c") is not None
+    assert cache.stats()['size'] == 2
+
+
+def test_facet_links_toggle_filter_query():
+    from nave.search.search import FacetCountLink, FacetLinkParams
+    query = NaveESQuery(index_name="test")
+    query.facet_params = QueryDict("q=bloemen&qf=dc_type:foto&rows=10&facet.limit=5")
+    query.base_params = query.facet_params
+    link_params = FacetLinkParams(query)
+    added = FacetCountLink("dc_subject", "roos", 3, query, link_params=link_params)
+    assert not added.is_selected
+    assert added.link == "?qf[]=dc_type%3Afoto&qf[]=dc_subject%3Aroos"
+    selected = FacetCountLink("dc_type", "foto", 5, query, link_params=link_params)
+    assert selected.is_selected
+    assert selected.link == ""
+    assert FacetCountLink("dc_subject", "roos", 3, query).link == added.link
+
+
+def test_page_beyond_the_end_returns_empty_page(monkeypatch):
+    from django.test import RequestFactory
+    monkeypatch.setattr(NaveESQuery, "resolve_search_after", lambda self, query, start: None)
+    query = NaveESQuery(index_name="test", size=20)
+    search = query.build_query_from_request(RequestFactory().get("/search?q=bloemen&rows=20&page=1000"))
+    assert search.to_dict()['size'] == 0
+    assert query.page == 1000
+    assert query.start == 19980
+    assert query.page_beyond_end
+
+
+def test_invalid_cursor_is_rejected():
+    import pytest
+    from django.test import RequestFactory
+    from nave.search.search import InvalidCursor
+    query = NaveESQuery(index_name="test")
+    with pytest.raises(InvalidCursor) as error:
+        query.build_query_from_request(RequestFactory().get("/search?q=bloemen&cursor=invalid"))
+    assert error.value.status_code == 400
+    assert "invalid cursor" in str(error.value.detail)
+
+
+def test_geo_point_search_ignores_paging_and_facets_of_drf_request():
+    from django.test import RequestFactory
+    from rest_framework.request import Request
+    query = NaveESQuery(index_name="test")
+    request = Request(RequestFactory().get("/search?q=bloemen&cursor=invalid&facet=dc_type&start=40"))
+    search = query.build_geo_point_search(request)
+    assert 'aggs' not in search.to_dict()
+    assert 'cursor' not in request.GET and 'facet' not in request.GET
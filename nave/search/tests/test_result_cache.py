@@ -0,0 +1,54 @@
+# -*- coding: utf-8 -*-
+"""Test the shared cache of serialized search responses."""
+from django.http import QueryDict
+
+from nave.search import result_cache
+from nave.search.search import NaveESQuery
+
+
+def test__get_query_specs__only_positive_spec_filters():
+    query = NaveESQuery(index_name="test", hidden_filters=['-delving_spec:blocked'])
+    query.base_params = QueryDict('q=amsterdam&qf=delving_spec:Spec&qf=dc_type:foto')
+    assert result_cache.get_query_specs(query) == ['spec']
+    query.base_params = QueryDict('q=amsterdam')
+    assert result_cache.get_query_specs(query) == []
+
+
+def test__invalidate_search_results__is_scoped_by_spec():
+    cache = result_cache.get_result_cache()
+    unfiltered = result_cache.get_generations(cache, [])
+    spec = result_cache.get_generations(cache, ['spec'])
+    other = result_cache.get_generations(cache, ['other'])
+    result_cache.invalidate_search_results('Spec')
+    assert result_cache.get_generations(cache, []) != unfiltered
+    assert result_cache.get_generations(cache, ['spec']) != spec
+    assert result_cache.get_generations(cache, ['other']) == other
+    result_cache.invalidate_search_results()
+    assert result_cache.get_generations(cache, ['other']) != other
+
+
+def test__get_cached_entry__computes_once():
+    calls = []
+
+    def get_data():
+        calls.append(1)
+        return {'result': {'items': []}}
+
+    first = result_cache.get_cached_entry("search_result:test", get_data)
+    second = result_cache.get_cached_entry("search_result:test", get_data)
+    assert len(calls) == 1
+    assert first['data'] == {'result': {'items': []}}
+    assert first['etag'] == second['etag']
+    result_cache.get_result_cache().delete("search_result:test")
+
+
+def test__patch_response_headers__private_with_ip_spec_white_list(settings):
+    from django.http import HttpResponse
+    entry = {'etag': '"abc"', 'last_modified': 0}
+    settings.IP_SPEC_WHITE_LIST = {}
+    response = result_cache.patch_response_headers(HttpResponse(), entry)
+    assert 'public' in response['Cache-Control']
+    settings.IP_SPEC_WHITE_LIST = {'restricted': ['10.0.0.1']}
+    response = result_cache.patch_response_headers(HttpResponse(), entry)
+    assert 'private' in response['Cache-Control']
+    assert 'public' not in response['Cache-Control']
@@ -8,7 +8,8 @@ from nave.search.viewsets import GroupViewSet
 from nave.search.viewsets import UserViewSet, OauthTokenViewSet
 from .views import DetailResultView, FoldOutDetailImageView, \
     LegacyAPIRedirectView, SearchListHTMLView, LodRelatedSearchHTMLView, V1SearchListApiView, \
-    V2SearchListApiView, BigDownloadView, KNReiseGeoView
+    V2SearchListApiView, BigDownloadView, KNReiseGeoView, GeoTileView, \
+    ClusterTileView
 
 router = routers.SimpleRouter(trailing_slash=True)
 router.register(r'search/v1', V1SearchListApiView, base_name='v1-list')
@@ -29,6 +30,9 @@ urlpatterns = [
     # redirect
     url(r'^organizations/.*?/api/search/?$', LegacyAPIRedirectView.as_view(), name='api_redirect_hub1'),
     url(r'^api/download/task/(?P<id>(.*))/$', BigDownloadView.as_view(), name='big_download'),
+    url(r'^api/geo/clusters/(?P<z>\d+)/(?P<x>\d+)/(?P<y>\d+)\.geojson$', ClusterTileView.as_view(),
+        name='geo_cluster_tile'),
+    url(r'^api/geo/tiles/(?P<z>\d+)/(?P<x>\d+)/(?P<y>\d+)\.mvt$', GeoTileView.as_view(), name='geo_tile'),
     url(r'^detail/foldout/(?P<doc_type>([^/]*))/(?P<slug>(.*?))/?$', DetailResultView.as_view(), name='results_detail_foldout'),
     url(r'^detail/(?P<slug>(.*))$', DetailResultView.as_view(template_name="search-detail.html"), name='result_detail'),
     url(r'^detail/fold-out/(?P<slug>(.*))$', DetailResultView.as_view(), name='results_detail_foldout'),
@@ -1,4 +1,5 @@
 import math
+import struct
 
 import geojson
 from geojson import Feature, FeatureCollection, Point
@@ -92,15 +93,25 @@ def get_bounding_box_params(params):
     return bounding_box_params
 
 
+def zoom_to_geohash_precision(zoom, cells_per_tile=8):
+    """Return the geohash precision with about cells_per_tile cells along the width of a tile at zoom."""
+    cell_width = 360.0 / (2 ** zoom) / cells_per_tile
+    for precision in range(1, 13):
+        # a geohash of precision p has ceil(5p / 2) longitude bits
+        if 360.0 / 2 ** ((5 * precision + 1) // 2) <= cell_width:
+            return precision
+    return 12
+
+
 def get_feature_collection(facets):
     features = []
     if 'geo_clusters' in facets:
         clusters = facets['geo_clusters']
-        for place in clusters.buckets:
+        buckets = list(clusters.buckets)
+        points = geohash.decode_many([place.key for place in buckets])
+        for place, (lat, lon) in zip(buckets, points):
             total = place.doc_count
-            geo_hash = place.key
-            lat, lon = geohash.decode(geo_hash)
-            center_point = Point(coordinates=(float(lon), float(lat)))
+            center_point = Point(coordinates=(lon, lat))
             properties = {'count': total}
             # todo: get the doc_id for individual keys as extra queries. doc_id is no longer returned.
             feature_id = None  # place.get('doc_id')
@@ -121,3 +132,82 @@ def places_as_geojson(facets):
 
 
 
+
+
+POINT_BUFFER_MAGIC = b'NVP1'
+
+
+def parse_point(value):
+    """Return (lat, lon) of a geo_point doc value, either an object or a "lat, lon" string."""
+    if isinstance(value, dict):
+        return float(value['lat']), float(value['lon'])
+    lat, lon = value.split(',')
+    return float(lat.strip()), float(lon.strip())
+
+
+def pack_points(points, precision=6):
+    """Yield a compact binary buffer of the (lat, lon) points.
+
+    The buffer starts with the magic bytes and the precision as uint32, followed by the little
+    endian int32 pairs of lat, lon scaled by 10 ** precision and delta encoded against the previous
+    point. Clients decode it with an Int32Array from byte 8 and a running sum.
+    """
+    factor = 10 ** precision
+    yield struct.pack('<4sI', POINT_BUFFER_MAGIC, precision)
+    previous_lat, previous_lon = 0, 0
+    chunk = []
+    for lat, lon in points:
+        lat, lon = int(round(lat * factor)), int(round(lon * factor))
+        chunk.append(struct.pack('<ii', lat - previous_lat, lon - previous_lon))
+        previous_lat, previous_lon = lat, lon
+        if len(chunk) >= 1000:
+            yield b"".join(chunk)
+            chunk = []
+    if chunk:
+        yield b"".join(chunk)
+
+
+def unpack_points(buffer):
+    """Return the list of (lat, lon) points of a buffer created with pack_points."""
+    magic, precision = struct.unpack_from('<4sI', buffer)
+    if magic != POINT_BUFFER_MAGIC:
+        raise ValueError("not a point buffer")
+    factor = 10 ** precision
+    points = []
+    lat, lon = 0, 0
+    for delta_lat, delta_lon in struct.iter_unpack('<ii', buffer[8:]):
+        lat, lon = lat + delta_lat, lon + delta_lon
+        points.append((lat / factor, lon / factor))
+    return points
+
+
+def tile_bounds(z, x, y):
+    """Return the (west, south, east, north) WGS84 bounds of the web mercator tile z/x/y."""
+    n = 2 ** z
+
+    def tile_lat(tile_y):
+        return math.degrees(math.atan(math.sinh(math.pi * (1 - 2 * tile_y / n))))
+
+    return x / n * 360.0 - 180.0, tile_lat(y + 1), (x + 1) / n * 360.0 - 180.0, tile_lat(y)
+
+
+def create_tile_filter(z, x, y, key="point"):
+    west, south, east, north = tile_bounds(z, x, y)
+    return {
+        "geo_bounding_box": {
+            key: {
+                "top_left": {"lat": north, "lon": west},
+                "bottom_right": {"lat": south, "lon": east}
+            }
+        }
+    }
+
+
+def to_tile_coordinates(lat, lon, z, x, y, extent=4096):
+    """Return the integer position of a WGS84 point within the tile z/x/y."""
+    n = 2 ** z
+    lat = max(min(lat, 85.0511), -85.0511)
+    lat_rad = math.radians(lat)
+    world_x = (lon + 180.0) / 360.0 * n
+    world_y = (1.0 - math.log(math.tan(lat_rad) + 1 / math.cos(lat_rad)) / math.pi) / 2.0 * n
+    return int(round((world_x - x) * extent)), int(round((world_y - y) * extent))
@@ -0,0 +1,101 @@
+"""Minimal Mapbox vector tile (v2) encoder for point layers.
+
+Only what the geo endpoints need is implemented: one layer of point features, each with string
+properties. See https://github.com/mapbox/vector-tile-spec/tree/master/2.1
+"""
+from . import gis
+
+VARINT = 0
+LENGTH_DELIMITED = 2
+
+MOVE_TO = 1
+POINT = 1
+
+
+def _varint(value):
+    out = bytearray()
+    while True:
+        byte = value & 0x7f
+        value >>= 7
+        if value:
+            out.append(byte | 0x80)
+        else:
+            out.append(byte)
+            return bytes(out)
+
+
+def _zigzag(value):
+    return (value << 1) ^ (value >> 31)
+
+
+def _field(number, wire_type):
+    return _varint((number << 3) | wire_type)
+
+
+def _varint_field(number, value):
+    return _field(number, VARINT) + _varint(value)
+
+
+def _bytes_field(number, value):
+    if isinstance(value, str):
+        value = value.encode('utf-8')
+    return _field(number, LENGTH_DELIMITED) + _varint(len(value)) + value
+
+
+def _packed_field(number, values):
+    return _bytes_field(number, b"".join(_varint(value) for value in values))
+
+
+class PointLayer(object):
+    """Collect point features and encode them as a vector tile layer."""
+
+    def __init__(self, name, z, x, y, extent=4096):
+        self.name = name
+        self.z, self.x, self.y = z, x, y
+        self.extent = extent
+        self._keys = []
+        self._values = []
+        self._value_index = {}
+        self._features = []
+
+    def _tag(self, key, value):
+        if key not in self._keys:
+            self._keys.append(key)
+        value = str(value)
+        if value not in self._value_index:
+            self._value_index[value] = len(self._values)
+            self._values.append(value)
+        return [self._keys.index(key), self._value_index[value]]
+
+    def add_point(self, lat, lon, properties=None, feature_id=None):
+        tile_x, tile_y = gis.to_tile_coordinates(lat, lon, self.z, self.x, self.y, self.extent)
+        if not (0 <= tile_x <= self.extent and 0 <= tile_y <= self.extent):
+            return False
+        tags = []
+        for key, value in (properties or {}).items():
+            tags.extend(self._tag(key, value))
+        feature = b""
+        if feature_id is not None:
+            feature += _varint_field(1, feature_id)
+        if tags:
+            feature += _packed_field(2, tags)
+        feature += _varint_field(3, POINT)
+        feature += _packed_field(4, [(1 << 3) | MOVE_TO, _zigzag(tile_x), _zigzag(tile_y)])
+        self._features.append(feature)
+        return True
+
+    def __len__(self):
+        return len(self._features)
+
+    def encode(self):
+        layer = _varint_field(15, 2) + _bytes_field(1, self.name)
+        layer += b"".join(_bytes_field(2, feature) for feature in self._features)
+        layer += b"".join(_bytes_field(3, key) for key in self._keys)
+        layer += b"".join(_bytes_field(4, _bytes_field(1, value)) for value in self._values)
+        layer += _varint_field(5, self.extent)
+        return layer
+
+
+def encode_tile(*layers):
+    """Return the protobuf encoded vector tile with the layers."""
+    return b"".join(_bytes_field(3, layer.encode()) for layer in layers)
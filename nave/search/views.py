@@ -4,8 +4,10 @@ The Django views used by the search module.
 
 
 """
+import hashlib
 import inspect
 import logging
+import os
 import sys
 from collections import OrderedDict, defaultdict
 
@@ -13,8 +15,11 @@ import bleach
 import requests
 from django.conf import settings
 
-from django.http import HttpResponse, HttpResponseBadRequest, HttpResponseNotAllowed, JsonResponse, HttpResponseNotFound, Http404
+from django.http import HttpResponse, HttpResponseBadRequest, HttpResponseNotAllowed, JsonResponse, HttpResponseNotFound, Http404, \
+    FileResponse, HttpResponseNotModified, StreamingHttpResponse
 from django.shortcuts import redirect
+from django.utils.cache import patch_cache_control
+from django.utils.http import http_date
 from django.utils.translation import ugettext_lazy as _, activate
 from django.views.generic import ListView, DetailView, RedirectView, View, TemplateView
 from rest_framework.decorators import list_route
@@ -37,12 +42,14 @@ from nave.void.models import EDMRecord
 
 
 from nave.void import REGISTERED_CONVERTERS
+from . import result_cache
 from .renderers import N3Renderer, JSONLDRenderer, TURTLERenderer, NTRIPLESRenderer, RDFRenderer, GeoJsonRenderer, \
     XMLRenderer, KMLRenderer, GeoBufRenderer
 from .search import NaveESQuery, NaveQueryResponse, NaveQueryResponseWrapper, NaveItemResponse, \
     NaveESItem
 from .serializers import NaveQueryResponseWrapperSerializer, NaveESItemSerializer
 from .utils import gis
+from .utils.vector_tile import PointLayer, encode_tile
 
 
 logger = logging.getLogger(__file__)
@@ -109,21 +116,113 @@ class ClusterGeoJsonView(ListView):
         return HttpResponse(geo_json, content_type="application/json")
 
 
+def get_geo_validators(search, params):
+    """Return the ETag and the Last-Modified timestamp of the records of a geo search.
+
+    Both change when records matching the search are added, removed or modified.
+    """
+    s = search.extra(size=0, track_total_hits=True)
+    s.aggs.metric('last_modified', 'max', field='system.modified_at')
+    response = s.execute()
+    modified = response.aggregations.last_modified.value
+    key = "{}:{}:{}".format(sorted(params.lists()), response.hits.total.value, modified)
+    etag = '"{}"'.format(hashlib.md5(key.encode('utf-8')).hexdigest())
+    return etag, modified / 1000 if modified else None
+
+
+def geo_response(request, search, get_content, content_type, streaming=False):
+    """Return the geo output of get_content with HTTP caching headers, or 304 when the client copy is fresh."""
+    etag, last_modified = get_geo_validators(search, request.GET)
+    if etag in request.META.get('HTTP_IF_NONE_MATCH', ''):
+        response = HttpResponseNotModified()
+    elif streaming:
+        response = StreamingHttpResponse(get_content(), content_type=content_type)
+    else:
+        response = HttpResponse(get_content(), content_type=content_type)
+    response['ETag'] = etag
+    if last_modified:
+        response['Last-Modified'] = http_date(last_modified)
+    if result_cache.depends_on_client_ip():
+        patch_cache_control(response, private=True)
+    patch_cache_control(response, max_age=getattr(settings, "GEO_CACHE_MAX_AGE", 3600))
+    return response
+
+
+class ClusterTileView(View):
+    """Return the geohash clusters of a search within tile z/x/y as a cached GeoJSON FeatureCollection."""
+    max_zoom = 22
+
+    def get(self, request, *args, **kwargs):
+        from .geo_cluster import get_cluster_tile
+        z, x, y = int(kwargs['z']), int(kwargs['x']), int(kwargs['y'])
+        if not (0 <= z <= self.max_zoom and 0 <= x < 2 ** z and 0 <= y < 2 ** z):
+            return HttpResponseBadRequest("invalid tile {}/{}/{}".format(z, x, y))
+        query_factory = NaveESQuery(index_name=settings.INDEX_NAME)
+        feature_collection = get_cluster_tile(query_factory, request, z, x, y)
+        return HttpResponse(gis.get_geojson(feature_collection), content_type="application/json")
+
+
+class GeoTileView(View):
+    """Return the points of a search as a Mapbox vector tile for z/x/y."""
+    layer_name = "points"
+    max_zoom = 22
+
+    def get(self, request, *args, **kwargs):
+        z, x, y = int(kwargs['z']), int(kwargs['x']), int(kwargs['y'])
+        if not (0 <= z <= self.max_zoom and 0 <= x < 2 ** z and 0 <= y < 2 ** z):
+            return HttpResponseBadRequest("invalid tile {}/{}/{}".format(z, x, y))
+        query_factory = NaveESQuery(index_name=settings.INDEX_NAME)
+        search = query_factory.build_geo_point_search(request, tile=(z, x, y))
+
+        def get_content():
+            layer = PointLayer(self.layer_name, z, x, y)
+            for hub_id, lat, lon in query_factory.get_geo_points(search):
+                layer.add_point(lat, lon, properties={'hub_id': hub_id})
+            return encode_tile(layer)
+
+        return geo_response(request, search, get_content, 'application/vnd.mapbox-vector-tile')
+
+
 class BigDownloadView(View):
+    """Report the progress of an export task and serve its file to the user that requested it."""
+
+    @staticmethod
+    def get_content_type(download_file, response_format):
+        """Return the content type of the export file, gzip when it is compressed."""
+        from .export import EXPORT_WRITERS
+        if download_file.endswith('.gz'):
+            return "application/gzip"
+        writer = EXPORT_WRITERS.get(response_format)
+        return writer.content_type if writer else "application/octet-stream"
 
-    def get(self, *args, **kwargs):
+    def get(self, request, *args, **kwargs):
+        if not request.user.is_authenticated():
+            logger.warn("Only logged in users can follow a download request.")
+            raise Http404()
         task_id = kwargs.get('id')
-        # todo find the task by task id
-        task_result = download_all_search_results.AsyncResult(task_id)
         if not task_id:
             return JsonResponse({'status': 'error', 'msg': 'You must supply a task id.'})
+        task_result = download_all_search_results.AsyncResult(task_id)
         resp = {
             'status': task_result.state,
             'task_id': task_id,
             'msg': """Generating a zip file for the api request.
                         When the zip file is done a download link will appear on this page."""}
+        if task_result.state in ['PROGRESS'] and isinstance(task_result.info, dict):
+            resp['nr_results'] = task_result.info.get('records', 0)
         if task_result.state in ['SUCCESS']:
-            link, query, results, resp_format = task_result.result
+            link, query, results, resp_format, download_file, username = task_result.result
+            if username != request.user.username:
+                logger.warn("User {} is not allowed to download {}.".format(request.user.username, task_id))
+                raise Http404()
+            if request.GET.get('file', 'false').lower() == 'true':
+                if not os.path.exists(download_file):
+                    raise Http404()
+                response = FileResponse(
+                    open(download_file, 'rb'), content_type=self.get_content_type(download_file, resp_format)
+                )
+                response['Content-Disposition'] = 'attachment; filename="{}"'.format(os.path.basename(download_file))
+                return response
             resp['download_link'] = link
             resp['es_query'] = query
             resp['nr_results'] = results
@@ -292,7 +391,11 @@ class SearchListAPIView(ViewSetMixin, ListAPIView, RetrieveAPIView):
         return query
 
     def get_queryset(self, cluster_geo=False, geo_query=False, acceptance=False, *args, **kwargs):
-        query = self.get_query(
+        query = self.get_search_query(cluster_geo=cluster_geo, geo_query=geo_query, acceptance=acceptance)
+        return self.get_query_response(query)
+
+    def get_search_query(self, cluster_geo=False, geo_query=False, acceptance=False):
+        return self.get_query(
             request=self.request,
             index_name=self.get_index_name,
             doc_types=self.doc_types,
@@ -305,10 +408,25 @@ class SearchListAPIView(ViewSetMixin, ListAPIView, RetrieveAPIView):
             acceptance=acceptance
         )
 
+    def get_query_response(self, query):
         response = NaveQueryResponse(query=query, api_view=self, converter=self.get_converter())
         wrapped_response = NaveQueryResponseWrapper(response)
         return wrapped_response
 
+    def cached_list(self, request, geo_query=False):
+        """Return the serialized search response from the shared result cache, None when it is not cacheable."""
+        query = self.get_search_query(geo_query=geo_query)
+        raw_query_string = self.lookup_query_object.query if self.lookup_query_object else None
+        key = result_cache.get_result_key(result_cache.get_result_cache(), query, request, raw_query_string)
+        if key is None:
+            return None
+        entry = result_cache.get_cached_entry(
+            key, lambda: NaveQueryResponseWrapperSerializer(self.get_query_response(query)).data
+        )
+        if entry['etag'] in request.META.get('HTTP_IF_NONE_MATCH', ''):
+            return result_cache.patch_response_headers(HttpResponseNotModified(), entry)
+        return result_cache.patch_response_headers(Response(entry['data']), entry)
+
     @property
     def acceptance_mode(self):
         mode = self.request.GET.get('mode', 'default')
@@ -318,18 +436,26 @@ class SearchListAPIView(ViewSetMixin, ListAPIView, RetrieveAPIView):
         return acceptance
 
     def stream_search_results(self, request):
+        """Export all search results in the requested download_format.
+
+        The export is streamed gzipped or, with async=true, written to a file by a celery task
+        that can be followed with the BigDownloadView.
+        """
         import uuid
-        from elasticsearch.helpers import scan
-        from .connector import get_es_client
+        from django.core.urlresolvers import reverse
         from django.http.response import Http404
+        from .export import SearchExport, get_export_writer, EXPORT_WRITERS
 
         # check if authenticated
         if not request.user.is_authenticated():
             logger.warn("Only logged in users can create a download request.")
             raise Http404()
         user = request.user
-        response_format = self.request.GET.get('format', 'json')
-        file_name = "{}_{}.{}".format(user.username, uuid.uuid1(), response_format)
+        response_format = self.request.GET.get('download_format', 'json')
+        if response_format not in EXPORT_WRITERS:
+            return HttpResponseBadRequest("unsupported download_format {}, choose from {}".format(
+                response_format, ", ".join(EXPORT_WRITERS.keys())))
+        name = "{}_{}".format(user.username, uuid.uuid1())
         query = self.get_query(
             request=self.request,
             index_name=self.get_index_name,
@@ -342,45 +468,32 @@ class SearchListAPIView(ViewSetMixin, ListAPIView, RetrieveAPIView):
             cluster_geo=False,
             converter=self.get_converter()
         )
-        downloader = scan(
-            client=get_es_client(),
-            query=query.query,
-            index=self.get_index_name,
-        )
-
-        # todo add serializer for response format
-        def streaming_generator():
-            yield "["
-            first = True
-            for result in downloader:
-                if first:
-                    first = False
-                else:
-                    yield ","
-                yield self.serialize_stream(es_item=result, format="json")
-            yield "]"
-
-        generator = streaming_generator()
-        ##
-        # async_task_id = download_all_search_results.delay(
-        #     query_dict=query.query,
-        #     response_format=self.request.GET.get('format', 'json'),
-        #     converter=self.get_converter(),
-        #     index_name=self.get_index_name,
-        #     doc_types=self.doc_types
-        # )
-        from django.http import StreamingHttpResponse
-        response = StreamingHttpResponse(
-            generator,
-            content_type="text/plain"  # todo later replace with response_format
-        )
-        # todo add streaming gzip of search results later
-        response['Content-Disposition'] = 'attachment; filename="{}"'.format(file_name)
-        return response
+        if self.request.GET.get('async', 'false').lower() == 'true':
+            converter_key = self.request.GET.get("converter", self.default_converter)
+            task = download_all_search_results.delay(
+                query_dict=query.query.to_dict(),
+                index_name=self.get_index_name,
+                converter=converter_key,
+                response_format=response_format,
+                name=name,
+                username=user.username
+            )
+            return redirect(reverse('big_download', kwargs={'id': task.id}))
+        writer = get_export_writer(response_format, converter=self.get_converter())
+        export = SearchExport(search=query.query, index=self.get_index_name, writer=writer)
+        compress = 'gzip' in request.META.get('HTTP_ACCEPT_ENCODING', '')
+        return export.stream_response(name, compress=compress)
 
     def stream_geosearch_results(self, request, max=1000, as_file=True):
-        """Return a streaming response with all geopoints"""
-        from django.http import StreamingHttpResponse
+        """Return a streaming response with all geopoints
+
+        The geoformat param selects the output: js (default) for the edmPoints javascript array, bin
+        for the delta encoded binary point buffer of gis.pack_points or geobuf for a Geobuf
+        FeatureCollection with the hub_id of every point. The binary formats are not capped.
+        """
+        geo_format = request.query_params.get('geoformat', 'js')
+        if geo_format in ['bin', 'geobuf']:
+            return self.stream_geo_points(request, geo_format)
 
         if hasattr(settings, 'GEO_STREAMING_RESPONSE'):
             max = settings.GEO_STREAMING_RESPONSE
@@ -396,11 +509,26 @@ class SearchListAPIView(ViewSetMixin, ListAPIView, RetrieveAPIView):
             response['Content-Disposition'] = 'attachment; filename="{}"'.format(file_name)
         return response
 
-    def serialize_stream(self, es_item, format="json"):
-        from elasticsearch_dsl.result import Result
-        item = NaveESItem(es_item=Result(es_item), converter=self.get_converter())
-        serialized_item = NaveESItemSerializer(item)
-        return JSONRenderer().render(serialized_item.data)
+    def stream_geo_points(self, request, geo_format):
+        import geobuf
+        from geojson import Feature, FeatureCollection, Point as GeoPoint
+
+        query_factory = NaveESQuery(index_name=settings.INDEX_NAME)
+        search = query_factory.build_geo_point_search(request)
+
+        if geo_format == 'bin':
+            def get_content():
+                points = ((lat, lon) for hub_id, lat, lon in query_factory.get_geo_points(search))
+                return gis.pack_points(points)
+            return geo_response(request, search, get_content, 'application/octet-stream', streaming=True)
+
+        def get_content():
+            features = [
+                Feature(geometry=GeoPoint((lon, lat)), id=hub_id)
+                for hub_id, lat, lon in query_factory.get_geo_points(search)
+            ]
+            return geobuf.encode(FeatureCollection(features=features))
+        return geo_response(request, search, get_content, 'application/octet-stream')
 
     def list(self, request, format=None, *args, **kwargs):
         # if has id redirect to detail view
@@ -436,6 +564,10 @@ class SearchListAPIView(ViewSetMixin, ListAPIView, RetrieveAPIView):
             # todo replace with normal geojson output as feature collection
             return Response(self.get_clustered_geojson(request))
         geo_query = request.accepted_renderer.format in ['geojson', 'kml']
+        if request.accepted_renderer.format != 'html' and result_cache.is_cacheable_request(request):
+            response = self.cached_list(request, geo_query=geo_query)
+            if response is not None:
+                return response
         queryset = self.get_queryset(geo_query=geo_query)
         # HTML VIEW ##############################################################
         mode = self.request.GET.get('mode', 'default')
@@ -456,6 +588,15 @@ class SearchListAPIView(ViewSetMixin, ListAPIView, RetrieveAPIView):
         serializer = NaveQueryResponseWrapperSerializer(queryset)
         return Response(serializer.data)
 
+    def get_schema(self, mode):
+        """Return the schema used to render the detail document for the requested mode."""
+        if mode in ['api', 'api-flat'] or mode in REGISTERED_CONVERTERS.keys():
+            return mode
+        if self.default_converter in REGISTERED_CONVERTERS.keys():
+            return self.default_converter
+        logger.warn("unable to convert results to schema {}".format(mode))
+        return 'api'
+
     def retrieve(self, request, pk=None, format=None, *args, **kwargs):
         def get_mode(default=None):
             params = request.GET
@@ -506,46 +647,34 @@ class SearchListAPIView(ViewSetMixin, ListAPIView, RetrieveAPIView):
         if response._results.hits.total.value == 0:
             return HttpResponseNotFound()
         clean_pk = response._results[0].meta.id
-        record = ElasticSearchRDFRecord(hub_id=clean_pk)
-        record.get_graph_by_id(hub_id=clean_pk)
-        response._rdf_record = record
         renderer_format = request.accepted_renderer.format
-        if renderer_format in list(EXTENSION_TO_MIME_TYPE.keys()) and renderer_format not in ['xml', 'json']:
-            graph = record.get_graph()
-            graph_string = graph.serialize(format=renderer_format).decode('utf-8')
-            mime_type = EXTENSION_TO_MIME_TYPE.get(renderer_format)
-            return Response(data=graph_string, content_type=mime_type)
-        target_uri = record.document_uri
-        if settings.RDF_USE_LOCAL_GRAPH:
-            graph = record.get_graph()
-        else:
-            store = rdfstore.get_rdfstore()
-            graph, _ = RDFModel.get_context_graph(store, named_graph=record.named_graph)
-        if not graph:
-            return HttpResponseNotFound()
-        mode = get_mode(self.default_converter)
-        bindings = GraphBindings(about_uri=target_uri, graph=graph)
+        is_rdf_format = renderer_format in list(EXTENSION_TO_MIME_TYPE.keys()) and renderer_format not in ['xml', 'json']
+        schema = self.get_schema(get_mode(self.default_converter))
+        converter = REGISTERED_CONVERTERS.get(schema)
         delving_fields = False if request.GET.get("delving_fields") == 'false' else True
-        converter = None
-        if mode in ['api', 'api-flat']:
-            index_doc = bindings.to_index_doc() if mode == 'api' else bindings.to_flat_index_doc()
-        elif mode in REGISTERED_CONVERTERS.keys():
-            converter = REGISTERED_CONVERTERS.get(mode)
-            index_doc = converter(
-                bindings=bindings,
-                graph=graph,
-                about_uri=bindings.about_uri()
-            ).convert(add_delving_fields=delving_fields)
-        elif self.default_converter in REGISTERED_CONVERTERS.keys():
-            converter = REGISTERED_CONVERTERS.get(self.default_converter)
-            index_doc = converter(
-                bindings=bindings,
-                graph=graph,
-                about_uri=bindings.about_uri()
-            ).convert(add_delving_fields=delving_fields)
-        else:
-            logger.warn("unable to convert results to schema {}".format(mode))
-            index_doc = bindings.to_index_doc()
+        index_doc = None
+        # the document is pre-rendered from the local graph, without it the context graph of the store is used
+        if not is_rdf_format and delving_fields and settings.RDF_USE_LOCAL_GRAPH:
+            index_doc = RDFRecord.get_prerendered_document(response._results.hits.hits[0], schema)
+        if index_doc is None:
+            record = ElasticSearchRDFRecord(hub_id=clean_pk)
+            record.get_graph_by_id(hub_id=clean_pk)
+            response._rdf_record = record
+            if is_rdf_format:
+                graph = record.get_graph()
+                graph_string = graph.serialize(format=renderer_format).decode('utf-8')
+                mime_type = EXTENSION_TO_MIME_TYPE.get(renderer_format)
+                return Response(data=graph_string, content_type=mime_type)
+            target_uri = record.document_uri
+            if settings.RDF_USE_LOCAL_GRAPH:
+                graph = record.get_graph()
+            else:
+                store = rdfstore.get_rdfstore()
+                graph, _ = RDFModel.get_context_graph(store, named_graph=record.named_graph)
+            if not graph:
+                return HttpResponseNotFound()
+            bindings = GraphBindings(about_uri=target_uri, graph=graph)
+            index_doc = RDFRecord.render_document(bindings, schema, graph=graph, add_delving_fields=delving_fields)
         layout_fields = OrderedDict()
         layout_fields['layout'] = converter().get_layout_fields() if converter else []
         if response.get_mlt():
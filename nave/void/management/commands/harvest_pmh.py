@@ -3,21 +3,83 @@ from django.core.management.base import BaseCommand
 
 
 class Command(BaseCommand):
-    args = '<base_url> <spec> <format>'
-    help = 'bulk load xml files processed by Narthex'
+    help = 'Harvest an OAI-PMH set to xml files, interrupted harvests are resumed from their checkpoint'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'base_url',
+            type=str,
+            help='The OAI-PMH endpoint.'
+        )
+        parser.add_argument(
+            'spec',
+            type=str,
+            help='The set to harvest.'
+        )
+        parser.add_argument(
+            'metadata_prefix',
+            type=str,
+            help='The metadataPrefix to harvest.'
+        )
+        parser.add_argument(
+            '--verb',
+            default='ListRecords',
+            help='ListRecords or ListIdentifiers.'
+        )
+        parser.add_argument(
+            '--from',
+            dest='from_date',
+            default=None,
+            help='Only harvest records modified from this date.'
+        )
+        parser.add_argument(
+            '--until',
+            dest='until_date',
+            default=None,
+            help='Only harvest records modified until this date.'
+        )
+        parser.add_argument(
+            '--slices',
+            type=int,
+            default=1,
+            help='Split the from/until range in date slices that are harvested in parallel.'
+        )
+        parser.add_argument(
+            '--workers',
+            type=int,
+            default=None,
+            help='Number of slices harvested at the same time.'
+        )
+        parser.add_argument(
+            '--output-dir',
+            default=None,
+            help='Directory for the harvested files and checkpoints.'
+        )
+        parser.add_argument(
+            '--restart',
+            action='store_true',
+            default=False,
+            help='Ignore the checkpoints of an earlier harvest.'
+        )
 
     def handle(self, *args, **options):
-        if len(args) != 3:
-            return self.args
-        base_url = args[0]
-        spec = args[1]
-        metadata_prefix = args[2]
+        base_url = options['base_url']
+        spec = options['spec']
+        metadata_prefix = options['metadata_prefix']
 
-        self.stdout.write('Starting harvesting for {} from '.format(spec, base_url))
+        self.stdout.write('Starting harvesting for {} from {}'.format(spec, base_url))
         from nave.void.oaipmh import OAIHarvester
-        harvester = OAIHarvester(base_url=base_url)
-        output_file = harvester.get_records_from_oai_pmh(set_spec=spec, metadata_prefix=metadata_prefix)
-        self.stdout.write('Wrote output to {}'.format(output_file))
-        self.stdout.write('Finished harvesting for {} from '.format(spec, base_url))
-
-
+        harvester = OAIHarvester(base_url=base_url, output_dir=options['output_dir'])
+        output_files = harvester.get_records_from_oai_pmh(
+            set_spec=spec,
+            metadata_prefix=metadata_prefix,
+            verb=options['verb'],
+            from_date=options['from_date'],
+            until_date=options['until_date'],
+            slices=options['slices'],
+            workers=options['workers'],
+            restart=options['restart']
+        )
+        for output_file in output_files:
+            self.stdout.write('Wrote output to {}'.format(output_file))
+        self.stdout.write('Finished harvesting for {} from {}'.format(spec, base_url))
@@ -647,10 +647,18 @@ class DataSet(TimeStampedModel, GroupOwned):
     def delete_from_index(self, index='{}'.format(settings.INDEX_NAME)):
         """Delete all dataset records from the Search Index. """
         # TODO: use nested query for this to delete by spec and not only for the unfielded spec name
-        response = es.delete_by_query(index=index, q="system.spec.raw:\"{}\"".format(self.spec))
+        response = get_es().delete_by_query(index=index, q="system.spec.raw:\"{}\"".format(self.spec))
         logger.info("Deleted {} from Search index with message: {}".format(self.spec, response))
+        self.invalidate_search_caches()
         return response
 
+    def invalidate_search_caches(self):
+        """Invalidate the cached cluster tiles and search responses after records of the dataset changed."""
+        from nave.search.geo_cluster import invalidate_cluster_tiles
+        from nave.search.result_cache import invalidate_search_results
+        invalidate_cluster_tiles()
+        invalidate_search_results(self.spec)
+
     def _sparql_delete_all_query(self):
         delete_records = """DROP SILENT GRAPH <{graph_uri}>;
           DELETE {{
@@ -810,6 +818,8 @@ class DataSet(TimeStampedModel, GroupOwned):
     def bulk_index(self, es_actions):
         logger.debug(es_actions)
         nr, errors = helpers.bulk(get_es(), es_actions)
+        if nr > 0:
+            self.invalidate_search_caches()
         if nr > 0 and not errors:
             logger.info("Indexed records {} for dataset {}".format(nr, self.spec))
             return True
@@ -818,6 +828,11 @@ class DataSet(TimeStampedModel, GroupOwned):
             return False
         return False
 
+    def _mark_graphs_as_not_orphaned(self, named_graphs):
+        """Mark the EDMRecords of unchanged named graphs as not orphaned in a single update."""
+        if named_graphs:
+            EDMRecord.objects.filter(dataset=self, named_graph__in=named_graphs).update(orphaned=False)
+
     def process_narthex_file(self, store=None, acceptance=False, path=None, console=False):
 
         if not store:
@@ -829,7 +844,7 @@ class DataSet(TimeStampedModel, GroupOwned):
             processed_fname = path
         logger.info("started processing {} for dataset {}".format(processed_fname, self.spec))
 
-        with open(processed_fname, 'r') as f:
+        with open(processed_fname, 'r') as f, rdfstore.SparqlUpdateWriter(store=store) as sparql_writer:
             record = []
             lines = 0
             records = 0
@@ -837,26 +852,30 @@ class DataSet(TimeStampedModel, GroupOwned):
             new = 0
             not_orphaned = []
             bulk_insert_records = []
-            sparql_update_queries = []
             es_actions = []
+            unchanged_graphs = []
             # set orphaned records
             self.mark_records_as_orphaned(state=True)
+            # fetch all stored content hashes at once instead of querying per record
+            stored_hashes = dict(
+                EDMRecord.objects.filter(dataset=self).values_list('named_graph', 'source_hash')
+            )
             for line in f:
                 lines += 1
                 exists, named_graph, content_hash = self.is_line_marker(line)
                 if exists:
-                    edm_record = EDMRecord.objects.filter(source_hash=content_hash, named_graph=named_graph).exists()
-                    if not edm_record:
+                    if named_graph not in stored_hashes or stored_hashes[named_graph] != content_hash:
                         triples = " ".join(record)
                         # print(is_marker)
                         new += 1
                         g = Graph(identifier=named_graph)
                         g.parse(data=triples)
-                        if not EDMRecord.objects.filter(named_graph=named_graph).exists():
+                        if named_graph not in stored_hashes:
                             created_record = EDMRecord.graph_to_record(
                                     graph=g,
                                     ds=self,
-                                    content_hash=None,
+                                    content_hash=content_hash,
+                                    force_insert=True,
                                     acceptance=acceptance,
                                     bulk=True)
 
@@ -873,18 +892,17 @@ class DataSet(TimeStampedModel, GroupOwned):
                                     )
                             )
                             if settings.RDF_STORE_TRIPLES:
-                                sparql_update_queries.append(
-                                    created_record.create_sparql_update_query(acceptance=acceptance))
+                                sparql_writer.add(created_record.create_sparql_update_query(acceptance=acceptance))
                         else:
                             updated_record = EDMRecord.graph_to_record(
                                     graph=g,
                                     ds=self,
-                                    content_hash=None,
+                                    content_hash=content_hash,
+                                    force_insert=True,
                                     acceptance=acceptance
                             )
                             if settings.RDF_STORE_TRIPLES:
-                                sparql_update_queries.append(
-                                    updated_record.create_sparql_update_query(acceptance=acceptance))
+                                sparql_writer.add(updated_record.create_sparql_update_query(acceptance=acceptance))
                             es_actions.append(
                                     updated_record.create_es_action(
                                             action="index",
@@ -896,9 +914,11 @@ class DataSet(TimeStampedModel, GroupOwned):
                                     )
                             )
                     else:
-                        EDMRecord.objects.filter(source_hash=content_hash, named_graph=named_graph).update(
-                                orphaned=False)
+                        unchanged_graphs.append(named_graph)
                         stored += 1
+                    if len(unchanged_graphs) >= 1000:
+                        self._mark_graphs_as_not_orphaned(unchanged_graphs)
+                        unchanged_graphs[:] = []
                     records += 1
                     record[:] = []
                     bulk_record_size = len(bulk_insert_records)
@@ -906,10 +926,6 @@ class DataSet(TimeStampedModel, GroupOwned):
                         EDMRecord.objects.bulk_create(bulk_insert_records)
                         logger.info("inserted 1000 records of {} at {}".format(self.spec, time.ctime()))
                         bulk_insert_records[:] = []
-                    nr_sparql_updates = len(sparql_update_queries)
-                    if settings.RDF_STORE_TRIPLES and nr_sparql_updates > 0 and nr_sparql_updates % 50 == 0:
-                        store.update("\n".join(sparql_update_queries))
-                        sparql_update_queries[:] = []
                     if records % 1000 == 0:
                         logger.info("processed {} records of {} at {}".format(records, self.spec, time.ctime()))
                         if console:
@@ -920,10 +936,9 @@ class DataSet(TimeStampedModel, GroupOwned):
                 else:
                     record.append(line)
             # store the remaining bulk items
+            self._mark_graphs_as_not_orphaned(unchanged_graphs)
             EDMRecord.objects.bulk_create(bulk_insert_records)
             self.bulk_index(es_actions)
-            if settings.RDF_STORE_TRIPLES and len(sparql_update_queries) > 0:
-                store.update("\n".join(sparql_update_queries))
             logger.info(
                     "Dataset {}: records inserted {}, records same content hash {}, lines parsed {}, total records processed {}".format(
                             self.spec, new, stored, lines, records)
@@ -935,30 +950,25 @@ class DataSet(TimeStampedModel, GroupOwned):
         if not store:
             store = rdfstore.get_rdfstore()
         es_actions = []
-        sparql_update_queries = []
         records_removed = 0
-        for record in EDMRecord.objects.filter(dataset=self, orphaned=True):
-            records_removed += 1
-            es_actions.append(
-                    record.create_es_action(
-                            action="delete",
-                            store=store,
-                            context=False,  # todo: fix issue with context indexing later
-                            flat=True,
-                            exclude_fields=None,
-                            acceptance=acceptance
-                    )
-            )
-            if settings.RDF_STORE_TRIPLES:
-                sparql_update_queries.append(record.create_sparql_update_query(delete=True, acceptance=acceptance))
-            if len(sparql_update_queries) >= 50:
-                store.update("\n".join(sparql_update_queries))
-                sparql_update_queries[:] = []
-            if len(es_actions) >= 1000:
-                self.bulk_index( es_actions)
-                es_actions[:] = []
-        if settings.RDF_STORE_TRIPLES:
-            store.update("\n".join(sparql_update_queries))
+        with rdfstore.SparqlUpdateWriter(store=store) as sparql_writer:
+            for record in EDMRecord.objects.filter(dataset=self, orphaned=True):
+                records_removed += 1
+                es_actions.append(
+                        record.create_es_action(
+                                action="delete",
+                                store=store,
+                                context=False,  # todo: fix issue with context indexing later
+                                flat=True,
+                                exclude_fields=None,
+                                acceptance=acceptance
+                        )
+                )
+                if settings.RDF_STORE_TRIPLES:
+                    sparql_writer.add(record.create_sparql_update_query(delete=True, acceptance=acceptance))
+                if len(es_actions) >= 1000:
+                    self.bulk_index( es_actions)
+                    es_actions[:] = []
         if len(es_actions) > 0:
             self.bulk_index(es_actions)
         logger.info("Removed {} orphans for dataset {}".format(records_removed, self.spec))
@@ -1,18 +1,30 @@
 # -*- coding: utf-8 -*-
 """Module to provide OAI-PMH interface."""
 from collections import defaultdict, namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
 from enum import Enum
 
-import ast
+import hashlib
+import json
+import logging
 import os
 import requests
-import base64
 from dateutil import parser
+from dateutil.tz import tzutc
 from urllib import parse
 from django.conf import settings
+from django.core import signing
+from django.http import StreamingHttpResponse
+from django.template.loader import get_template, render_to_string
+from django.utils.cache import patch_vary_headers
+from django.utils.text import compress_sequence
 from django.views.generic import TemplateView
+from elasticsearch.exceptions import NotFoundError, TransportError
 from elasticsearch_dsl import Search, A
 from lxml import etree as ET
+from requests.adapters import HTTPAdapter
+from requests.packages.urllib3.util.retry import Retry
 
 from nave.lod.utils.resolver import RDFRecord, ElasticSearchRDFRecord
 from nave.void import REGISTERED_CONVERTERS
@@ -20,6 +32,8 @@ from nave.void.models import DataSet, OaiPmhPublished, EDMRecord
 
 from nave.search.connector import get_es_client
 
+logger = logging.getLogger(__name__)
+
 
 class OaiVerb(Enum):
     Identify = 1
@@ -58,16 +72,6 @@ for verb, params in list(VERBS_WITH_PARAMS.items()):
     for param in params:
         PARAMS_WITH_VERBS[param].append(verb)
 
-def encodeToken(token):
-    encodedBytes = base64.b64encode(token.encode("utf-8"))
-    encodedStr = str(encodedBytes, "utf-8")
-    return encodedStr
-
-def decodeToken(token):
-    decodedBytes = base64.urlsafe_b64decode(token.strip())
-    decodedStr = str(decodedBytes, "utf-8")
-    return decodedStr
-
 class OAIException(Exception):
 
     def __init__(self, code, message, *args, **kwargs): # real signature unknown
@@ -85,6 +89,7 @@ class OAIProvider(TemplateView):
     record_model = EDMRecord
     record_access_filter = {'dataset__oai_pmh': OaiPmhPublished.public}
     records_returned = 100
+    stream_marker = "__oai_pmh_stream__"
 
     def __init__(self, **kwargs):
         super(OAIProvider, self).__init__(**kwargs)
@@ -96,6 +101,8 @@ class OAIProvider(TemplateView):
         self.filters = None
         self.list_size = None
         self.set = None
+        self.streaming = getattr(settings, "OAI_PMH_STREAMING", True)
+        self.gzip = getattr(settings, "OAI_PMH_GZIP", False)
 
     class Meta:
         abstract = True
@@ -144,19 +151,18 @@ class OAIProvider(TemplateView):
                 "badArgument",
                 "The request includes illegal arguments or is missing required arguments."
             )
-        items = [self.get_item(identifier)]
-        if not items:
+        item = self.get_item(identifier)
+        if item is None:
             return self.error(
                 "idDoesNotExist",
                 "The value of the identifier argument is unknown or illegal in this repository."
             )
-        converters = REGISTERED_CONVERTERS
-        current_converter = converters[self.metadataPrefix]
-        converted_items = []
-        for i in list(items):
-            converted_items.append(self._get_item_info(item=i, converter=current_converter))
+        current_converter = REGISTERED_CONVERTERS[self.metadataPrefix]
+        converted_items = self._iter_item_info([item], current_converter)
+        if self.streaming:
+            return self.stream_to_response('GetRecord', converted_items, "oaipmh/record.xml")
         return self.render_to_response({
-            'items': converted_items
+            'items': list(converted_items)
         })
 
     def last_modified(self, obj):
@@ -173,13 +179,51 @@ class OAIProvider(TemplateView):
             response_kwargs['content_type'] = self.content_type
 
         # add common context data needed for all responses
-        context.update({
+        context.update(self.get_common_context())
+        return super(TemplateView, self) \
+            .render_to_response(context, **response_kwargs)
+
+    def get_common_context(self):
+        return {
             'verb': self.oai_verb,
             'all_params': " ".join(["{}=\"{}\"".format(key, value) for key, value in self.request.GET.dict().items()]),
             'url': self.request.build_absolute_uri(self.request.path),
-        })
-        return super(TemplateView, self) \
-            .render_to_response(context, **response_kwargs)
+        }
+
+    def accepts_gzip(self):
+        return self.gzip and 'gzip' in self.request.META.get('HTTP_ACCEPT_ENCODING', '')
+
+    def stream_to_response(self, element, items, item_template, with_resumption_token=False):
+        """Stream the OAI-PMH envelope, every rendered item and the resumption token.
+
+        The items are rendered one at a time while the response is sent, so a page of large
+        records is never held in memory as a whole.
+        """
+        context = self.get_common_context()
+        context.update({'element': element, 'content': self.stream_marker})
+        head, tail = render_to_string("oaipmh/envelope.xml", context).split(self.stream_marker)
+        template = get_template(item_template)
+
+        def stream():
+            yield head
+            for item_info in items:
+                yield template.render({'i': item_info})
+            if with_resumption_token:
+                yield render_to_string("oaipmh/resumption_token.xml", {
+                    'resumption_token': self.generate_resumption_token(),
+                    'cursor': self.cursor,
+                    'list_size': self.list_size
+                })
+            yield tail
+
+        content = stream()
+        if self.accepts_gzip():
+            response = StreamingHttpResponse(compress_sequence(content), content_type=self.content_type)
+            response['Content-Encoding'] = 'gzip'
+            patch_vary_headers(response, ('Accept-Encoding',))
+        else:
+            response = StreamingHttpResponse(content, content_type=self.content_type)
+        return response
 
     def identify(self):
         """Return the OAI-PMH Identify request.
@@ -214,16 +258,17 @@ class OAIProvider(TemplateView):
 
     def list_identifiers(self):
         self.template_name = 'oaipmh/list_identifiers.xml'
-        identifiers = []
-        for i in list(self.items()):
-            item_info = {
+        identifiers = (
+            {
                 'identifier': self.oai_identifier(i),
                 'last_modified': self.last_modified(i),
                 'sets': [self.sets(i)]
-            }
-            identifiers.append(item_info)
+            } for i in self.items()
+        )
+        if self.streaming:
+            return self.stream_to_response('ListIdentifiers', identifiers, "oaipmh/header.xml", True)
         return self.render_to_response({
-            'items': identifiers,
+            'items': list(identifiers),
             'resumption_token': self.generate_resumption_token(),
             'cursor': self.cursor,
             'list_size': self.list_size}
@@ -265,15 +310,24 @@ class OAIProvider(TemplateView):
         }
         return item_info
 
+    def _iter_item_info(self, items, converter):
+        """Convert the items lazily, a record that fails to convert is logged and left out."""
+        for item in items:
+            try:
+                yield self._get_item_info(item, converter)
+            except Exception as e:
+                logger.exception("Unable to convert {} to {}: {}".format(
+                    self.oai_identifier(item), self.metadataPrefix, e)
+                )
+
     def list_records(self):
         self.template_name = "oaipmh/list_records.xml"
-        items = []
-        converters = REGISTERED_CONVERTERS
-        current_converter = converters[self.metadataPrefix]
-        for i in list(self.items()):
-            items.append(self._get_item_info(i, current_converter))
+        current_converter = REGISTERED_CONVERTERS[self.metadataPrefix]
+        items = self._iter_item_info(self.items(), current_converter)
+        if self.streaming:
+            return self.stream_to_response('ListRecords', items, "oaipmh/record.xml", True)
         return self.render_to_response({
-            'items': items,
+            'items': list(items),
             'resumption_token': self.generate_resumption_token(),
             'cursor': self.cursor,
             'list_size': self.list_size}
@@ -360,7 +414,10 @@ class OAIProvider(TemplateView):
                         repeated argument, or values for arguments have an illegal syntax.""",
             )
 
-        self.create_harvest_steps(request)
+        try:
+            self.create_harvest_steps(request)
+        except OAIException as oe:
+            return self.error(oe.code, oe.message)
 
         if self.metadataPrefix not in REGISTERED_CONVERTERS.keys():
             return self.error(
@@ -394,77 +451,118 @@ class ElasticSearchOAIProvider(OAIProvider):
     client = get_es_client()
     ESDataSet = namedtuple("DataSet", ['spec', 'description', 'name', 'valid', 'data_owner'])
     _es_response = None
+    token_salt = "nave.void.oaipmh.resumption"
+    sort_order = [{"system.modified_at": {"order": "asc"}}, {"_id": {"order": "desc"}}]
 
     def __init__(self, spec=None, query=None, **kwargs):
         super(ElasticSearchOAIProvider, self).__init__(**kwargs)
         self.query = query
         self.spec = spec
         self.sort_key = None
+        self.pit_id = None
+        self.pit_keep_alive = getattr(settings, "OAI_PMH_PIT_KEEP_ALIVE", "10m")
+        self.token_max_age = getattr(settings, "OAI_PMH_TOKEN_MAX_AGE", 86400)
+        self._es_query = None
 
     def get(self, request, *args, **kwargs):
         return super(ElasticSearchOAIProvider, self).get(request, *args, **kwargs)
 
-    def get_next_search_cursor(self):
-        return {'search_after': ast.literal_eval(self.sort_key.replace('%20', ' '))}
-
     def get_next_cursor(self):
         return self.cursor + self.records_returned
 
+    def open_point_in_time(self):
+        """Open a point-in-time so that all pages of a harvest see the same snapshot of the index.
+
+        Returns None when point-in-time searches are disabled or not supported by the cluster. The
+        harvest then pages with search_after over the live index.
+        """
+        if not self.pit_keep_alive:
+            return None
+        try:
+            response = self.client.open_point_in_time(index=settings.INDEX_NAME, keep_alive=self.pit_keep_alive)
+        except (AttributeError, TransportError) as te:
+            logger.warning("Unable to open point-in-time for OAI-PMH harvest: {}".format(te))
+            return None
+        return response.get('id')
+
+    def close_point_in_time(self):
+        if not self.pit_id:
+            return
+        try:
+            self.client.close_point_in_time(body={'id': self.pit_id})
+        except (AttributeError, TransportError) as te:
+            logger.debug("Unable to close point-in-time {}: {}".format(self.pit_id, te))
+        self.pit_id = None
+
     def create_filters_from_token(self, token):
-        token = decodeToken(token)
-        filters = dict([entry.strip().split('=') for entry in token.strip().split("::")])
+        try:
+            token = signing.loads(token.strip(), salt=self.token_salt, max_age=self.token_max_age)
+        except signing.BadSignature:
+            raise OAIException(
+                code="badResumptionToken",
+                message="The value of the resumptionToken argument is invalid or expired."
+            )
+        self.metadataPrefix = token['p']
+        self.cursor = int(token['c'])
+        self.list_size = int(token['n'])
+        self.sort_key = token['s']
+        self.pit_id = token.get('t')
+        filters = token['f']
         filters.update(self.record_access_filter)
-        self.metadataPrefix = filters.pop('prefix')
-        self.list_size = int(filters.pop('list_size'))
-        self.cursor = int(filters.pop('cursor'))
-        self.sort_key = filters.pop('sort_key')
         self.filters = filters
-        fmt = '%Y-%m-%dT%H:%M:%S%z'  # '%Y-%m-%d %H:%M:%S %Z%z'
-        until_date = filters.get('modified__lt')
-        from_date = filters.get('modified__gt')
-        if from_date and ' ' in from_date:
-            from_date=parser.parse(timestr=filters.pop('modified__gt'))
-            filters["modified__gt"] = from_date.strftime(fmt)
-        if until_date and ' ' in until_date:
-            until_date=parser.parse(timestr=filters.pop('modified__lt'))
-            filters["modified__lt"] = until_date.strftime(fmt)
-
         return filters
 
     def get_query_result(self):
         if not self._es_response:
-            s = self.convert_filters_to_query(self.filters)
-            self._es_response = s.execute()
-
+            if self.sort_key is None and self.list_size is None:
+                self.pit_id = self.open_point_in_time()
+            self._es_query = self.convert_filters_to_query(self.filters)
+            try:
+                self._es_response = self._es_query.execute()
+            except NotFoundError:
+                if not self.pit_id:
+                    raise
+                # the point-in-time has expired, continue the harvest from the sort key on a new one
+                logger.info("OAI-PMH point-in-time expired, reopening at cursor {}".format(self.cursor))
+                self.pit_id = self.open_point_in_time()
+                if not self.pit_id:
+                    self.sort_key = self.sort_key[:len(self.sort_order)]
+                self._es_query = self.convert_filters_to_query(self.filters)
+                self._es_response = self._es_query.execute()
+            # elasticsearch can return a new id for the point-in-time with every response
+            self.pit_id = getattr(self._es_response, 'pit_id', self.pit_id)
         return self._es_response
 
     def get_list_size(self):
         return self.get_query_result().hits.total.value
 
     def get_sort_key(self):
-        return self.get_query_result().hits[-1].meta.sort
+        return list(self.get_query_result().hits[-1].meta.sort)
 
     def generate_resumption_token(self):
-        if self.cursor + self.records_returned >= self.list_size:
+        if self.get_next_cursor() >= self.list_size or len(self.get_query_result().hits) < self.records_returned:
+            self.close_point_in_time()
             return None
-        token_dict = {
-            'prefix': self.metadataPrefix,
-            'cursor': self.get_next_cursor(),
-            'list_size': self.list_size,
-            'sort_key': self.get_sort_key(),
+        filters = dict(self.filters)
+        filters.pop(list(self.record_access_filter.keys())[0], None)
+        token = {
+            'p': self.metadataPrefix,
+            'c': self.get_next_cursor(),
+            'n': self.list_size,
+            's': self.get_sort_key(),
+            't': self.pit_id,
+            'f': filters,
         }
-        token_dict.update(**self.filters)
-        token_dict.pop(list(self.record_access_filter.keys())[0])
-        token = "::".join(["{}={}".format(key, value) for key, value in list(token_dict.items())])
-        token = encodeToken(token)
-        return token
+        return signing.dumps(token, salt=self.token_salt, compress=True)
 
     def get_items(self):
-        if self.get_list_size() == 0:
+        response = self.get_query_result()
+        if not response.hits:
+            self.close_point_in_time()
             return None
-        return ElasticSearchRDFRecord.get_rdf_records_from_query(
-            query=self.convert_filters_to_query(self.filters),
-            response=self.get_query_result()
+        return ElasticSearchRDFRecord.iter_rdf_records_from_query(
+            query=self._es_query,
+            response=response
         )
 
     def sets(self, obj):
@@ -482,7 +580,13 @@ class ElasticSearchOAIProvider(OAIProvider):
             response=response)[0]
 
     def convert_filters_to_query(self, filters):
-        s = Search(using=self.client, index=settings.INDEX_NAME).extra(track_total_hits=True)
+        if self.pit_id:
+            # searches on a point-in-time must not name an index
+            s = Search(using=self.client).extra(pit={'id': self.pit_id, 'keep_alive': self.pit_keep_alive})
+        else:
+            s = Search(using=self.client, index=settings.INDEX_NAME)
+        # the completeListSize is only counted for the first page of a harvest
+        s = s.extra(track_total_hits=self.list_size is None)
         spec = filters.get("dataset__spec", None)
         modified_from = filters.get('modified__gt', None)
         modified_until = filters.get('modified__lt', None)
@@ -500,14 +604,10 @@ class ElasticSearchOAIProvider(OAIProvider):
             s = s.filter("range", **{"system.modified_at": {"gte": modified_from}})
         if modified_until:
             s = s.filter("range", **{"system.modified_at": {"lte": modified_until}})
-        s = s.sort({"system.modified_at": {"order": "asc"}, "_id": {"order": "desc"}})
-        # todo change to scroll
-        # slice_query = s[self.cursor: self.get_next_cursor()]
-        # TODO retrieve this from the resumption token
+        s = s.sort(*self.sort_order)
         slice_query = s.extra(size=self.records_returned)
-        if 'resumptionToken' in self.request.GET:
-            slice_query = slice_query.extra(**self.get_next_search_cursor())
-        print(slice_query.to_dict())
+        if self.sort_key:
+            slice_query = slice_query.extra(search_after=self.sort_key)
         return slice_query
 
     def get_dataset_list(self):
@@ -553,33 +653,191 @@ class DjangoOAIProvider(OAIProvider):
         return obj.modified
 
 
-HarvestStep = namedtuple('HarvestStep', ['records_returned', 'total_records', 'resumption_token', 'records'])
-HarvestRequest = namedtuple('HarvestRequest', ['base_url', 'set_spec', 'metadata_prefix', 'verb'])
+OAI_NS = '{http://www.openarchives.org/OAI/2.0/}'
+
+DAY_GRANULARITY = 'YYYY-MM-DD'
+SECOND_GRANULARITY = 'YYYY-MM-DDThh:mm:ssZ'
+
+HarvestStep = namedtuple('HarvestStep', ['records_returned', 'total_records', 'resumption_token', 'list_size'])
+HarvestRequest = namedtuple('HarvestRequest', ['base_url', 'set_spec', 'metadata_prefix', 'verb', 'from_date',
+                                               'until_date'])
+
+
+class OAIHarvestError(Exception):
+    pass
+
+
+def get_harvest_session():
+    """Return a keep-alive session that retries failed and throttled (503) OAI-PMH requests."""
+    session = requests.Session()
+    retry = Retry(
+        total=getattr(settings, "OAI_HARVEST_RETRIES", 5),
+        backoff_factor=getattr(settings, "OAI_HARVEST_BACKOFF", 1),
+        status_forcelist=[500, 502, 503, 504],
+    )
+    adapter = HTTPAdapter(max_retries=retry, pool_maxsize=getattr(settings, "OAI_HARVEST_WORKERS", 4))
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    return session
+
+
+def parse_datestamp(value):
+    """Parse an OAI-PMH datestamp to a naive UTC datetime, datestamps without offset are UTC."""
+    datestamp = parser.parse(value)
+    if datestamp.tzinfo is not None:
+        datestamp = datestamp.astimezone(tzutc()).replace(tzinfo=None)
+    return datestamp
+
+
+def split_date_range(from_date, until_date, slices, granularity=SECOND_GRANULARITY):
+    """Split the inclusive from/until range in consecutive, non overlapping (from, until) OAI-PMH datestamps.
+
+    :param granularity: the datestamp granularity of the repository, with DAY_GRANULARITY the slices are whole days
+    """
+    start = parse_datestamp(from_date)
+    end = parse_datestamp(until_date) if until_date else datetime.utcnow().replace(microsecond=0)
+    if granularity == DAY_GRANULARITY:
+        fmt = '%Y-%m-%d'
+        unit = timedelta(days=1)
+        start = start.replace(hour=0, minute=0, second=0, microsecond=0)
+        end = end.replace(hour=0, minute=0, second=0, microsecond=0)
+    else:
+        fmt = '%Y-%m-%dT%H:%M:%SZ'
+        unit = timedelta(seconds=1)
+        start = start.replace(microsecond=0)
+        end = end.replace(microsecond=0)
+    if slices <= 1 or end <= start:
+        return [(start.strftime(fmt), end.strftime(fmt))]
+    end += unit
+    units = (end - start) // unit
+    slices = min(slices, units)
+    bounds = [start + unit * (units * i // slices) for i in range(slices)] + [end]
+    return [
+        (lower.strftime(fmt), (upper - unit).strftime(fmt))
+        for lower, upper in zip(bounds, bounds[1:]) if upper > lower
+    ]
+
+
+class HarvestCheckpoint:
+    """The resumption token and output position of a harvest, stored next to the output files.
+
+    The checkpoint is written after every page, so an interrupted harvest continues with the
+    page after the last one that was written to disk. The checkpoints of a run are removed when
+    all its slices are complete, so the next run starts a new harvest.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.reset()
+        if os.path.exists(path):
+            with open(path) as f:
+                self.state.update(json.load(f))
+
+    @property
+    def started(self):
+        return self.state['records'] > 0 or self.state['resumption_token'] is not None
+
+    def reset(self):
+        """Replace the state with the state of a harvest that has not started."""
+        self.state = {'resumption_token': None, 'records': 0, 'file_index': 0, 'offset': 0, 'done': False}
+
+    def save(self, **state):
+        self.state.update(state)
+        tmp_path = "{}.tmp".format(self.path)
+        with open(tmp_path, 'w') as f:
+            json.dump(self.state, f)
+        os.replace(tmp_path, self.path)
+
+    def remove(self):
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+
+class RotatingRecordWriter:
+    """Append serialized OAI-PMH records to a series of files with at most records_per_file records each."""
+
+    root_tag = "delving-records"
+
+    def __init__(self, path_template, records_per_file, file_index=0, offset=0, records_in_file=0):
+        self.path_template = path_template
+        self.records_per_file = records_per_file
+        self.file_index = file_index
+        self.records_in_file = records_in_file
+        self.paths = []
+        self._file = None
+        self._open(offset)
+
+    @property
+    def path(self):
+        return self.path_template.format(self.file_index)
+
+    @property
+    def offset(self):
+        return self._file.tell()
+
+    def _open(self, offset=0):
+        if offset and os.path.exists(self.path):
+            # drop everything written after the last checkpoint
+            self._file = open(self.path, 'r+b')
+            self._file.truncate(offset)
+            self._file.seek(offset)
+        else:
+            self._file = open(self.path, 'wb')
+            self._file.write('<?xml version="1.0" encoding="UTF-8"?>\n<{}>\n'.format(self.root_tag).encode('utf-8'))
+            self.records_in_file = 0
+        self.paths.append(self.path)
+
+    def _close_file(self):
+        self._file.write('</{}>\n'.format(self.root_tag).encode('utf-8'))
+        self._file.close()
+
+    def write(self, record):
+        if self.records_in_file >= self.records_per_file:
+            self._close_file()
+            self.file_index += 1
+            self._open()
+        self._file.write(ET.tostring(record, encoding='utf-8', with_tail=False))
+        self._file.write(b"\n")
+        self.records_in_file += 1
+
+    def flush(self):
+        self._file.flush()
+        os.fsync(self._file.fileno())
 
+    def close(self):
+        if self._file and not self._file.closed:
+            self._close_file()
 
 
 class OAIHarvester:
+    """Harvest an OAI-PMH endpoint to rotating xml files on disk.
 
-    def __init__(self, base_url):
-        self.base_url = base_url
+    Each page is appended to the current output file and checkpointed, so a harvest that is
+    interrupted resumes from the last resumption token. With slices > 1 the from/until range is
+    split and the date slices are harvested in parallel.
+    """
 
-    @staticmethod
-    def get_next_oai_pmh_uri(harvest_request, harvest_step):
-        uri = ""
-        if harvest_step.total_records is 0:
-            uri = "{0}?verb={1}".format(harvest_request.base_url, harvest_request.verb)
-            if harvest_request.set_spec is not "":
-                uri += "&set={}".format(harvest_request.set_spec)
-            if harvest_request.metadata_prefix is not "":
-                uri += "&metadataPrefix={}".format(harvest_request.metadata_prefix)
-        else:
-            uri = "{}?verb={}&resumptionToken={}".format(
-                harvest_request.base_url,
-                harvest_request.verb,
-                harvest_step.resumptionToken.encode("utf-8"),
-            )
-        return uri
+    def __init__(self, base_url, output_dir=None, records_per_file=None, session=None, timeout=None):
+        self.base_url = base_url.rstrip("?")
+        self.output_dir = output_dir or getattr(settings, "OAI_HARVEST_OUTPUT_DIR", "/tmp")
+        self.records_per_file = records_per_file or getattr(settings, "OAI_HARVEST_RECORDS_PER_FILE", 10000)
+        self.timeout = timeout or getattr(settings, "OAI_HARVEST_TIMEOUT", 60)
+        self.session = session or get_harvest_session()
 
+    @staticmethod
+    def get_request_params(harvest_request, resumption_token=None):
+        if resumption_token:
+            return {'verb': harvest_request.verb, 'resumptionToken': resumption_token}
+        params = {'verb': harvest_request.verb}
+        if harvest_request.set_spec:
+            params['set'] = harvest_request.set_spec
+        if harvest_request.metadata_prefix:
+            params['metadataPrefix'] = harvest_request.metadata_prefix
+        if harvest_request.from_date:
+            params['from'] = harvest_request.from_date
+        if harvest_request.until_date:
+            params['until'] = harvest_request.until_date
+        return params
 
     @staticmethod
     def clean_bad_namespaces(tn):
@@ -598,42 +856,136 @@ class OAIHarvester:
         clean_response = clean_response.replace('<?xml version="1.0" encoding="UTF-8"?>', '')
         return clean_response
 
-    def parse_oai_pmh_response(self, harvest_request, harvest_step):
+    def fetch_page(self, harvest_request, resumption_token=None):
+        response = self.session.get(
+            self.base_url,
+            params=self.get_request_params(harvest_request, resumption_token),
+            timeout=self.timeout
+        )
+        response.raise_for_status()
+        return ET.fromstring(self.clean_response(response.text))
+
+    def get_granularity(self):
+        """Return the datestamp granularity that the repository reports in Identify."""
+        response = self.session.get(self.base_url, params={'verb': 'Identify'}, timeout=self.timeout)
+        response.raise_for_status()
+        tree = ET.fromstring(self.clean_response(response.text))
+        granularity = next(tree.iter('{}granularity'.format(OAI_NS)), None)
+        if granularity is None or not granularity.text:
+            return SECOND_GRANULARITY
+        return granularity.text.strip()
+
+    def parse_oai_pmh_response(self, harvest_request, harvest_step, writer):
+        record_tree = self.fetch_page(harvest_request, harvest_step.resumption_token)
+        error = next(record_tree.iter('{}error'.format(OAI_NS)), None)
+        if error is not None:
+            if error.get('code') == 'noRecordsMatch':
+                return HarvestStep(0, harvest_step.total_records, None, 0)
+            raise OAIHarvestError("{}: {}".format(error.get('code'), error.text))
+        record_sep = '{}record'.format(OAI_NS) if harvest_request.verb == "ListRecords" \
+            else '{}header'.format(OAI_NS)
         records_processed = 0
-        uri = self.get_next_oai_pmh_uri(harvest_request, harvest_step)
-        response = requests.get(uri)
-        print("'{}'".format(uri))
-        resumption_token = None
-        record_tree = ET.fromstring(self.clean_response(response.text))
-        record_sep = '{http://www.openarchives.org/OAI/2.0/}record' if harvest_request.verb == "ListRecords" \
-            else '{http://www.openarchives.org/OAI/2.0/}header'
         for record in record_tree.iter(record_sep):
-            harvest_step.records.append(record)
+            writer.write(record)
             records_processed += 1
-        token =  next(record_tree.iter('{http://www.openarchives.org/OAI/2.0/}resumptionToken'), None)
-        if token.text is not None:
-            resumption_token = token.text.strip()
-            cursor = token.attrib.get('cursor')
-            list_size = token.attrib.get('completeListSize')
-        if records_processed == 0:
-            with open('/tmp/test_output.xml', 'w') as f:
-                f.write(response.text)
-        print("token: {}/{}".format(resumption_token, records_processed))
+        resumption_token = None
+        list_size = harvest_step.list_size
+        token = next(record_tree.iter('{}resumptionToken'.format(OAI_NS)), None)
+        if token is not None:
+            if token.text and token.text.strip():
+                resumption_token = token.text.strip()
+            list_size = token.attrib.get('completeListSize', list_size)
         return HarvestStep(
             records_processed,
             harvest_step.total_records + records_processed,
             resumption_token,
-            harvest_step.records
+            list_size
         )
 
-    def get_records_from_oai_pmh(self, set_spec, metadata_prefix, verb="ListRecords"):
-        harvest_step = HarvestStep(50, 0, "fake_token", ET.Element("delving-records"))
-        harvest_request = HarvestRequest(self.base_url.rstrip("?"), set_spec, metadata_prefix, verb)
-        print(harvest_request)
-        while harvest_step.resumption_token is not None:
-            harvest_step = self.parse_oai_pmh_response(harvest_request, harvest_step)
-        tree = ET.ElementTree(harvest_step.records)
-        output_file = os.path.join('/tmp', 'oai_records_{}_{}.xml'.format(set_spec, metadata_prefix))
-        tree.write(output_file, encoding="utf-8", xml_declaration=True, pretty_print=True)
-        print("processed {} records".format(harvest_step.total_records))
-        return output_file
+    def get_checkpoint(self, name):
+        return HarvestCheckpoint(os.path.join(self.output_dir, "{}.checkpoint.json".format(name)))
+
+    def harvest_slice(self, harvest_request, name, restart=False):
+        """Harvest one request to the files of name and return their paths."""
+        path_template = os.path.join(self.output_dir, "{}_{{:04d}}.xml".format(name))
+        checkpoint = self.get_checkpoint(name)
+        if restart:
+            checkpoint.reset()
+        if checkpoint.state['done']:
+            # a slice of an interrupted run that was completed before the interruption
+            logger.info("Harvest {} is already complete".format(name))
+            return checkpoint.state.get('paths', [])
+        state = checkpoint.state
+        writer = RotatingRecordWriter(
+            path_template,
+            self.records_per_file,
+            file_index=state['file_index'],
+            offset=state['offset'],
+            records_in_file=state.get('records_in_file', 0)
+        )
+        paths = list(state.get('paths', []))
+        harvest_step = HarvestStep(0, state['records'], state['resumption_token'], state.get('list_size'))
+        if checkpoint.started:
+            logger.info("Resuming harvest {} after {} records".format(name, harvest_step.total_records))
+        try:
+            while True:
+                harvest_step = self.parse_oai_pmh_response(harvest_request, harvest_step, writer)
+                writer.flush()
+                offset = writer.offset
+                done = harvest_step.resumption_token is None
+                if done:
+                    writer.close()
+                paths += [path for path in writer.paths if path not in paths]
+                # the last page and the completion are saved at once, a rerun never fetches page 1 again
+                checkpoint.save(
+                    resumption_token=harvest_step.resumption_token,
+                    records=harvest_step.total_records,
+                    list_size=harvest_step.list_size,
+                    file_index=writer.file_index,
+                    offset=offset,
+                    records_in_file=writer.records_in_file,
+                    paths=paths,
+                    done=done
+                )
+                logger.info("Harvest {}: {}/{} records".format(
+                    name, harvest_step.total_records, harvest_step.list_size or '?')
+                )
+                if harvest_step.resumption_token is None:
+                    break
+        finally:
+            writer.close()
+        return paths
+
+    def get_records_from_oai_pmh(self, set_spec, metadata_prefix, verb="ListRecords", from_date=None,
+                                 until_date=None, slices=1, workers=None, restart=False):
+        """Harvest the set and return the list of written files.
+
+        :param slices: split the from/until range into this many date ranges that are harvested in parallel
+        :param restart: ignore the checkpoints of earlier runs
+        """
+        os.makedirs(self.output_dir, exist_ok=True)
+        # the checkpoints are only resumed by a run with the same request
+        run_key = hashlib.md5(
+            repr((self.base_url, verb, from_date, until_date, slices)).encode('utf-8')
+        ).hexdigest()[:12]
+        name = 'oai_records_{}_{}_{}'.format(set_spec, metadata_prefix, run_key)
+        if slices > 1 and from_date:
+            date_ranges = split_date_range(from_date, until_date, slices, self.get_granularity())
+        else:
+            date_ranges = [(from_date, until_date)]
+        jobs = [
+            (
+                HarvestRequest(self.base_url, set_spec, metadata_prefix, verb, from_, until),
+                name if len(date_ranges) == 1 else "{}_{:03d}".format(name, i)
+            )
+            for i, (from_, until) in enumerate(date_ranges)
+        ]
+        workers = workers or getattr(settings, "OAI_HARVEST_WORKERS", 4)
+        output_files = []
+        with ThreadPoolExecutor(max_workers=min(workers, len(jobs))) as executor:
+            futures = [executor.submit(self.harvest_slice, request, job_name, restart) for request, job_name in jobs]
+            for future in futures:
+                output_files.extend(future.result())
+        for request, job_name in jobs:
+            self.get_checkpoint(job_name).remove()
+        return output_files
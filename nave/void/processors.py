@@ -11,8 +11,11 @@ from rdflib.namespace import RDF
 from rdflib.plugins.parsers.ntriples import ParseError
 
 from nave.lod.utils import rdfstore
+from nave.lod.utils.graph_cache import graph_cache
 from nave.lod.utils.resolver import RDFRecord
 from nave.search.connector import get_es_client
+from nave.search.geo_cluster import invalidate_cluster_tiles
+from nave.search.result_cache import invalidate_search_results
 from nave.void.models import DataSet
 
 from nave.lod import tasks
@@ -295,18 +298,27 @@ class BulkApiProcessor:
         sparql_updates = [sparql_update for k, sparql_update in self.sparql_update_queries.items() if k in new_records]
         return es_actions, sparql_updates
 
+    @staticmethod
+    def get_action_specs(es_actions):
+        """Return the specs of the index actions, None stands for actions without a spec."""
+        specs = set()
+        for es_action in es_actions:
+            spec_values = es_action.get('_source', {}).get('delving_spec') or [{}]
+            specs.add(spec_values[0].get('raw'))
+        return specs
+
     def process(self):
         for i, action in enumerate(self.api_requests):
             self._process_action(action)
         if self.es_actions:
             es_actions, sparql_updates = self.diff_by_content_hash()
             self.bulk_index(es_actions)
-            # if sparql_updates and settings.RDF_STORE_TRIPLES:
-                # tasks.process_sparql_updates.apply_async(
-                    # (sparql_updates, None),
-                    # routing_key=settings.RECORD_QUEUE,
-                    # queue=settings.RECORD_QUEUE
-                # )
+            if es_actions:
+                invalidate_cluster_tiles()
+                for spec in self.get_action_specs(es_actions):
+                    invalidate_search_results(spec)
+            if sparql_updates and settings.RDF_STORE_TRIPLES:
+                self.store_sparql_updates(sparql_updates)
 
         logger.info("Done Processing with {} graphs from {}.".format(self.records_stored, len(self.api_requests)))
         return self._processing_statistics()
@@ -322,6 +334,16 @@ class BulkApiProcessor:
             return False
         return False
 
+    def store_sparql_updates(self, sparql_updates):
+        with rdfstore.SparqlUpdateWriter(store=self.store) as writer:
+            writer.extend(sparql_updates)
+        if writer.stats['failed_batches']:
+            self.store_errors.append(
+                "Unable to store {} SPARQL updates".format(writer.stats['failed_updates'])
+            )
+            return False
+        return True
+
     @staticmethod
     def synchronise_dataset_metadata(store, dataset_graph_uri):
         """Synchronise the metadata of the dataset between Narthex and Nave."""
@@ -339,14 +361,17 @@ class BulkApiProcessor:
                 purge_date = action.get('modification_date')
                 if purge_date:
                     orphans_removed = RDFRecord.remove_orphans(spec=self.spec, timestamp=purge_date)
+                    graph_cache.invalidate_spec(self.spec)
                     logger.info("Deleted {} orphans for {} before {}".format(orphans_removed, self.spec, purge_date))
                     # print("Deleted {} orphans for {} before {}".format(orphans_removed, self.spec, purge_date))
             elif process_verb in ['disable_index']:
                 RDFRecord.delete_from_index(self.spec)
+                graph_cache.invalidate_spec(self.spec)
                 logger.info("Deleted dataset {} from index. ".format(self.spec))
                 # print("Deleted dataset {} from index. ".format(self.spec))
             elif process_verb in ['drop_dataset']:
                 RDFRecord.delete_from_index(self.spec)
+                graph_cache.invalidate_spec(self.spec)
                 DataSet.objects.filter(spec=self.spec).delete()
                 logger.info("Deleted dataset {} from index. ".format(self.spec))
                 # print("Deleted dataset {} from index. ".format(self.spec))
@@ -371,6 +396,7 @@ class BulkApiProcessor:
                     logger.error(e, action)
                     return None
                 self.records_stored += 1
+                graph_cache.invalidate(record.hub_id)
                 self.es_actions[(record.hub_id, content_hash)] = record.create_es_action(
                         action=process_verb,
                         store=self.store,
@@ -3,9 +3,14 @@
 
 
 """
+import gzip
+import os
+
+import pytest
 from django.test import RequestFactory
+from lxml import etree
 
-from nave.void.oaipmh import OAIProvider
+from nave.void.oaipmh import OAIProvider, ElasticSearchOAIProvider, OAIException, OAIHarvester, split_date_range
 
 rf = RequestFactory()
 
@@ -46,3 +51,176 @@ def test_generate_filters_from_token():
     assert provider.list_size == 4432
     assert len(provider.filters) == 4
 
+
+
+def _es_response(hits):
+    from elasticsearch_dsl import Search
+    from elasticsearch_dsl.response import Response
+    return Response(Search(), {
+        'pit_id': 'pit-2',
+        'hits': {'total': {'value': 250, 'relation': 'eq'}, 'hits': hits}
+    })
+
+
+def test_es_resumption_token_round_trip():
+    provider = ElasticSearchOAIProvider()
+    provider.metadataPrefix = "edm"
+    provider.list_size = 250
+    provider.pit_id = 'pit-1'
+    provider.filters = {'dataset__spec': 'ton-smits-huis', 'dataset__oai_pmh': 'public'}
+    hits = [{'_id': str(i), '_source': {}, 'sort': [1420070400000 + i, str(i)]} for i in range(100)]
+    provider._es_response = _es_response(hits)
+    provider.pit_id = getattr(provider._es_response, 'pit_id')
+    token = provider.generate_resumption_token()
+    assert token
+
+    resumed = ElasticSearchOAIProvider()
+    resumed.create_filters_from_token(token)
+    assert resumed.metadataPrefix == "edm"
+    assert resumed.cursor == 100
+    assert resumed.list_size == 250
+    assert resumed.sort_key == [1420070400099, '99']
+    assert resumed.pit_id == 'pit-2'
+    assert resumed.filters['dataset__spec'] == 'ton-smits-huis'
+    assert 'dataset__oai_pmh' in resumed.filters
+
+
+def test_es_resumption_token_is_signed():
+    provider = ElasticSearchOAIProvider()
+    with pytest.raises(OAIException) as exc:
+        provider.create_filters_from_token("prefix=edm::cursor=100::list_size=4432::sort_key=[1, 'a']")
+    assert exc.value.code == "badResumptionToken"
+
+
+def _stream_identifiers(request, gzip_enabled=False):
+    provider = OAIProvider()
+    provider._setup_request(request)
+    provider.gzip = gzip_enabled
+    headers = iter([
+        {'identifier': 'spec_{}'.format(i), 'last_modified': '2015-01-01T00:00:00Z', 'sets': ['spec']}
+        for i in range(3)
+    ])
+    return provider.stream_to_response('ListIdentifiers', headers, "oaipmh/header.xml")
+
+
+def test_stream_to_response():
+    response = _stream_identifiers(_request({'verb': 'ListIdentifiers'}))
+    assert response.streaming
+    tree = etree.fromstring(b"".join(response.streaming_content))
+    ns = {'oai': 'http://www.openarchives.org/OAI/2.0/'}
+    identifiers = tree.xpath('//oai:ListIdentifiers/oai:header/oai:identifier/text()', namespaces=ns)
+    assert identifiers == ['spec_0', 'spec_1', 'spec_2']
+
+
+def test_stream_to_response_gzip():
+    request = rf.get('api/oai-pmh', {'verb': 'ListIdentifiers'}, HTTP_ACCEPT_ENCODING='gzip, deflate')
+    response = _stream_identifiers(request, gzip_enabled=True)
+    assert response['Content-Encoding'] == 'gzip'
+    content = gzip.decompress(b"".join(response.streaming_content))
+    assert content.count(b"<header>") == 3
+
+
+OAI_PAGE = """<?xml version="1.0" encoding="UTF-8"?>
+<OAI-PMH xmlns="http://www.openarchives.org/OAI/2.0/">
+  <ListRecords>
+    {records}
+    <resumptionToken completeListSize="4" cursor="0">{token}</resumptionToken>
+  </ListRecords>
+</OAI-PMH>"""
+
+
+def serve_pages(session, pages, fail_at=None):
+    """Answer the requests of the fake session with the OAI-PMH pages by resumption token."""
+    session.requests = []
+
+    def respond(method, url, params=None, **kwargs):
+        if fail_at is not None and len(session.requests) == fail_at:
+            return IOError("connection lost")
+        records, next_token = pages[params.get('resumptionToken', '0')]
+        return session.response(OAI_PAGE.format(
+            records="".join("<record><header><identifier>{}</identifier></header></record>".format(r)
+                            for r in records),
+            token=next_token
+        ))
+
+    session.respond = respond
+    return session
+
+
+def requested_params(session):
+    return [kwargs['params'] for method, url, kwargs in session.requests]
+
+
+HARVEST_PAGES = {'0': (['a', 'b'], 'page-2'), 'page-2': (['c', 'd'], '')}
+
+
+def test_split_date_range():
+    ranges = split_date_range('2015-01-01', '2015-01-04T23:59:59Z', 4)
+    assert ranges[0] == ('2015-01-01T00:00:00Z', '2015-01-01T23:59:59Z')
+    assert ranges[-1] == ('2015-01-04T00:00:00Z', '2015-01-04T23:59:59Z')
+    assert len(ranges) == 4
+
+
+def test_split_date_range_converts_offsets_to_utc():
+    ranges = split_date_range('2015-01-01T00:00:00+02:00', '2015-01-02T01:59:59+02:00', 2)
+    assert ranges == [
+        ('2014-12-31T22:00:00Z', '2015-01-01T10:59:59Z'), ('2015-01-01T11:00:00Z', '2015-01-01T23:59:59Z')
+    ]
+
+
+def test_split_date_range_day_granularity():
+    ranges = split_date_range('2015-01-01', '2015-01-10', 3, granularity='YYYY-MM-DD')
+    assert ranges == [('2015-01-01', '2015-01-03'), ('2015-01-04', '2015-01-06'), ('2015-01-07', '2015-01-10')]
+    assert len(split_date_range('2015-01-01', '2015-01-02', 5, granularity='YYYY-MM-DD')) == 2
+
+
+def test_harvester_resumes_from_checkpoint(tmpdir, fake_session):
+    output_dir = str(tmpdir)
+    failing = OAIHarvester('http://example.com/oai', output_dir=output_dir,
+                           session=serve_pages(fake_session, HARVEST_PAGES, 2))
+    with pytest.raises(IOError):
+        failing.get_records_from_oai_pmh('spec', 'edm')
+
+    session = serve_pages(fake_session, HARVEST_PAGES)
+    harvester = OAIHarvester('http://example.com/oai', output_dir=output_dir, session=session)
+    output_files = harvester.get_records_from_oai_pmh('spec', 'edm')
+    assert requested_params(session) == [{'verb': 'ListRecords', 'resumptionToken': 'page-2'}]
+    tree = etree.parse(output_files[0])
+    assert tree.xpath('//oai:identifier/text()', namespaces={'oai': 'http://www.openarchives.org/OAI/2.0/'}) == \
+        ['a', 'b', 'c', 'd']
+
+
+def test_harvester_rotates_files(tmpdir, fake_session):
+    harvester = OAIHarvester('http://example.com/oai', output_dir=str(tmpdir), records_per_file=3,
+                             session=serve_pages(fake_session, HARVEST_PAGES))
+    output_files = harvester.get_records_from_oai_pmh('spec', 'edm')
+    assert len(output_files) == 2
+    assert [len(etree.parse(path).getroot()) for path in output_files] == [3, 1]
+
+
+def test_harvester_starts_a_new_run_after_a_complete_harvest(tmpdir, fake_session):
+    output_dir = str(tmpdir)
+    harvester = OAIHarvester('http://example.com/oai', output_dir=output_dir, session=fake_session)
+    serve_pages(fake_session, HARVEST_PAGES)
+    harvester.get_records_from_oai_pmh('spec', 'edm')
+    serve_pages(fake_session, HARVEST_PAGES)
+    harvester.get_records_from_oai_pmh('spec', 'edm')
+    assert requested_params(fake_session)[0] == {'verb': 'ListRecords', 'set': 'spec', 'metadataPrefix': 'edm'}
+    serve_pages(fake_session, HARVEST_PAGES)
+    output_files = harvester.get_records_from_oai_pmh('spec', 'edm', from_date='2015-01-01')
+    assert requested_params(fake_session)[0]['from'] == '2015-01-01'
+    assert len(output_files) == 1
+    assert not [name for name in os.listdir(output_dir) if name.endswith('.checkpoint.json')]
+
+
+def test_harvester_restart_replaces_the_checkpoint(tmpdir, fake_session):
+    output_dir = str(tmpdir)
+    failing = OAIHarvester('http://example.com/oai', output_dir=output_dir, records_per_file=1,
+                           session=serve_pages(fake_session, HARVEST_PAGES, 2))
+    with pytest.raises(IOError):
+        failing.get_records_from_oai_pmh('spec', 'edm')
+    harvester = OAIHarvester('http://example.com/oai', output_dir=output_dir, records_per_file=10,
+                             session=serve_pages(fake_session, HARVEST_PAGES))
+    output_files = harvester.get_records_from_oai_pmh('spec', 'edm', restart=True)
+    assert len(output_files) == 1
+    assert len(etree.parse(output_files[0]).getroot()) == 4
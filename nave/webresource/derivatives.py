@@ -0,0 +1,380 @@
+"""
+Generation of WebResource derivatives outside of the request.
+
+The derivatives are rendered in a process pool, so decoding large masters does
+not block the web workers. Concurrent requests for the same derivative are
+coalesced:
+
+    * within a process all requests wait on the same future
+    * between processes a lock file next to the derivative marks it as in flight
+
+Derivatives are written to a temporary file in the target directory and renamed
+into place, so a partially written file is never served. This also makes the
+batch pre-generation of a spec resumable: fresh derivatives are skipped, so an
+interrupted run continues where it stopped.
+
+The following settings are Optional
+
+    * WEB_RESOURCE_DERIVATIVE_WORKERS: the size of the process pool, defaults to the number of cores
+    * WEB_RESOURCE_DERIVATIVE_TIMEOUT: the latency budget in seconds a request waits for a derivative
+    * WEB_RESOURCE_DERIVATIVE_LOCK_TIMEOUT: the age in seconds after which a lock file is considered stale
+"""
+import logging
+import math
+import os
+import subprocess
+import threading
+import time
+import uuid
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, TimeoutError
+from concurrent.futures.process import BrokenProcessPool
+from datetime import timedelta
+from itertools import repeat
+
+from django.conf import settings
+from PIL import Image
+
+logger = logging.getLogger(__file__)
+
+# the colors are extracted from a copy that fits within this size
+COLOR_EXTRACTION_SIZE = 256
+
+_executor = None
+_waiters = None
+_executor_lock = threading.Lock()
+_in_flight = {}
+_in_flight_lock = threading.RLock()
+
+
+class DerivativePending(Exception):
+    """Raised when a derivative is still being generated after the latency budget."""
+
+
+def get_executor():
+    """Return the process pool that renders the derivatives."""
+    global _executor, _waiters
+    with _executor_lock:
+        if _executor is None:
+            _executor = ProcessPoolExecutor(
+                max_workers=getattr(settings, "WEB_RESOURCE_DERIVATIVE_WORKERS", None) or os.cpu_count()
+            )
+            _waiters = ThreadPoolExecutor(max_workers=8)
+    return _executor
+
+
+def reset_executor(executor):
+    """Replace the process pool after a worker died, a broken pool refuses all work."""
+    global _executor
+    with _executor_lock:
+        if _executor is executor:
+            _executor = None
+    executor.shutdown(wait=False)
+
+
+def get_temp_path(outfile):
+    """Return a unique temporary path in the directory of outfile that keeps its extension."""
+    path, extension = os.path.splitext(outfile)
+    return "{}.{}.tmp{}".format(path, uuid.uuid4().hex, extension)
+
+
+def write_atomic(outfile, write):
+    """Call write with a temporary path and move the result to outfile."""
+    os.makedirs(os.path.dirname(outfile), exist_ok=True)
+    temp_path = get_temp_path(outfile)
+    try:
+        write(temp_path)
+        os.replace(temp_path, outfile)
+    finally:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+
+
+def get_target_size(size, width, height):
+    """Return the size of an image of size after it is thumbnailed to fit within width x height."""
+    scale = min(width / size[0], height / size[1], 1)
+    return max(1, int(math.ceil(size[0] * scale))), max(1, int(math.ceil(size[1] * scale)))
+
+
+def open_reduced(infile, width, height):
+    """Open infile for decoding at the lowest resolution that still covers width x height.
+
+    JPEG is decoded in draft mode at 1/2, 1/4 or 1/8 scale, JPEG2000 at a reduced
+    resolution level and for pyramid TIFFs the smallest covering level is selected.
+    """
+    im = Image.open(infile)
+    target_width, target_height = get_target_size(im.size, width, height)
+    if im.format == "JPEG":
+        im.draft(im.mode, (target_width, target_height))
+    elif im.format == "JPEG2000":
+        reduce = 0
+        while reduce < 5 and im.size[0] >> (reduce + 1) >= target_width and im.size[1] >> (reduce + 1) >= target_height:
+            reduce += 1
+        if reduce:
+            im.reduce = reduce
+    elif im.format == "TIFF" and getattr(im, "n_frames", 1) > 1:
+        full_width, full_height = im.size
+        level = 0
+        for frame in range(1, im.n_frames):
+            im.seek(frame)
+            frame_width, frame_height = im.size
+            same_aspect = abs(frame_width / frame_height - full_width / full_height) < 0.01
+            if same_aspect and frame_width >= target_width and frame_height >= target_height:
+                level = frame
+        im.seek(level)
+    return im
+
+
+def render_thumbnails(infile, targets):
+    """Create the JPEG thumbnails (outfile, width, height) of infile from a single decode.
+
+    The final size of every thumbnail is computed from the size of the master, which
+    is decoded once at the resolution that covers all of them. The thumbnails are
+    then resized step by step from the largest to the smallest final size.
+    Returns the number of created thumbnails.
+    """
+    start = time.time()
+    if not targets:
+        return 0
+    created = 0
+    try:
+        with Image.open(infile) as master:
+            master_size = master.size
+        sized_targets = sorted(
+            ((outfile, get_target_size(master_size, width, height)) for outfile, width, height in targets),
+            key=lambda target: target[1][0] * target[1][1],
+            reverse=True
+        )
+        im = open_reduced(
+            infile, max(size[0] for _, size in sized_targets), max(size[1] for _, size in sized_targets)
+        )
+        im.load()
+        if im.mode not in ("RGB", "L"):
+            im = im.convert("RGB")
+        for outfile, size in sized_targets:
+            if im.size != size:
+                im = im.resize(size, Image.LANCZOS)
+            write_atomic(outfile, lambda path: im.save(path, "JPEG"))
+            created += 1
+    except Exception as err:
+        # besides IOError PIL raises e.g. DecompressionBombError for sources that can not be decoded
+        logger.error("cannot create thumbnail for {} because of {}".format(infile, err))
+        return created
+    logger.info("Thumbnailed {} => {} in {}".format(
+        infile, ", ".join(target[0] for target in targets), str(timedelta(seconds=time.time() - start))))
+    return created
+
+
+def render_thumbnail(infile, outfile, width, height):
+    """Create the JPEG thumbnail of infile at outfile."""
+    return render_thumbnails(infile, [(outfile, width, height)]) == 1
+
+
+def open_color_image(infile, size=COLOR_EXTRACTION_SIZE):
+    """Return a downscaled copy of infile for the color palette extraction."""
+    im = open_reduced(infile, size, size)
+    im.thumbnail((size, size))
+    return im
+
+
+def render_deepzoom(infile, outfile):
+    """Create an IIPimage server compliant tiled pyramid tiff of infile at outfile."""
+    start = time.time()
+
+    def write(path):
+        subprocess.check_call(
+            ["vips", "im_vips2tiff", infile] + ["{}:deflate,tile:256x256,pyramid".format(path)])
+
+    try:
+        write_atomic(outfile, write)
+    except subprocess.CalledProcessError as err:
+        logger.error("cannot create deepzoom for {} because of {}".format(infile, err))
+        return False
+    logger.info("Deepzoomed {} => {} in {}".format(
+        infile, outfile, str(timedelta(seconds=time.time() - start))))
+    return True
+
+
+def acquire_lock(outfile):
+    """Create the lock file of outfile, return False when another process holds it."""
+    lock_path = "{}.lock".format(outfile)
+    os.makedirs(os.path.dirname(lock_path), exist_ok=True)
+    try:
+        if time.time() - os.path.getmtime(lock_path) > getattr(settings, "WEB_RESOURCE_DERIVATIVE_LOCK_TIMEOUT", 120):
+            logger.warning("Removing stale derivative lock {}".format(lock_path))
+            os.remove(lock_path)
+    except OSError:
+        pass
+    try:
+        os.close(os.open(lock_path, os.O_CREAT | os.O_EXCL | os.O_WRONLY))
+    except FileExistsError:
+        return False
+    return True
+
+
+def release_lock(outfile):
+    try:
+        os.remove("{}.lock".format(outfile))
+    except OSError:
+        pass
+
+
+def wait_for_file(outfile):
+    """Wait until another process has released the lock of outfile and return if it exists."""
+    lock_path = "{}.lock".format(outfile)
+    deadline = time.time() + getattr(settings, "WEB_RESOURCE_DERIVATIVE_LOCK_TIMEOUT", 120)
+    while os.path.exists(lock_path) and not os.path.exists(outfile) and time.time() < deadline:
+        time.sleep(0.1)
+    return os.path.exists(outfile)
+
+
+def _submit(outfile, render, args):
+    executor = get_executor()
+    if not acquire_lock(outfile):
+        return _waiters.submit(wait_for_file, outfile)
+    try:
+        try:
+            future = executor.submit(render, *args)
+        except BrokenProcessPool:
+            logger.error("The derivative process pool is broken, starting a new one")
+            reset_executor(executor)
+            future = get_executor().submit(render, *args)
+    except Exception:
+        release_lock(outfile)
+        raise
+    future.add_done_callback(lambda f: release_lock(outfile))
+    return future
+
+
+def _forget(outfile):
+    with _in_flight_lock:
+        _in_flight.pop(outfile, None)
+
+
+def get_derivative(outfile, render, *args, timeout=None):
+    """Generate outfile once with render(*args) and return if it was created.
+
+    All concurrent requests for outfile wait on the same generation. When it takes
+    longer than timeout seconds DerivativePending is raised, the generation continues
+    in the background.
+    """
+    with _in_flight_lock:
+        future = _in_flight.get(outfile)
+        if future is None:
+            future = _submit(outfile, render, args)
+            _in_flight[outfile] = future
+            future.add_done_callback(lambda f: _forget(outfile))
+    if timeout is None:
+        timeout = getattr(settings, "WEB_RESOURCE_DERIVATIVE_TIMEOUT", 3)
+    try:
+        return future.result(timeout=timeout)
+    except TimeoutError:
+        raise DerivativePending(outfile)
+    except BrokenProcessPool:
+        # a worker died while rendering, e.g. killed on a large source, the next _submit starts a new pool
+        logger.error("The derivative process pool broke while rendering {}".format(outfile))
+        return False
+
+
+def get_configured_sizes():
+    """Return the square thumbnail sizes that are pre-generated for every source."""
+    return sorted({
+        getattr(settings, "WEB_RESOURCE_THUMB_SMALL", 220),
+        getattr(settings, "WEB_RESOURCE_THUMB_LARGE", 500)
+    })
+
+
+def iter_source_paths(source_dir):
+    """Yield the paths of the source images below source_dir in a stable order."""
+    from nave.webresource.webresource import SUPPORTED_IMAGE_EXTENSIONS
+    for root, dirs, files in os.walk(source_dir):
+        dirs.sort()
+        for name in sorted(files):
+            extension = os.path.splitext(name)[1].lower().lstrip('.')
+            if extension in SUPPORTED_IMAGE_EXTENSIONS and ".tmp." not in name:
+                yield os.path.join(root, name)
+
+
+def generate_source_derivatives(spec, path, sizes, deepzoom=False, base_dir=None):
+    """Create the missing or stale derivatives of one source image.
+
+    Returns a Counter with the number of created, skipped and failed derivatives.
+    """
+    from nave.webresource.webresource import WebResource
+    stats = Counter()
+    webresource = WebResource(spec=spec, path=path, base_dir=base_dir)
+
+    def is_fresh(outfile):
+        return os.path.exists(outfile) and not webresource.is_derivative_stale(outfile)
+
+    thumbnails = []
+    for size in sizes:
+        width, height = webresource.get_thumbnail_size(size, size)
+        outfile = webresource.get_thumbnail_path(width, height)
+        if is_fresh(outfile):
+            stats['skipped'] += 1
+        elif not acquire_lock(outfile):
+            stats['locked'] += 1
+        else:
+            thumbnails.append((outfile, width, height))
+    try:
+        created = render_thumbnails(path, thumbnails) if thumbnails else 0
+    except Exception as e:
+        logger.error("cannot create thumbnails for {} because of {}".format(path, e))
+        created = 0
+    finally:
+        for outfile, width, height in thumbnails:
+            release_lock(outfile)
+    stats['created'] += created
+    stats['errors'] += len(thumbnails) - created
+
+    deepzoom_path = webresource.get_deepzoom_path
+    if not deepzoom:
+        pass
+    elif is_fresh(deepzoom_path):
+        stats['skipped'] += 1
+    elif not acquire_lock(deepzoom_path):
+        stats['locked'] += 1
+    else:
+        try:
+            created = render_deepzoom(path, deepzoom_path)
+        except Exception as e:
+            logger.error("cannot create deepzoom for {} because of {}".format(path, e))
+            created = False
+        finally:
+            release_lock(deepzoom_path)
+        stats['created' if created else 'errors'] += 1
+    return +stats
+
+
+def log_throughput(spec, stats, sources, elapsed):
+    message = "Pre-generated derivatives for {} sources of {} in {}: {} ({:.1f} sources/s)".format(
+        sources, spec, str(timedelta(seconds=elapsed)),
+        ", ".join("{} {}".format(count, key) for key, count in sorted(stats.items())),
+        sources / elapsed if elapsed else 0
+    )
+    logger.info(message)
+    return message
+
+
+def pregenerate_spec(spec, deepzoom=False, workers=None, base_dir=None, progress=None, progress_interval=100):
+    """Create the configured derivatives of all source images of spec in parallel processes.
+
+    :param progress: called with the number of processed sources, the total and the stats so far
+    """
+    from nave.webresource.webresource import WebResource, SOURCE_DIR
+    spec_dir = WebResource(spec=spec, base_dir=base_dir).get_spec_dir
+    paths = list(iter_source_paths(os.path.join(spec_dir, SOURCE_DIR)))
+    sizes = get_configured_sizes()
+    stats = Counter()
+    start = time.time()
+    with ProcessPoolExecutor(max_workers=workers or os.cpu_count()) as executor:
+        results = executor.map(
+            generate_source_derivatives, repeat(spec), paths, repeat(sizes), repeat(deepzoom), repeat(base_dir),
+            chunksize=4
+        )
+        for processed, source_stats in enumerate(results, 1):
+            stats.update(source_stats)
+            if progress and processed % progress_interval == 0:
+                progress(processed, len(paths), stats)
+    return stats, len(paths), time.time() - start
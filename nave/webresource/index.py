@@ -0,0 +1,224 @@
+"""
+In memory index of the sources and derivatives of the WebResource spec directories.
+
+Resolving a thumbnail on the filesystem takes several exists, getmtime and glob
+calls, which are slow on network storage. The index records for each spec the
+source files and the derivatives with their modification time, so a thumbnail
+that is known to be fresh is resolved without any filesystem call.
+
+The index of a spec is filled by the scanner and updated when derivatives are
+found or written by the web process. Entries that are missing from the index
+are looked up on the filesystem. A thumbnail is only resolved from the index
+when its entries were observed less than WEB_RESOURCE_INDEX_TTL seconds ago.
+Older entries, like the ones of a scan loaded from WEB_RESOURCE_INDEX_DB, are
+checked on the filesystem again, so changes made by other processes are picked
+up within the TTL. The index is dropped after the TTL as well.
+
+The following settings are Optional
+
+    * WEB_RESOURCE_INDEX_TTL: the time in seconds the index of a spec is used before it is reloaded
+    * WEB_RESOURCE_INDEX_DB: path of a SQLite database where the scanner stores the index, so the
+      web processes can load it instead of starting empty
+"""
+import logging
+import os
+import re
+import sqlite3
+import threading
+import time
+
+from django.conf import settings
+
+logger = logging.getLogger(__file__)
+
+# the extensions that are preferred when a source exists with more than one extension
+SOURCE_EXTENSION_PREFERENCE = ['tif', 'tiff', 'jp2', 'jpg', 'jpeg']
+
+DERIVATIVE_PATTERN = re.compile(r'^(?P<base>.+?)(?:_(?P<width>\d+)x(?P<height>\d+))?\.(?:jpg|tif)$')
+
+_known_spec_dirs = set()
+_indexes = {}
+_indexes_lock = threading.Lock()
+
+
+def is_known_spec_dir(spec_dir):
+    return spec_dir in _known_spec_dirs
+
+
+def add_known_spec_dir(spec_dir):
+    _known_spec_dirs.add(spec_dir)
+
+
+def get_source_rank(path):
+    extension = os.path.splitext(path)[1].lower().lstrip('.')
+    if extension in SOURCE_EXTENSION_PREFERENCE:
+        return SOURCE_EXTENSION_PREFERENCE.index(extension)
+    return len(SOURCE_EXTENSION_PREFERENCE)
+
+
+class SpecIndex(object):
+    """The sources and derivatives of one spec directory with their modification times."""
+
+    def __init__(self, spec_dir):
+        self.spec_dir = spec_dir
+        # source path without extension -> (path, mtime)
+        self.sources = {}
+        # derivative base path -> {size: (path, mtime)}, size is (width, height) or None for deepzoom
+        self.derivatives = {}
+        # path -> the time the source or derivative was observed
+        self.seen_at = {}
+        self.created_at = time.time()
+        self.scanned_at = None
+        self._lock = threading.Lock()
+
+    def add_source(self, path, mtime, seen_at=None):
+        base = os.path.splitext(path)[0]
+        with self._lock:
+            known = self.sources.get(base)
+            if known is None or known[0] == path or get_source_rank(path) < get_source_rank(known[0]):
+                self.sources[base] = (path, mtime)
+                self.seen_at[path] = seen_at if seen_at is not None else time.time()
+
+    def get_source(self, base_path):
+        """Return the (path, mtime) of the source at base_path with any extension or None."""
+        return self.sources.get(os.path.splitext(base_path)[0])
+
+    @staticmethod
+    def parse_derivative_path(path):
+        directory, name = os.path.split(path)
+        match = DERIVATIVE_PATTERN.match(name)
+        if not match:
+            return None, None
+        size = (int(match.group('width')), int(match.group('height'))) if match.group('width') else None
+        return os.path.join(directory, match.group('base')), size
+
+    def add_derivative(self, path, mtime, seen_at=None):
+        base, size = self.parse_derivative_path(path)
+        if base is None:
+            return
+        with self._lock:
+            self.derivatives.setdefault(base, {})[size] = (path, mtime)
+            self.seen_at[path] = seen_at if seen_at is not None else time.time()
+
+    def get_derivative(self, path):
+        base, size = self.parse_derivative_path(path)
+        return self.derivatives.get(base, {}).get(size)
+
+    def get_available_sizes(self, base_path):
+        """Return the thumbnail sizes that exist for the derivative base path."""
+        return sorted(size for size in self.derivatives.get(base_path, {}) if size is not None)
+
+    def remove_derivatives(self, base_path):
+        with self._lock:
+            self.derivatives.pop(base_path, None)
+
+    def is_recent(self, path):
+        """Was the path observed less than WEB_RESOURCE_INDEX_TTL seconds ago."""
+        return time.time() - self.seen_at.get(path, 0) < getattr(settings, "WEB_RESOURCE_INDEX_TTL", 600)
+
+    def is_fresh(self, derivative_path, source_base_path):
+        """Is the derivative recently seen to exist and to be newer than its source."""
+        derivative = self.get_derivative(derivative_path)
+        source = self.get_source(source_base_path)
+        if derivative is None or source is None:
+            return False
+        return derivative[1] >= source[1] and self.is_recent(derivative[0]) and self.is_recent(source[0])
+
+    def _scan_dir(self, directory, add):
+        for root, dirs, files in os.walk(directory):
+            for name in files:
+                if name.endswith('.lock') or '.tmp.' in name or name.endswith('.json'):
+                    continue
+                path = os.path.join(root, name)
+                try:
+                    add(path, os.stat(path).st_mtime)
+                except OSError:
+                    continue
+
+    def scan(self):
+        """Record all sources and derivatives present in the spec directory."""
+        from nave.webresource.webresource import SOURCE_DIR, CACHE_DIR, THUMBNAIL_DIR, DEEPZOOM_DIR
+        start = time.time()
+        self.scanned_at = start
+        for directory in [SOURCE_DIR, CACHE_DIR]:
+            self._scan_dir(os.path.join(self.spec_dir, directory), self.add_source)
+        for directory in [THUMBNAIL_DIR, DEEPZOOM_DIR]:
+            self._scan_dir(os.path.join(self.spec_dir, directory), self.add_derivative)
+        logger.info("Indexed {} sources and {} derivatives of {} in {:.1f}s".format(
+            len(self.sources), sum(len(sizes) for sizes in self.derivatives.values()),
+            self.spec_dir, time.time() - start))
+        return self
+
+    def rows(self):
+        for path, mtime in self.sources.values():
+            yield self.spec_dir, 'source', path, mtime
+        for sizes in self.derivatives.values():
+            for path, mtime in sizes.values():
+                yield self.spec_dir, 'derivative', path, mtime
+
+    def save(self, db_path):
+        """Replace the entries of the spec directory in the SQLite database."""
+        with sqlite3.connect(db_path, timeout=30) as connection:
+            create_table(connection)
+            connection.execute("DELETE FROM webresource_index WHERE spec_dir = ?", (self.spec_dir,))
+            connection.executemany("INSERT INTO webresource_index VALUES (?, ?, ?, ?)", self.rows())
+            connection.execute(
+                "INSERT OR REPLACE INTO webresource_index_scan VALUES (?, ?)",
+                (self.spec_dir, self.scanned_at or self.created_at)
+            )
+
+    def load(self, db_path):
+        """Add the entries of the spec directory from the SQLite database, they count as seen at the scan."""
+        with sqlite3.connect(db_path, timeout=30) as connection:
+            create_table(connection)
+            scan = connection.execute(
+                "SELECT scanned_at FROM webresource_index_scan WHERE spec_dir = ?", (self.spec_dir,)
+            ).fetchone()
+            scanned_at = scan[0] if scan else 0
+            rows = connection.execute(
+                "SELECT kind, path, mtime FROM webresource_index WHERE spec_dir = ?", (self.spec_dir,)
+            )
+            for kind, path, mtime in rows:
+                if kind == 'source':
+                    self.add_source(path, mtime, seen_at=scanned_at)
+                else:
+                    self.add_derivative(path, mtime, seen_at=scanned_at)
+        return self
+
+
+def create_table(connection):
+    connection.execute(
+        "CREATE TABLE IF NOT EXISTS webresource_index (spec_dir TEXT, kind TEXT, path TEXT, mtime REAL)"
+    )
+    connection.execute("CREATE INDEX IF NOT EXISTS webresource_index_spec_dir ON webresource_index (spec_dir)")
+    connection.execute(
+        "CREATE TABLE IF NOT EXISTS webresource_index_scan (spec_dir TEXT PRIMARY KEY, scanned_at REAL)"
+    )
+
+
+def get_spec_index(spec_dir):
+    """Return the index of spec_dir, loaded from WEB_RESOURCE_INDEX_DB when it is configured."""
+    spec_index = _indexes.get(spec_dir)
+    if spec_index is not None and time.time() - spec_index.created_at < getattr(settings, "WEB_RESOURCE_INDEX_TTL", 600):
+        return spec_index
+    with _indexes_lock:
+        spec_index = SpecIndex(spec_dir)
+        db_path = getattr(settings, "WEB_RESOURCE_INDEX_DB", None)
+        if db_path and os.path.exists(db_path):
+            try:
+                spec_index.load(db_path)
+            except sqlite3.Error as e:
+                logger.error("Unable to load the webresource index of {} from {}: {}".format(spec_dir, db_path, e))
+        _indexes[spec_dir] = spec_index
+    return spec_index
+
+
+def scan_spec_dir(spec_dir):
+    """Scan spec_dir, replace its index and store it in WEB_RESOURCE_INDEX_DB when it is configured."""
+    spec_index = SpecIndex(spec_dir).scan()
+    with _indexes_lock:
+        _indexes[spec_dir] = spec_index
+    db_path = getattr(settings, "WEB_RESOURCE_INDEX_DB", None)
+    if db_path:
+        spec_index.save(db_path)
+    return spec_index
@@ -0,0 +1,20 @@
+# coding=utf-8
+"""
+Django command to scan the sources and derivatives of specs into the WebResource index.
+"""
+from django.core.management import BaseCommand
+
+
+class Command(BaseCommand):
+    help = 'Scan the sources and derivatives of specs and store them in WEB_RESOURCE_INDEX_DB.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('spec', nargs='+', help='Spec names to index.')
+
+    def handle(self, *args, **options):
+        from nave.webresource import index
+        from nave.webresource.webresource import WebResource
+        for spec in options['spec']:
+            spec_index = index.scan_spec_dir(WebResource(spec=spec).get_spec_dir)
+            self.stdout.write('Indexed {} sources and {} derivative groups of {}'.format(
+                len(spec_index.sources), len(spec_index.derivatives), spec))
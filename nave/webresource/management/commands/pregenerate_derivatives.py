@@ -0,0 +1,35 @@
+# coding=utf-8
+"""
+Django command to pre-generate the thumbnails and deepzoom pyramids of a spec.
+"""
+from django.core.management import BaseCommand
+
+
+class Command(BaseCommand):
+    help = 'Create the missing or stale thumbnails and deepzoom derivatives of all source images of a spec.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('spec', nargs='+', help='Spec names to pre-generate the derivatives for.')
+        parser.add_argument('--deepzoom', action='store_true', default=False, help='Also create deepzoom pyramids.')
+        parser.add_argument('--workers', type=int, default=None, help='Number of processes, defaults to the cores.')
+        parser.add_argument('--celery', action='store_true', default=False,
+                            help='Schedule the work in chunks on the celery workers.')
+        parser.add_argument('--chunk-size', type=int, default=50, help='Number of sources per celery task.')
+
+    def handle(self, *args, **options):
+        from nave.webresource import derivatives, index, tasks
+        from nave.webresource.webresource import WebResource
+        for spec in options['spec']:
+            if options['celery']:
+                chunks = tasks.pregenerate_derivatives(
+                    spec, deepzoom=options['deepzoom'], chunk_size=options['chunk_size'])
+                self.stdout.write('Scheduled {} chunks for {}'.format(chunks, spec))
+                continue
+
+            def progress(processed, total, stats):
+                self.stdout.write('{}: {}/{} sources, {}'.format(spec, processed, total, dict(stats)))
+
+            stats, sources, elapsed = derivatives.pregenerate_spec(
+                spec, deepzoom=options['deepzoom'], workers=options['workers'], progress=progress)
+            self.stdout.write(derivatives.log_throughput(spec, stats, sources, elapsed))
+            index.scan_spec_dir(WebResource(spec=spec).get_spec_dir)
@@ -0,0 +1,177 @@
+"""
+Bounded caching of remote digital objects for WebResources.
+
+Remote objects are fetched with a pooled keep-alive session in a small thread
+pool, never on the request thread. The request only waits for the fetch within
+the latency budget of the derivatives. The body is streamed to a temporary file
+in the cache directory, aborted when it exceeds the maximum size, and moved into
+place with the extension of its (sniffed) mime-type.
+
+Failed fetches are remembered in the cache with an exponential backoff, so a
+broken or slow remote server is not asked again on every request.
+
+The following settings are Optional
+
+    * WEB_RESOURCE_REMOTE_CONNECT_TIMEOUT: the connect timeout in seconds
+    * WEB_RESOURCE_REMOTE_READ_TIMEOUT: the read timeout in seconds
+    * WEB_RESOURCE_REMOTE_MAX_SIZE: the maximum size in bytes of a remote object
+    * WEB_RESOURCE_REMOTE_WORKERS: the number of concurrent remote fetches per process
+    * WEB_RESOURCE_REMOTE_BACKOFF: the seconds a failed uri is not fetched, doubled for every next failure
+    * WEB_RESOURCE_REMOTE_MAX_BACKOFF: the maximum seconds a failed uri is not fetched
+"""
+import hashlib
+import logging
+import mimetypes
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, TimeoutError
+
+import requests
+from django.conf import settings
+from django.core.cache import cache
+from requests.adapters import HTTPAdapter
+from requests.packages.urllib3.util.retry import Retry
+
+from nave.webresource import derivatives
+
+logger = logging.getLogger(__file__)
+
+CHUNK_SIZE = 64 * 1024
+
+_session = None
+_executor = None
+_lock = threading.Lock()
+_in_flight = {}
+_in_flight_lock = threading.RLock()
+
+
+class RemoteFetchError(Exception):
+    """Raised when a remote digital object can not be cached."""
+
+
+def get_session():
+    """Return the shared keep-alive session for remote digital objects."""
+    global _session
+    with _lock:
+        if _session is None:
+            session = requests.Session()
+            retry = Retry(total=2, backoff_factor=0.5, status_forcelist=[502, 503, 504])
+            adapter = HTTPAdapter(
+                max_retries=retry,
+                pool_connections=16,
+                pool_maxsize=getattr(settings, "WEB_RESOURCE_REMOTE_WORKERS", 4)
+            )
+            session.mount('http://', adapter)
+            session.mount('https://', adapter)
+            _session = session
+    return _session
+
+
+def get_executor():
+    global _executor
+    with _lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=getattr(settings, "WEB_RESOURCE_REMOTE_WORKERS", 4))
+    return _executor
+
+
+def get_failure_key(uri):
+    return "webresource_remote:failure:{}".format(hashlib.sha256(uri.encode('utf-8')).hexdigest())
+
+
+def is_backing_off(uri):
+    """Is the uri failed recently and should not be fetched yet."""
+    failure = cache.get(get_failure_key(uri))
+    return failure is not None and failure['retry_at'] > time.time()
+
+
+def record_failure(uri, reason):
+    key = get_failure_key(uri)
+    failure = cache.get(key) or {'failures': 0}
+    failures = failure['failures'] + 1
+    max_backoff = getattr(settings, "WEB_RESOURCE_REMOTE_MAX_BACKOFF", 86400)
+    backoff = min(getattr(settings, "WEB_RESOURCE_REMOTE_BACKOFF", 300) * 2 ** (failures - 1), max_backoff)
+    cache.set(key, {'failures': failures, 'retry_at': time.time() + backoff, 'reason': reason}, max_backoff * 2)
+    logger.warning("Unable to cache {} ({} failures), retry in {}s: {}".format(uri, failures, backoff, reason))
+
+
+def get_extension(mime_type):
+    extension = mimetypes.guess_extension(mime_type) if mime_type else None
+    if extension in ['.jpe', '.jpeg']:
+        extension = '.jpg'
+    return extension or ''
+
+
+def fetch_remote(uri, base_path, guess_mime_type=None):
+    """Stream the remote uri to base_path with the extension of its mime-type and return the path.
+
+    :param guess_mime_type: called with the downloaded file when the response has no usable Content-Type
+    """
+    max_size = getattr(settings, "WEB_RESOURCE_REMOTE_MAX_SIZE", 50 * 1024 * 1024)
+    timeout = (
+        getattr(settings, "WEB_RESOURCE_REMOTE_CONNECT_TIMEOUT", 5),
+        getattr(settings, "WEB_RESOURCE_REMOTE_READ_TIMEOUT", 30)
+    )
+    os.makedirs(os.path.dirname(base_path), exist_ok=True)
+    temp_path = derivatives.get_temp_path(base_path)
+    try:
+        with get_session().get(uri, stream=True, timeout=timeout) as response:
+            if response.status_code != 200:
+                raise RemoteFetchError("status {}".format(response.status_code))
+            mime_type = response.headers.get('Content-Type', '').split(';')[0].strip().lower()
+            if mime_type == 'text/html':
+                raise RemoteFetchError("HTML pages are not digital objects")
+            if int(response.headers.get('Content-Length') or 0) > max_size:
+                raise RemoteFetchError("size {} exceeds {}".format(response.headers['Content-Length'], max_size))
+            size = 0
+            with open(temp_path, 'wb') as f:
+                for chunk in response.iter_content(chunk_size=CHUNK_SIZE):
+                    size += len(chunk)
+                    if size > max_size:
+                        raise RemoteFetchError("size exceeds {}".format(max_size))
+                    f.write(chunk)
+        if guess_mime_type and (not mime_type or mime_type == 'application/octet-stream'):
+            mime_type, extension = guess_mime_type(temp_path)
+        path = "{}{}".format(base_path, get_extension(mime_type))
+        os.replace(temp_path, path)
+    except requests.RequestException as e:
+        raise RemoteFetchError(str(e))
+    finally:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+    logger.info("Cached {} ({} bytes, {}) => {}".format(uri, size, mime_type, path))
+    return path
+
+
+def _fetch(uri, base_path, guess_mime_type):
+    try:
+        return fetch_remote(uri, base_path, guess_mime_type)
+    except (RemoteFetchError, OSError) as e:
+        record_failure(uri, str(e))
+        return None
+    finally:
+        with _in_flight_lock:
+            _in_flight.pop(uri, None)
+
+
+def cache_remote(uri, base_path, guess_mime_type=None, timeout=None):
+    """Fetch the remote uri in the worker pool and return the cached path, or None when it failed.
+
+    Concurrent requests for the same uri share one fetch. Raises DerivativePending when
+    the fetch takes longer than the timeout, the fetch continues in the background.
+    """
+    if is_backing_off(uri):
+        logger.debug("Not fetching {}, it failed recently".format(uri))
+        return None
+    with _in_flight_lock:
+        future = _in_flight.get(uri)
+        if future is None:
+            future = get_executor().submit(_fetch, uri, base_path, guess_mime_type)
+            _in_flight[uri] = future
+    if timeout is None:
+        timeout = getattr(settings, "WEB_RESOURCE_DERIVATIVE_TIMEOUT", 3)
+    try:
+        return future.result(timeout=timeout)
+    except TimeoutError:
+        raise derivatives.DerivativePending(uri)
@@ -1,5 +1,9 @@
 # coding=utf-8
-from celery import shared_task
+import os
+import time
+from collections import Counter
+
+from celery import shared_task, group
 from celery.task import task
 from celery.utils.log import get_task_logger
 
@@ -36,3 +40,29 @@ def create_deepzoom(uri, spec):
     wr = WebResource(uri=uri, spec=spec)
     if not wr.exists_deepzoom:
         return wr.create_deepzoom()
+
+
+@task()
+def pregenerate_derivatives_chunk(spec, paths, sizes, deepzoom=False):
+    """Create the missing or stale derivatives for a chunk of source images of spec."""
+    from nave.webresource import derivatives
+    stats = Counter()
+    start = time.time()
+    for path in paths:
+        stats.update(derivatives.generate_source_derivatives(spec, path, sizes, deepzoom=deepzoom))
+    derivatives.log_throughput(spec, stats, len(paths), time.time() - start)
+    return dict(stats)
+
+
+@task()
+def pregenerate_derivatives(spec, deepzoom=False, chunk_size=50):
+    """Split the source images of spec in chunks that are processed in parallel by the workers."""
+    from nave.webresource import derivatives
+    from nave.webresource.webresource import WebResource, SOURCE_DIR
+    source_dir = os.path.join(WebResource(spec=spec).get_spec_dir, SOURCE_DIR)
+    paths = list(derivatives.iter_source_paths(source_dir))
+    sizes = derivatives.get_configured_sizes()
+    chunks = [paths[i:i + chunk_size] for i in range(0, len(paths), chunk_size)]
+    group(pregenerate_derivatives_chunk.s(spec, chunk, sizes, deepzoom) for chunk in chunks).apply_async()
+    logger.info("Scheduled derivatives of {} sources of {} in {} chunks".format(len(paths), spec, len(chunks)))
+    return len(chunks)
@@ -0,0 +1,93 @@
+import os
+
+import pytest
+
+from nave.webresource import derivatives
+
+test_image = os.path.join(os.path.dirname(__file__), 'source', 'faceeightyeight.jpg')
+
+
+def test__render_thumbnail__writes_atomically(tmpdir):
+    outfile = os.path.join(str(tmpdir), "thumbnails", "test_220x220.jpg")
+    assert derivatives.render_thumbnail(test_image, outfile, 220, 220)
+    assert os.path.exists(outfile)
+    assert os.listdir(os.path.dirname(outfile)) == ["test_220x220.jpg"]
+
+
+def test__render_thumbnail__missing_source(tmpdir):
+    outfile = os.path.join(str(tmpdir), "test_220x220.jpg")
+    assert not derivatives.render_thumbnail(os.path.join(str(tmpdir), "missing.jpg"), outfile, 220, 220)
+    assert not os.path.exists(outfile)
+
+
+def test__get_derivative__waits_for_other_process(tmpdir, settings):
+    settings.WEB_RESOURCE_DERIVATIVE_LOCK_TIMEOUT = 120
+    outfile = os.path.join(str(tmpdir), "test_220x220.jpg")
+    assert derivatives.acquire_lock(outfile)
+    assert not derivatives.acquire_lock(outfile)
+    with pytest.raises(derivatives.DerivativePending):
+        derivatives.get_derivative(outfile, derivatives.render_thumbnail, test_image, outfile, 220, 220, timeout=0.2)
+    derivatives.render_thumbnail(test_image, outfile, 220, 220)
+    derivatives.release_lock(outfile)
+    assert derivatives.get_derivative(outfile, derivatives.render_thumbnail, test_image, outfile, 220, 220)
+
+
+def test__generate_source_derivatives__skips_fresh(tmpdir):
+    import shutil
+    from nave.webresource.webresource import WebResource, SOURCE_DIR
+    webresource = WebResource(spec="test-spec", base_dir=str(tmpdir))
+    source = os.path.join(webresource.get_spec_dir, SOURCE_DIR, "faceeightyeight.jpg")
+    shutil.copy(test_image, source)
+    assert list(derivatives.iter_source_paths(os.path.dirname(source))) == [source]
+    stats = derivatives.generate_source_derivatives("test-spec", source, [100, 200], base_dir=str(tmpdir))
+    assert stats['created'] == 2
+    stats = derivatives.generate_source_derivatives("test-spec", source, [100, 200], base_dir=str(tmpdir))
+    assert stats['skipped'] == 2 and 'created' not in stats
+
+
+def test__render_thumbnails__single_decode_all_sizes(tmpdir):
+    from PIL import Image
+    master = os.path.join(str(tmpdir), "master.jpg")
+    Image.new("RGB", (2000, 1000), (200, 30, 30)).save(master, "JPEG")
+    reduced = derivatives.open_reduced(master, 220, 220)
+    assert reduced.size == (250, 125)
+    targets = [(os.path.join(str(tmpdir), "small.jpg"), 100, 100), (os.path.join(str(tmpdir), "large.jpg"), 500, 500)]
+    assert derivatives.render_thumbnails(master, targets) == 2
+    assert Image.open(targets[0][0]).size == (100, 50)
+    assert Image.open(targets[1][0]).size == (500, 250)
+    assert max(derivatives.open_color_image(master).size) <= derivatives.COLOR_EXTRACTION_SIZE
+
+
+def test__render_thumbnails__boxes_that_are_not_nested(tmpdir):
+    from PIL import Image
+    master = os.path.join(str(tmpdir), "master.jpg")
+    Image.new("RGB", (1000, 1000), (30, 200, 30)).save(master, "JPEG")
+    targets = [(os.path.join(str(tmpdir), "wide.jpg"), 1000, 100), (os.path.join(str(tmpdir), "square.jpg"), 300, 300)]
+    assert derivatives.render_thumbnails(master, targets) == 2
+    assert Image.open(targets[0][0]).size == (100, 100)
+    assert Image.open(targets[1][0]).size == (300, 300)
+
+
+def test__get_derivative__replaces_a_broken_process_pool(tmpdir, monkeypatch):
+    from concurrent.futures.process import BrokenProcessPool
+
+    class BrokenExecutor:
+        def submit(self, *args, **kwargs):
+            raise BrokenProcessPool("a worker died")
+
+        def shutdown(self, wait=True):
+            pass
+
+    derivatives.get_executor()
+    monkeypatch.setattr(derivatives, "_executor", BrokenExecutor())
+    outfile = os.path.join(str(tmpdir), "test_220x220.jpg")
+    assert derivatives.get_derivative(outfile, derivatives.render_thumbnail, test_image, outfile, 220, 220, timeout=30)
+    assert not isinstance(derivatives._executor, BrokenExecutor)
+
+
+def test__render_thumbnail__decompression_bomb(tmpdir, monkeypatch):
+    from PIL import Image
+    monkeypatch.setattr(Image, "MAX_IMAGE_PIXELS", 10)
+    outfile = os.path.join(str(tmpdir), "test_220x220.jpg")
+    assert not derivatives.render_thumbnail(test_image, outfile, 220, 220)
+    assert not os.path.exists(outfile)
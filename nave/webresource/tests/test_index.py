@@ -0,0 +1,59 @@
+import os
+import shutil
+
+from nave.webresource import index
+from nave.webresource.webresource import WebResource, SOURCE_DIR
+
+spec_name = "test-spec"
+test_image = os.path.join(os.path.dirname(__file__), 'source', 'faceeightyeight.jpg')
+
+
+def test__spec_index__prefers_source_extension():
+    spec_index = index.SpecIndex("/tmp/spec")
+    spec_index.add_source("/tmp/spec/source/123.jpg", 10)
+    spec_index.add_source("/tmp/spec/source/123.tif", 20)
+    spec_index.add_source("/tmp/spec/source/123.png", 30)
+    assert spec_index.get_source("/tmp/spec/source/123.jpg") == ("/tmp/spec/source/123.tif", 20)
+
+
+def test__spec_index__derivative_freshness():
+    spec_index = index.SpecIndex("/tmp/spec")
+    spec_index.add_source("/tmp/spec/source/123.jpg", 10)
+    spec_index.add_derivative("/tmp/spec/derivatives/thumbnails/ab/cd/ef/abcdef_220x220.jpg", 20)
+    spec_index.add_derivative("/tmp/spec/derivatives/thumbnails/ab/cd/ef/abcdef_500x500.jpg", 5)
+    assert spec_index.is_fresh("/tmp/spec/derivatives/thumbnails/ab/cd/ef/abcdef_220x220.jpg", "/tmp/spec/source/123")
+    assert not spec_index.is_fresh("/tmp/spec/derivatives/thumbnails/ab/cd/ef/abcdef_500x500.jpg", "/tmp/spec/source/123")
+    assert spec_index.get_available_sizes("/tmp/spec/derivatives/thumbnails/ab/cd/ef/abcdef") == [(220, 220), (500, 500)]
+
+
+def test__scan_spec_dir__resolves_without_glob(tmpdir, settings, monkeypatch):
+    settings.WEB_RESOURCE_INDEX_DB = os.path.join(str(tmpdir), "index.sqlite")
+    webresource = WebResource(spec=spec_name, base_dir=str(tmpdir), uri="urn:{}/123.jpg".format(spec_name))
+    source = os.path.join(webresource.get_spec_dir, SOURCE_DIR, "123.jpg")
+    shutil.copy(test_image, source)
+    index.scan_spec_dir(webresource.get_spec_dir)
+    loaded = index.SpecIndex(webresource.get_spec_dir).load(settings.WEB_RESOURCE_INDEX_DB)
+    assert loaded.get_source(source)[0] == source
+
+    def fail(*args):
+        raise AssertionError("the indexed source should not be globbed")
+
+    monkeypatch.setattr(WebResource, "get_source_path_matches", fail)
+    assert WebResource(spec=spec_name, base_dir=str(tmpdir), uri="urn:{}/123.jpg".format(spec_name)).uri_to_path == source
+
+
+def test__spec_index__old_scan_entries_are_not_fresh(tmpdir, settings):
+    settings.WEB_RESOURCE_INDEX_TTL = 600
+    db_path = os.path.join(str(tmpdir), "index.sqlite")
+    thumbnail = "/tmp/spec/derivatives/thumbnails/ab/cd/ef/abcdef_220x220.jpg"
+    scanned = index.SpecIndex("/tmp/spec")
+    scanned.add_source("/tmp/spec/source/123.jpg", 10)
+    scanned.add_derivative(thumbnail, 20)
+    scanned.scanned_at = 1000
+    scanned.save(db_path)
+    loaded = index.SpecIndex("/tmp/spec").load(db_path)
+    assert loaded.get_source("/tmp/spec/source/123.jpg") == ("/tmp/spec/source/123.jpg", 10)
+    assert not loaded.is_fresh(thumbnail, "/tmp/spec/source/123")
+    loaded.add_source("/tmp/spec/source/123.jpg", 10)
+    loaded.add_derivative(thumbnail, 20)
+    assert loaded.is_fresh(thumbnail, "/tmp/spec/source/123")
@@ -0,0 +1,45 @@
+import os
+
+import pytest
+
+from nave.webresource import remote
+
+test_image = os.path.join(os.path.dirname(__file__), 'source', 'faceeightyeight.jpg')
+test_uri = "http://example.com/images/123"
+
+
+def test__fetch_remote__streams_with_extension(tmpdir, monkeypatch, fake_session):
+    with open(test_image, 'rb') as f:
+        content = f.read()
+    fake_session.add_response(content, headers={'Content-Type': 'image/jpeg', 'Content-Length': str(len(content))})
+    monkeypatch.setattr(remote, "get_session", lambda: fake_session)
+    base_path = os.path.join(str(tmpdir), "cache", "abc")
+    path = remote.fetch_remote(test_uri, base_path)
+    assert path == "{}.jpg".format(base_path)
+    assert os.listdir(os.path.dirname(base_path)) == ["abc.jpg"]
+    method, url, kwargs = fake_session.requests[0]
+    assert url == test_uri and kwargs['stream'] and kwargs['timeout']
+
+
+def test__fetch_remote__rejects_large_and_html(tmpdir, settings, monkeypatch, fake_session):
+    settings.WEB_RESOURCE_REMOTE_MAX_SIZE = 10
+    base_path = os.path.join(str(tmpdir), "cache", "abc")
+    fake_session.add_response(b"x" * 100)
+    fake_session.add_response(b"<html>", headers={'Content-Type': 'text/html; charset=utf-8'})
+    monkeypatch.setattr(remote, "get_session", lambda: fake_session)
+    with pytest.raises(remote.RemoteFetchError):
+        remote.fetch_remote(test_uri, base_path)
+    with pytest.raises(remote.RemoteFetchError):
+        remote.fetch_remote(test_uri, base_path)
+    assert os.listdir(os.path.dirname(base_path)) == []
+
+
+def test__cache_remote__backs_off_after_failure(tmpdir, monkeypatch, fake_session):
+    fake_session.add_response(status_code=500)
+    monkeypatch.setattr(remote, "get_session", lambda: fake_session)
+    uri = "{}/{}".format(test_uri, tmpdir.basename)
+    base_path = os.path.join(str(tmpdir), "cache", "abc")
+    assert remote.cache_remote(uri, base_path, timeout=5) is None
+    assert remote.is_backing_off(uri)
+    assert remote.cache_remote(uri, base_path, timeout=5) is None
+    assert len(fake_session.requests) == 1
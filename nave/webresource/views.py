@@ -3,9 +3,12 @@ import logging
 
 from django.conf import settings
 from django.core.urlresolvers import reverse
-from django.http import Http404
+from django.http import Http404, HttpResponse, HttpResponseRedirect
+from django.utils.cache import add_never_cache_headers
 from django.views.generic import RedirectView
 
+from .derivatives import DerivativePending
+
 
 logger = logging.getLogger(__file__)
 
@@ -21,6 +24,21 @@ class WebResourceRedirectView(RedirectView):
     permanent = False
     query_string = False
 
+    def get(self, request, *args, **kwargs):
+        """Fall back to the placeholder image or 202 while the derivative is generated."""
+        try:
+            return super(WebResourceRedirectView, self).get(request, *args, **kwargs)
+        except DerivativePending as pending:
+            logger.info("Derivative not ready within the latency budget: {}".format(pending))
+            placeholder = getattr(settings, "WEB_RESOURCE_PLACEHOLDER_URL", None)
+            if placeholder:
+                response = HttpResponseRedirect(placeholder)
+            else:
+                response = HttpResponse("The derivative is being generated", content_type="text/plain", status=202)
+            response['Retry-After'] = getattr(settings, "WEB_RESOURCE_DERIVATIVE_TIMEOUT", 3)
+            add_never_cache_headers(response)
+            return response
+
     def get_redirect_url(self, *args, **kwargs):
         """
         Retrieving the WebResource derivative URIs
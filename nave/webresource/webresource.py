@@ -12,25 +12,19 @@ In addition it will also be able to:
 
 """
 import mimetypes
-import shutil
-import urllib
-from datetime import timedelta
 from glob import glob
 import hashlib
 import json
 import logging
 import os
 import re
-import subprocess
-from urllib.error import HTTPError
 
 import magic
-import time
 from colorific.palette import extract_colors
-from PIL import Image
-import requests
 import webcolors
 
+from nave.webresource import derivatives, index, remote
+
 logger = logging.getLogger(__file__)
 
 SOURCE_DIR = "source"
@@ -154,13 +148,34 @@ class WebResource:
         )
 
     def create_dataset_webresource_dirs(self):
-        """Create all subdirectories for the WebResource based on spec."""
+        """Create all subdirectories for the WebResource based on spec.
+
+        Spec directories that are known to exist in this process are not checked again.
+        """
+        if index.is_known_spec_dir(self.get_spec_dir):
+            return False
+        created = False
         if not self.exist_webresource_dirs:
             for folder in WEB_RESOURCE_DIRS:
                 full_path = os.path.join(self.get_spec_dir, folder)
                 os.makedirs(full_path, exist_ok=True, mode=0o777)
-            return True
-        return False
+            created = True
+        index.add_known_spec_dir(self.get_spec_dir)
+        return created
+
+    @property
+    def spec_index(self):
+        """The index of the sources and derivatives of the spec."""
+        return index.get_spec_index(self.get_spec_dir)
+
+    def index_derivative(self, derivative_path):
+        """Record the derivative and its source in the spec index."""
+        try:
+            source_path = self.get_source_path
+            self.spec_index.add_source(source_path, os.path.getmtime(source_path))
+            self.spec_index.add_derivative(derivative_path, os.path.getmtime(derivative_path))
+        except OSError as e:
+            logger.warn("Unable to index derivative {}: {}".format(derivative_path, e))
 
     def create_deepzoom(self):
         """Create an IIPimage server compliant tiled deepzoom pyramid tiff.
@@ -171,54 +186,31 @@ class WebResource:
             output_image.tif:deflate,tile:256x256,pyramid
 
         """
-        start = time.time()
-        input_file = self.get_source_path
-        output_file = self.get_deepzoom_path
-        os.makedirs(os.path.dirname(output_file), exist_ok=True)
-        created = subprocess.check_call(
-            ["vips", "im_vips2tiff", input_file] +
-            ["{}:deflate,tile:256x256,pyramid".format(output_file)])
-        elapsed = (time.time() - start)
-        logger.info(
-            "Deepzoomed {} => {} in {}".format(
-                input_file,
-                output_file,
-                str(timedelta(seconds=elapsed))
-            )
-        )
-        return True if created == 0 else False
+        return derivatives.render_deepzoom(self.get_source_path, self.get_deepzoom_path)
 
-    def create_thumbnail(self, width, height):
-        """Create the thumbnail derivative of the source digital object."""
+    def get_thumbnail_size(self, width, height):
+        """Limit the requested thumbnail size to WEB_RESOURCE_MAX_SIZE."""
         max_size = getattr(self.settings, 'WEB_RESOURCE_MAX_SIZE', 1000)
         if not isinstance(max_size, int):
             max_size = int(max_size)
         if width > max_size or height > max_size:
             width = height = max_size
-        start = time.time()
-        infile = self.get_source_path
-        outfile = self.get_thumbnail_path(width, height)
-        try:
-            os.makedirs(os.path.dirname(outfile), exist_ok=True)
-            im = Image.open(infile)
-            im.thumbnail((width, height))
-            im.save(outfile, "JPEG")
-            elapsed = (time.time() - start)
-            logger.info(
-                "Thumbnailed {} => {} in {}".format(
-                    infile,
-                    outfile,
-                    str(timedelta(seconds=elapsed))
-                )
-            )
-        except IOError as err:
-            logger.error(
-                "cannot create thumbnail for {} because of {}".format(
-                    infile,
-                    err)
-            )
-            return False
-        return True
+        return width, height
+
+    def create_thumbnail(self, width, height):
+        """Create the thumbnail derivative of the source digital object."""
+        width, height = self.get_thumbnail_size(width, height)
+        return derivatives.render_thumbnail(
+            self.get_source_path, self.get_thumbnail_path(width, height), width, height
+        )
+
+    def create_thumbnails(self, sizes):
+        """Create the thumbnail derivatives for all (width, height) sizes from a single decode of the source."""
+        targets = []
+        for width, height in sizes:
+            width, height = self.get_thumbnail_size(width, height)
+            targets.append((self.get_thumbnail_path(width, height), width, height))
+        return derivatives.render_thumbnails(self.get_source_path, targets) == len(targets)
 
     def get_all_derivatives(self):
         """Get all derivatives and return the paths as a list."""
@@ -236,6 +228,8 @@ class WebResource:
         for path in self.get_all_derivatives():
             if os.path.exists(path):
                 os.remove(path)
+        for kind in [THUMBNAIL_DIR, DEEPZOOM_DIR]:
+            self.spec_index.remove_derivatives(os.path.join(self.get_spec_dir, self.get_derivative_base_path(kind=kind)))
         logger.info("Deleted all derivatives for {}".format(self.uri))
 
     def is_derivative_stale(self, derivative_path):
@@ -325,16 +319,22 @@ class WebResource:
             raise ValueError(mesg)
         return uri
 
+    @property
+    def get_source_base_path(self):
+        """Return the path of the source object as derived from the URI, the extension may differ on disk."""
+        if self.is_cached:
+            return os.path.join(self.get_spec_dir, self.get_derivative_base_path(kind=CACHE_DIR))
+        return os.path.join(self.get_spec_dir, SOURCE_DIR, self.clean_uri)
+
     @property
     def uri_to_path(self):
         """Given the URI give back the path to the WebResource source object."""
-        path = None
-        if self.is_cached:
-            path = os.path.join(self.get_spec_dir,
-                                self.get_derivative_base_path(kind=CACHE_DIR))
+        path = self.get_source_base_path
+        indexed = self.spec_index.get_source(path)
+        if indexed is not None:
+            webresource_path = indexed[0]
         else:
-            path = os.path.join(self.get_spec_dir, SOURCE_DIR, self.clean_uri)
-        webresource_path = self.get_from_source_path(path)
+            webresource_path = self.get_from_source_path(path)
         if webresource_path and not self._source_path:
             self._source_path = webresource_path
         return webresource_path if webresource_path else path
@@ -487,7 +487,10 @@ class WebResource:
                     tasks.create_deepzoom.delay(self._uri, self.spec)
                     uri = None
             else:
-                created = self.create_deepzoom()
+                created = derivatives.get_derivative(
+                    self.get_deepzoom_path, derivatives.render_deepzoom,
+                    self.get_source_path, self.get_deepzoom_path
+                )
                 if created:
                     uri = self.get_deepzoom_uri
                 else:
@@ -508,8 +511,15 @@ class WebResource:
 
     def get_thumbnail_redirect(self, width, height):
         """All processing steps for finding, creating, and redirecting to
-        the thumbnail derivative."""
+        the thumbnail derivative.
+
+        Raises DerivativePending when the thumbnail is not created within the
+        latency budget.
+        """
+        width, height = self.get_thumbnail_size(width, height)
         thumbnail_path = self.get_thumbnail_path(width, height)
+        if self.spec_index.is_fresh(thumbnail_path, self.get_source_base_path):
+            return self.get_thumbnail_uri(width, height)
         if self.is_derivative_stale(thumbnail_path):
             self.remove_all_derivatives()
         if not self.exists_source and self.is_cached:
@@ -517,13 +527,18 @@ class WebResource:
             if not self.exists_source:
                 return None
         if not self.exists_thumbnail(width, height):
-            created = self.create_thumbnail(width, height)
+            created = derivatives.get_derivative(
+                thumbnail_path, derivatives.render_thumbnail,
+                self.get_source_path, thumbnail_path, width, height
+            )
             if created:
                 uri = self.get_thumbnail_uri(width, height)
             else:
                 uri = None
         else:
             uri = self.get_thumbnail_uri(width, height)
+        if uri:
+            self.index_derivative(thumbnail_path)
         return uri
 
     @property
@@ -565,7 +580,7 @@ class WebResource:
         return actual_name, closest_name
 
     def _extract_colors(self):
-        return extract_colors(self.get_source_path)
+        return extract_colors(derivatives.open_color_image(self.get_source_path))
 
     @property
     def get_json_path(self):
@@ -661,10 +676,8 @@ class WebResource:
 
         HTML pages are not considered digital objects in this context.
         """
-        response = requests.get(uri)
-        if response.status == 200:
-            pass
-        # TODO: implement me
+        base_path = os.path.join(self.get_spec_dir, self.get_derivative_base_path(uri=uri, kind=CACHE_DIR))
+        return remote.fetch_remote(uri, base_path, guess_mime_type=self.guess_mime_type)
 
     def guess_mime_type(self, path):
         """Guess the extension and mime-type of the file."""
@@ -678,14 +691,9 @@ class WebResource:
         spec cache directory."""
         if not self.is_cached:
             return
-        try:
-            logger.info("Attempting to cache: {}".format(self.uri))
-            local_filename, headers = urllib.request.urlretrieve(self.uri)
-            mime_type = headers.get('Content-Type')
-            if not mime_type:
-                mime_type, extension = self.guess_mime_type(local_filename)
-            # extension = mimetypes.guess_extension(mime_type)
-            os.makedirs(os.path.dirname(self.get_source_path), exist_ok=True)
-            shutil.move(local_filename, self.get_source_path)
-        except HTTPError as he:
-            logger.error(he.code, he.reason)
+        logger.info("Attempting to cache: {}".format(self.uri))
+        path = remote.cache_remote(self.uri, self.get_source_base_path, guess_mime_type=self.guess_mime_type)
+        if path:
+            self._source_path = path
+            self.spec_index.add_source(path, os.path.getmtime(path))
+        return path